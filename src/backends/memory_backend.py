@@ -0,0 +1,302 @@
+from backends.storage_backend import StorageBackend, apply_projection
+from exceptions.duplicate_user_exception import DuplicateUserException
+
+from collections import defaultdict, deque
+from copy import deepcopy
+from threading import RLock
+from uuid import uuid4
+
+"""
+Stores users in a dict for tests and single-process deployments.
+Nothing survives a restart.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+class MemoryBackend(StorageBackend):
+
+    def __init__(self):
+
+        self.users: dict = {}
+        self.ids_by_name: dict = {}
+        self.pool: defaultdict = defaultdict(deque)
+        self.jobs: dict = {}
+        self.lock: RLock = RLock()
+
+    def ensure_indexes(self) -> None:
+        pass
+
+    def insert(self, item: dict) -> any:
+
+        with self.lock:
+
+            if item["user"] in self.ids_by_name:
+                raise DuplicateUserException(f"User already exists: {item['user']}")
+
+            document: dict = deepcopy(item)
+            document.setdefault("_id", uuid4().hex)
+
+            self.users[document["_id"]] = document
+            self.ids_by_name[document["user"]] = document["_id"]
+
+            return document["_id"]
+
+    def retrieve(self, query: dict, projection: dict = None) -> dict:
+
+        with self.lock:
+
+            if "_id" in query:
+                candidates: list = [self.users.get(query["_id"])]
+            elif "user" in query:
+                candidates: list = [self.users.get(self.ids_by_name.get(query["user"]))]
+            else:
+                candidates: list = list(self.users.values())
+
+            for document in candidates:
+
+                if document and all(document.get(field) == value for field, value in query.items()):
+                    return deepcopy(apply_projection(document, projection))
+
+            return None
+
+    def add_thread(self, user_id: any, thread_id: str) -> None:
+
+        with self.lock:
+
+            if user_id in self.users:
+                self.users[user_id].setdefault("threads", []).append(thread_id)
+
+    def update_chat_history(self, user_id: any, chat_history: list[dict]) -> None:
+
+        with self.lock:
+
+            if user_id in self.users:
+                self.users[user_id]["chat_history"] = deepcopy(chat_history)
+
+    def append_chat_history(self, user_id: any, messages: list[dict]) -> None:
+
+        with self.lock:
+
+            if user_id in self.users:
+                self.users[user_id].setdefault("chat_history", []).extend(deepcopy(messages))
+
+    def get_chat_history(self, user_id: any, limit: int, before: int = None) -> tuple[list[dict], int]:
+
+        with self.lock:
+
+            if user_id not in self.users:
+                return [], 0
+
+            history: list = self.users[user_id].get("chat_history", [])
+            end: int = len(history) if before is None else min(before, len(history))
+            start: int = max(end - limit, 0)
+
+            return deepcopy(history[start:end]), start
+
+    def delete_user(self, user_id: any) -> None:
+
+        with self.lock:
+
+            document: dict = self.users.pop(user_id, None)
+
+            if document:
+                self.ids_by_name.pop(document["user"], None)
+
+    def update_count(self, user_id: any, extra: int, within_limit: bool = False) -> int:
+
+        with self.lock:
+
+            document: dict = self.users.get(user_id)
+
+            if document is None:
+                return None
+
+            if within_limit and document["usage"] + extra > document["limit"]:
+                return None
+
+            document["usage"] += extra
+
+            return document["usage"]
+
+    def record_turn(self, user_id: any, messages: list[dict], extra: int, thread_id: str = None) -> int:
+
+        with self.lock:
+
+            document: dict = self.users.get(user_id)
+
+            if document is None:
+                return None
+
+            document["usage"] += extra
+            document.setdefault("chat_history", []).extend(deepcopy(messages))
+
+            threads: list = document.setdefault("threads", [])
+
+            if thread_id and thread_id not in threads:
+                threads.append(thread_id)
+
+            return document["usage"]
+
+    def set_assistant(self, user_id: any, assistant_id: str) -> None:
+
+        with self.lock:
+
+            if user_id in self.users:
+                self.users[user_id]["assistant_id"] = assistant_id
+
+    def set_password(self, user_id: any, password: bytes) -> None:
+
+        with self.lock:
+
+            if user_id in self.users:
+                self.users[user_id]["password"] = password
+
+    def add_resource(self, kind: str, resource_id: str) -> None:
+
+        with self.lock:
+            self.pool[kind].append(resource_id)
+
+    def take_resource(self, kind: str) -> str:
+
+        with self.lock:
+            return self.pool[kind].popleft() if self.pool[kind] else None
+
+    def remove_resource(self, kind: str, resource_id: str) -> bool:
+
+        with self.lock:
+
+            if resource_id not in self.pool[kind]:
+                return False
+
+            self.pool[kind].remove(resource_id)
+
+            return True
+
+    def count_resources(self, kind: str) -> int:
+
+        with self.lock:
+            return len(self.pool[kind])
+
+    def list_resources(self, kind: str) -> list[str]:
+
+        with self.lock:
+            return list(self.pool[kind])
+
+    def enqueue_job(self, key: str, kind: str, payload: dict, run_at: float) -> None:
+
+        with self.lock:
+
+            job: dict = self.jobs.get(key)
+
+            if job and job["status"] != "failed":
+                return
+
+            self.jobs[key] = {
+                "_id": key,
+                "key": key,
+                "kind": kind,
+                "payload": deepcopy(payload),
+                "status": "pending",
+                "attempts": 0,
+                "run_at": run_at,
+                "lease_until": 0,
+                "owner": None,
+                "error": None,
+                "result": None,
+            }
+
+    def claim_job(self, now: float, lease: float, kinds: list[str], owner: str) -> dict:
+
+        with self.lock:
+
+            due: list = [
+                job for job in self.jobs.values()
+                if job["kind"] in kinds and (
+                    (job["status"] == "pending" and job["run_at"] <= now)
+                    or (job["status"] == "running" and job["lease_until"] <= now)
+                )
+            ]
+
+            if not due:
+                return None
+
+            job: dict = min(due, key=lambda job: job["run_at"])
+            job["status"] = "running"
+            job["lease_until"] = now + lease
+            job["attempts"] += 1
+            job["owner"] = owner
+
+            return deepcopy({field: job[field] for field in ("_id", "key", "kind", "payload", "attempts", "owner")})
+
+    # The job, while the claim still holds it, or whatever its state if no owner is given. Called with the lock held.
+    def held_job(self, job_id: any, owner: str) -> dict:
+
+        job: dict = self.jobs.get(job_id)
+
+        if job is None or (owner is not None and (job["status"] != "running" or job["owner"] != owner)):
+            return None
+
+        return job
+
+    def renew_job(self, job_id: any, owner: str, lease_until: float) -> bool:
+
+        with self.lock:
+
+            job: dict = self.held_job(job_id, owner)
+
+            if job is not None:
+                job["lease_until"] = lease_until
+
+            return job is not None
+
+    def finish_job(self, job_id: any, owner: str = None) -> bool:
+
+        with self.lock:
+            return self.held_job(job_id, owner) is not None and self.jobs.pop(job_id) is not None
+
+    def complete_job(self, job_id: any, result: dict, owner: str) -> bool:
+
+        with self.lock:
+
+            job: dict = self.held_job(job_id, owner)
+
+            if job is not None:
+                job.update(status="done", result=deepcopy(result))
+
+            return job is not None
+
+    def retry_job(self, job_id: any, run_at: float, error: str, owner: str) -> bool:
+
+        with self.lock:
+
+            job: dict = self.held_job(job_id, owner)
+
+            if job is not None:
+                job.update(status="pending", run_at=run_at, error=error)
+
+            return job is not None
+
+    def fail_job(self, job_id: any, error: str, owner: str) -> bool:
+
+        with self.lock:
+
+            job: dict = self.held_job(job_id, owner)
+
+            if job is not None:
+                job.update(status="failed", error=error)
+
+            return job is not None
+
+    def get_job(self, key: str) -> dict:
+
+        with self.lock:
+
+            job: dict = self.jobs.get(key)
+
+            return deepcopy({field: job[field] for field in ("_id", "status", "attempts", "error", "result")}) if job else None
+
+    def count_jobs(self, status: str) -> int:
+
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job["status"] == status)
@@ -0,0 +1,273 @@
+from backends.storage_backend import StorageBackend
+from exceptions.duplicate_user_exception import DuplicateUserException
+from utils.mongo_utils import get_client
+from pymongo.mongo_client import MongoClient
+from pymongo import ReturnDocument, ASCENDING
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+
+from threading import Lock
+
+"""
+Stores users in a MongoDB collection through the process-wide client.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The connection strings whose indexes have already been checked by this process.
+_indexed_uris: set = set()
+_index_lock: Lock = Lock()
+
+class MongoBackend(StorageBackend):
+
+    def __init__(
+        self,
+        uri: str,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        database: str = "demo",
+        collection: str = "users"
+    ):
+
+        self.uri: str = uri
+        self.client: MongoClient = get_client(uri, max_pool_size, min_pool_size)
+        self.collection = self.client[database][collection]
+        self.pool = self.client[database]["pool"]
+        self.jobs = self.client[database]["jobs"]
+
+    def ensure_indexes(self) -> None:
+
+        with _index_lock:
+
+            if self.uri in _indexed_uris:
+                return
+
+            self.collection.create_index([("user", ASCENDING)], unique=True, name="user_unique")
+            self.collection.create_index([("assistant_id", ASCENDING)], name="assistant_id")
+            self.pool.create_index([("kind", ASCENDING), ("_id", ASCENDING)], name="kind")
+            self.jobs.create_index([("key", ASCENDING)], unique=True, name="key_unique")
+            self.jobs.create_index([("status", ASCENDING), ("run_at", ASCENDING)], name="due")
+
+            _indexed_uris.add(self.uri)
+
+    def parse_id(self, value: str) -> any:
+        return ObjectId(value) if ObjectId.is_valid(value) else value
+
+    def insert(self, item: dict) -> any:
+
+        try:
+            return self.collection.insert_one(item).inserted_id
+
+        except DuplicateKeyError as e:
+
+            raise DuplicateUserException(f"User already exists: {e}")
+
+    def retrieve(self, query: dict, projection: dict = None) -> dict:
+        return self.collection.find_one(query, projection)
+
+    def add_thread(self, user_id: any, thread_id: str) -> None:
+
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$push": {"threads": thread_id}}
+        )
+
+    def update_chat_history(self, user_id: any, chat_history: list[dict]) -> None:
+
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {"chat_history": chat_history}}
+        )
+
+    def append_chat_history(self, user_id: any, messages: list[dict]) -> None:
+
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$push": {"chat_history": {"$each": messages}}}
+        )
+
+    def get_chat_history(self, user_id: any, limit: int, before: int = None) -> tuple[list[dict], int]:
+
+        end: any = "$total" if before is None else {"$min": [before, "$total"]}
+
+        pipeline: list[dict] = [
+            {"$match": {"_id": user_id}},
+            {"$project": {"history": {"$ifNull": ["$chat_history", []]}}},
+            {"$project": {"history": 1, "total": {"$size": "$history"}}},
+            {"$project": {"history": 1, "end": end}},
+            {"$project": {
+                "history": 1,
+                "end": 1,
+                "start": {"$max": [{"$subtract": ["$end", limit]}, 0]},
+            }},
+            {"$project": {
+                "start": 1,
+                "page": {"$cond": [
+                    {"$gt": ["$end", "$start"]},
+                    {"$slice": ["$history", "$start", {"$subtract": ["$end", "$start"]}]},
+                    [],
+                ]},
+            }},
+        ]
+
+        result: list[dict] = list(self.collection.aggregate(pipeline))
+
+        if not result:
+            return [], 0
+
+        return result[0]["page"], result[0]["start"]
+
+    def delete_user(self, user_id: any) -> None:
+        self.collection.delete_one({"_id": user_id})
+
+    def update_count(self, user_id: any, extra: int, within_limit: bool = False) -> int:
+
+        query: dict = {"_id": user_id}
+
+        if within_limit:
+            query["$expr"] = {"$lte": [{"$add": ["$usage", extra]}, "$limit"]}
+
+        user: dict = self.collection.find_one_and_update(
+            query,
+            {"$inc": {"usage": extra}},
+            projection={"usage": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+        return user["usage"] if user else None
+
+    def record_turn(self, user_id: any, messages: list[dict], extra: int, thread_id: str = None) -> int:
+
+        update: dict = {
+            "$inc": {"usage": extra},
+            "$push": {"chat_history": {"$each": messages}},
+        }
+
+        if thread_id:
+            update["$addToSet"] = {"threads": thread_id}
+
+        user: dict = self.collection.find_one_and_update(
+            {"_id": user_id},
+            update,
+            projection={"usage": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+        return user["usage"] if user else None
+
+    def set_assistant(self, user_id: any, assistant_id: str) -> None:
+
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {"assistant_id": assistant_id}}
+        )
+
+    def set_password(self, user_id: any, password: bytes) -> None:
+
+        self.collection.update_one(
+            {"_id": user_id},
+            {"$set": {"password": password}}
+        )
+
+    def add_resource(self, kind: str, resource_id: str) -> None:
+        self.pool.insert_one({"kind": kind, "resource_id": resource_id})
+
+    def take_resource(self, kind: str) -> str:
+
+        resource: dict = self.pool.find_one_and_delete({"kind": kind}, sort=[("_id", ASCENDING)])
+
+        return resource["resource_id"] if resource else None
+
+    def remove_resource(self, kind: str, resource_id: str) -> bool:
+        return self.pool.delete_one({"kind": kind, "resource_id": resource_id}).deleted_count > 0
+
+    def count_resources(self, kind: str) -> int:
+        return self.pool.count_documents({"kind": kind})
+
+    def list_resources(self, kind: str) -> list[str]:
+
+        resources = self.pool.find({"kind": kind}, {"resource_id": 1}).sort("_id", ASCENDING)
+
+        return [resource["resource_id"] for resource in resources]
+
+    def enqueue_job(self, key: str, kind: str, payload: dict, run_at: float) -> None:
+
+        # New jobs and jobs that failed for good start over; queued ones are left alone.
+        fresh: dict = {"$eq": [{"$ifNull": ["$status", "failed"]}, "failed"]}
+
+        try:
+            self.jobs.update_one({"key": key}, [{"$set": {
+                "kind": kind,
+                "payload": payload,
+                "status": {"$cond": [fresh, "pending", "$status"]},
+                "attempts": {"$cond": [fresh, 0, "$attempts"]},
+                "run_at": {"$cond": [fresh, run_at, "$run_at"]},
+                "lease_until": {"$cond": [fresh, 0, "$lease_until"]},
+                "owner": {"$cond": [fresh, None, "$owner"]},
+                "error": {"$cond": [fresh, None, "$error"]},
+                "result": {"$cond": [fresh, None, "$result"]},
+            }}], upsert=True)
+
+        except DuplicateKeyError:
+
+            # Someone else queued it at the same moment.
+            pass
+
+    def claim_job(self, now: float, lease: float, kinds: list[str], owner: str) -> dict:
+
+        return self.jobs.find_one_and_update(
+            {"kind": {"$in": kinds}, "$or": [
+                {"status": "pending", "run_at": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lte": now}},
+            ]},
+            {"$set": {"status": "running", "lease_until": now + lease, "owner": owner}, "$inc": {"attempts": 1}},
+            projection={"key": 1, "kind": 1, "payload": 1, "attempts": 1, "owner": 1},
+            sort=[("run_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    # Matches a job while the claim still holds it, or whatever its state if no owner is given.
+    def held_job(self, job_id: any, owner: str) -> dict:
+
+        if owner is None:
+            return {"_id": job_id}
+
+        return {"_id": job_id, "status": "running", "owner": owner}
+
+    def renew_job(self, job_id: any, owner: str, lease_until: float) -> bool:
+
+        return self.jobs.update_one(
+            self.held_job(job_id, owner),
+            {"$set": {"lease_until": lease_until}}
+        ).matched_count > 0
+
+    def finish_job(self, job_id: any, owner: str = None) -> bool:
+        return self.jobs.delete_one(self.held_job(job_id, owner)).deleted_count > 0
+
+    def complete_job(self, job_id: any, result: dict, owner: str) -> bool:
+
+        return self.jobs.update_one(
+            self.held_job(job_id, owner),
+            {"$set": {"status": "done", "result": result}}
+        ).matched_count > 0
+
+    def retry_job(self, job_id: any, run_at: float, error: str, owner: str) -> bool:
+
+        return self.jobs.update_one(
+            self.held_job(job_id, owner),
+            {"$set": {"status": "pending", "run_at": run_at, "error": error}}
+        ).matched_count > 0
+
+    def fail_job(self, job_id: any, error: str, owner: str) -> bool:
+
+        return self.jobs.update_one(
+            self.held_job(job_id, owner),
+            {"$set": {"status": "failed", "error": error}}
+        ).matched_count > 0
+
+    def get_job(self, key: str) -> dict:
+        return self.jobs.find_one({"key": key}, {"status": 1, "attempts": 1, "error": 1, "result": 1})
+
+    def count_jobs(self, status: str) -> int:
+        return self.jobs.count_documents({"status": status})
@@ -0,0 +1,475 @@
+from backends.storage_backend import StorageBackend, apply_projection
+from exceptions.duplicate_user_exception import DuplicateUserException
+
+import json
+import sqlite3
+from contextlib import contextmanager
+from threading import local, Lock
+from uuid import uuid4
+
+"""
+Stores users in an embedded SQLite database for single-node deployments.
+The database runs in WAL mode so readers never block the writer, every
+thread gets its own connection, and all statements are parameterized so
+sqlite3's statement cache reuses their prepared form.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+SCHEMA: tuple = (
+    """CREATE TABLE IF NOT EXISTS users (
+        id TEXT PRIMARY KEY,
+        user TEXT NOT NULL UNIQUE,
+        password BLOB,
+        usage INTEGER NOT NULL DEFAULT 0,
+        "limit" INTEGER NOT NULL DEFAULT 0,
+        assistant_id TEXT,
+        threads TEXT NOT NULL DEFAULT '[]',
+        extra TEXT NOT NULL DEFAULT '{}'
+    )""",
+    "CREATE INDEX IF NOT EXISTS users_assistant_id ON users (assistant_id)",
+    """CREATE TABLE IF NOT EXISTS messages (
+        user_id TEXT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        PRIMARY KEY (user_id, seq)
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS pool (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        resource_id TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS pool_kind ON pool (kind, id)",
+    """CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        key TEXT NOT NULL UNIQUE,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        run_at REAL NOT NULL,
+        lease_until REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        result TEXT,
+        owner TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, run_at)",
+)
+
+# Columns added to the jobs table after it was first created, so older files gain them on startup.
+JOB_COLUMNS: dict = {"result": "TEXT", "owner": "TEXT"}
+
+# The columns a query may filter on, and the document fields they hold.
+COLUMNS: dict = {"_id": "id", "user": "user", "assistant_id": "assistant_id"}
+
+# Fields that have their own column; everything else goes into `extra`.
+STORED_FIELDS: set = {"_id", "user", "password", "usage", "limit", "assistant_id", "threads", "chat_history"}
+
+INSERT_USER: str = """INSERT INTO users (id, user, password, usage, "limit", assistant_id, threads, extra)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+SELECT_USER: str = """SELECT id, user, password, usage, "limit", assistant_id, threads, extra FROM users WHERE {}"""
+SELECT_THREADS: str = "SELECT threads FROM users WHERE id = ?"
+UPDATE_THREADS: str = "UPDATE users SET threads = ? WHERE id = ?"
+UPDATE_ASSISTANT: str = "UPDATE users SET assistant_id = ? WHERE id = ?"
+UPDATE_PASSWORD: str = "UPDATE users SET password = ? WHERE id = ?"
+DELETE_USER: str = "DELETE FROM users WHERE id = ?"
+ADD_USAGE: str = "UPDATE users SET usage = usage + ? WHERE id = ?"
+RESERVE_USAGE: str = 'UPDATE users SET usage = usage + ? WHERE id = ? AND usage + ? <= "limit"'
+SELECT_USAGE: str = "SELECT usage FROM users WHERE id = ?"
+COUNT_MESSAGES: str = "SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE user_id = ?"
+INSERT_MESSAGE: str = "INSERT INTO messages (user_id, seq, role, content) VALUES (?, ?, ?, ?)"
+SELECT_MESSAGES: str = """SELECT role, content FROM messages
+    WHERE user_id = ? AND seq >= ? AND seq < ? ORDER BY seq"""
+DELETE_MESSAGES: str = "DELETE FROM messages WHERE user_id = ?"
+INSERT_RESOURCE: str = "INSERT INTO pool (kind, resource_id) VALUES (?, ?)"
+SELECT_RESOURCE: str = "SELECT id, resource_id FROM pool WHERE kind = ? ORDER BY id LIMIT 1"
+DELETE_RESOURCE: str = "DELETE FROM pool WHERE id = ?"
+REMOVE_RESOURCE: str = "DELETE FROM pool WHERE kind = ? AND resource_id = ?"
+COUNT_RESOURCES: str = "SELECT COUNT(*) FROM pool WHERE kind = ?"
+LIST_RESOURCES: str = "SELECT resource_id FROM pool WHERE kind = ? ORDER BY id"
+ENQUEUE_JOB: str = """INSERT INTO jobs (key, kind, payload, status, run_at) VALUES (?, ?, ?, 'pending', ?)
+    ON CONFLICT (key) DO UPDATE SET kind = excluded.kind, payload = excluded.payload, status = 'pending',
+    attempts = 0, run_at = excluded.run_at, lease_until = 0, owner = NULL, error = NULL, result = NULL WHERE status = 'failed'"""
+SELECT_DUE_JOB: str = """SELECT id, key, kind, payload, attempts FROM jobs
+    WHERE kind IN ({}) AND ((status = 'pending' AND run_at <= ?) OR (status = 'running' AND lease_until <= ?))
+    ORDER BY run_at LIMIT 1"""
+CLAIM_JOB: str = "UPDATE jobs SET status = 'running', lease_until = ?, attempts = attempts + 1, owner = ? WHERE id = ?"
+HELD_JOB: str = " AND status = 'running' AND owner = ?"
+RENEW_JOB: str = "UPDATE jobs SET lease_until = ? WHERE id = ?" + HELD_JOB
+DELETE_JOB: str = "DELETE FROM jobs WHERE id = ?"
+COMPLETE_JOB: str = "UPDATE jobs SET status = 'done', result = ? WHERE id = ?" + HELD_JOB
+RETRY_JOB: str = "UPDATE jobs SET status = 'pending', run_at = ?, error = ? WHERE id = ?" + HELD_JOB
+FAIL_JOB: str = "UPDATE jobs SET status = 'failed', error = ? WHERE id = ?" + HELD_JOB
+SELECT_JOB: str = "SELECT id, status, attempts, error, result FROM jobs WHERE key = ?"
+COUNT_JOBS: str = "SELECT COUNT(*) FROM jobs WHERE status = ?"
+
+class SqliteBackend(StorageBackend):
+
+    def __init__(self, path: str = "chat.db"):
+
+        self.path: str = path
+        self.local: local = local()
+        self.connections: list = []
+        self.connections_lock: Lock = Lock()
+        self.ready: bool = False
+
+    """
+    Returns this thread's connection, opening and configuring it on first use.
+
+    Returns:
+        sqlite3.Connection: The connection.
+    """
+    def connection(self) -> sqlite3.Connection:
+
+        conn: sqlite3.Connection = getattr(self.local, "conn", None)
+
+        if conn is None:
+
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+            conn.execute("PRAGMA busy_timeout = 5000")
+
+            self.local.conn = conn
+
+            with self.connections_lock:
+                self.connections.append(conn)
+
+        return conn
+
+    """
+    Runs a block inside a write transaction that takes the lock up front.
+    """
+    @contextmanager
+    def transaction(self):
+
+        conn: sqlite3.Connection = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield conn
+
+        except BaseException:
+
+            conn.execute("ROLLBACK")
+            raise
+
+        conn.execute("COMMIT")
+
+    def ensure_indexes(self) -> None:
+
+        if self.ready:
+            return
+
+        with self.transaction() as conn:
+
+            for statement in SCHEMA:
+                conn.execute(statement)
+
+            columns: set = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+
+            for column, kind in JOB_COLUMNS.items():
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+        self.ready = True
+
+    def insert(self, item: dict) -> any:
+
+        user_id: any = item.get("_id") or uuid4().hex
+        extra: dict = {field: value for field, value in item.items() if field not in STORED_FIELDS}
+
+        try:
+            with self.transaction() as conn:
+
+                conn.execute(INSERT_USER, (
+                    user_id,
+                    item["user"],
+                    item.get("password"),
+                    item.get("usage", 0),
+                    item.get("limit", 0),
+                    item.get("assistant_id"),
+                    json.dumps(item.get("threads", [])),
+                    json.dumps(extra),
+                ))
+
+                self.insert_messages(conn, user_id, 0, item.get("chat_history", []))
+
+        except sqlite3.IntegrityError as e:
+
+            raise DuplicateUserException(f"User already exists: {e}")
+
+        return user_id
+
+    def retrieve(self, query: dict, projection: dict = None) -> dict:
+
+        unknown: set = set(query) - set(COLUMNS)
+
+        if unknown:
+            raise ValueError(f"Can't query SQLite users by {', '.join(sorted(unknown))}")
+
+        where: str = " AND ".join(f"{COLUMNS[field]} = ?" for field in query) or "1 = 1"
+        conn: sqlite3.Connection = self.connection()
+
+        row: tuple = conn.execute(SELECT_USER.format(where) + " LIMIT 1", tuple(query.values())).fetchone()
+
+        if row is None:
+            return None
+
+        document: dict = {
+            "_id": row[0],
+            "user": row[1],
+            "password": row[2],
+            "usage": row[3],
+            "limit": row[4],
+            "assistant_id": row[5],
+            "threads": json.loads(row[6]),
+            **json.loads(row[7]),
+        }
+
+        # Only read the messages when the projection keeps them.
+        if "chat_history" in apply_projection({"chat_history": None}, projection):
+            document["chat_history"], _ = self.get_chat_history(row[0], -1)
+
+        return apply_projection(document, projection)
+
+    def add_thread(self, user_id: any, thread_id: str) -> None:
+        self.update_threads(user_id, thread_id, unique=False)
+
+    def update_chat_history(self, user_id: any, chat_history: list[dict]) -> None:
+
+        with self.transaction() as conn:
+
+            conn.execute(DELETE_MESSAGES, (user_id,))
+            self.insert_messages(conn, user_id, 0, chat_history)
+
+    def append_chat_history(self, user_id: any, messages: list[dict]) -> None:
+
+        with self.transaction() as conn:
+
+            count: int = conn.execute(COUNT_MESSAGES, (user_id,)).fetchone()[0]
+            self.insert_messages(conn, user_id, count, messages)
+
+    def get_chat_history(self, user_id: any, limit: int, before: int = None) -> tuple[list[dict], int]:
+
+        conn: sqlite3.Connection = self.connection()
+        conn.execute("BEGIN")
+
+        try:
+            count: int = conn.execute(COUNT_MESSAGES, (user_id,)).fetchone()[0]
+            end: int = count if before is None else min(before, count)
+            start: int = 0 if limit < 0 else max(end - limit, 0)
+
+            rows: list = conn.execute(SELECT_MESSAGES, (user_id, start, end)).fetchall()
+
+        finally:
+            conn.execute("COMMIT")
+
+        return [{"role": role, "content": content} for role, content in rows], start
+
+    def delete_user(self, user_id: any) -> None:
+
+        with self.transaction() as conn:
+            conn.execute(DELETE_USER, (user_id,))
+
+    def update_count(self, user_id: any, extra: int, within_limit: bool = False) -> int:
+
+        with self.transaction() as conn:
+
+            if within_limit:
+                cursor: sqlite3.Cursor = conn.execute(RESERVE_USAGE, (extra, user_id, extra))
+            else:
+                cursor: sqlite3.Cursor = conn.execute(ADD_USAGE, (extra, user_id))
+
+            if cursor.rowcount == 0:
+                return None
+
+            return conn.execute(SELECT_USAGE, (user_id,)).fetchone()[0]
+
+    def record_turn(self, user_id: any, messages: list[dict], extra: int, thread_id: str = None) -> int:
+
+        with self.transaction() as conn:
+
+            if conn.execute(ADD_USAGE, (extra, user_id)).rowcount == 0:
+                return None
+
+            count: int = conn.execute(COUNT_MESSAGES, (user_id,)).fetchone()[0]
+            self.insert_messages(conn, user_id, count, messages)
+
+            if thread_id:
+                self.update_threads(user_id, thread_id, unique=True, conn=conn)
+
+            return conn.execute(SELECT_USAGE, (user_id,)).fetchone()[0]
+
+    def set_assistant(self, user_id: any, assistant_id: str) -> None:
+
+        with self.transaction() as conn:
+            conn.execute(UPDATE_ASSISTANT, (assistant_id, user_id))
+
+    def set_password(self, user_id: any, password: bytes) -> None:
+
+        with self.transaction() as conn:
+            conn.execute(UPDATE_PASSWORD, (password, user_id))
+
+    def add_resource(self, kind: str, resource_id: str) -> None:
+
+        with self.transaction() as conn:
+            conn.execute(INSERT_RESOURCE, (kind, resource_id))
+
+    def take_resource(self, kind: str) -> str:
+
+        with self.transaction() as conn:
+
+            row: tuple = conn.execute(SELECT_RESOURCE, (kind,)).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(DELETE_RESOURCE, (row[0],))
+
+            return row[1]
+
+    def remove_resource(self, kind: str, resource_id: str) -> bool:
+
+        with self.transaction() as conn:
+            return conn.execute(REMOVE_RESOURCE, (kind, resource_id)).rowcount > 0
+
+    def count_resources(self, kind: str) -> int:
+        return self.connection().execute(COUNT_RESOURCES, (kind,)).fetchone()[0]
+
+    def list_resources(self, kind: str) -> list[str]:
+        return [row[0] for row in self.connection().execute(LIST_RESOURCES, (kind,))]
+
+    def enqueue_job(self, key: str, kind: str, payload: dict, run_at: float) -> None:
+
+        with self.transaction() as conn:
+            conn.execute(ENQUEUE_JOB, (key, kind, json.dumps(payload), run_at))
+
+    def claim_job(self, now: float, lease: float, kinds: list[str], owner: str) -> dict:
+
+        with self.transaction() as conn:
+
+            placeholders: str = ", ".join("?" for _ in kinds)
+            row: tuple = conn.execute(SELECT_DUE_JOB.format(placeholders), (*kinds, now, now)).fetchone()
+
+            if row is None:
+                return None
+
+            conn.execute(CLAIM_JOB, (now + lease, owner, row[0]))
+
+            return {
+                "_id": row[0],
+                "key": row[1],
+                "kind": row[2],
+                "payload": json.loads(row[3]),
+                "attempts": row[4] + 1,
+                "owner": owner,
+            }
+
+    def renew_job(self, job_id: any, owner: str, lease_until: float) -> bool:
+
+        with self.transaction() as conn:
+            return conn.execute(RENEW_JOB, (lease_until, job_id, owner)).rowcount > 0
+
+    def finish_job(self, job_id: any, owner: str = None) -> bool:
+
+        with self.transaction() as conn:
+
+            if owner is None:
+                return conn.execute(DELETE_JOB, (job_id,)).rowcount > 0
+
+            return conn.execute(DELETE_JOB + HELD_JOB, (job_id, owner)).rowcount > 0
+
+    def complete_job(self, job_id: any, result: dict, owner: str) -> bool:
+
+        with self.transaction() as conn:
+            return conn.execute(COMPLETE_JOB, (json.dumps(result), job_id, owner)).rowcount > 0
+
+    def retry_job(self, job_id: any, run_at: float, error: str, owner: str) -> bool:
+
+        with self.transaction() as conn:
+            return conn.execute(RETRY_JOB, (run_at, error, job_id, owner)).rowcount > 0
+
+    def fail_job(self, job_id: any, error: str, owner: str) -> bool:
+
+        with self.transaction() as conn:
+            return conn.execute(FAIL_JOB, (error, job_id, owner)).rowcount > 0
+
+    def get_job(self, key: str) -> dict:
+
+        row: tuple = self.connection().execute(SELECT_JOB, (key,)).fetchone()
+
+        if row is None:
+            return None
+
+        return {
+            "_id": row[0],
+            "status": row[1],
+            "attempts": row[2],
+            "error": row[3],
+            "result": json.loads(row[4]) if row[4] is not None else None,
+        }
+
+    def count_jobs(self, status: str) -> int:
+        return self.connection().execute(COUNT_JOBS, (status,)).fetchone()[0]
+
+    def close(self) -> None:
+
+        with self.connections_lock:
+
+            for conn in self.connections:
+                conn.close()
+
+            self.connections.clear()
+
+        self.local = local()
+
+    """
+    Inserts messages with consecutive sequence numbers.
+
+    Args:
+        conn (sqlite3.Connection): The connection inside the current transaction.
+        user_id (any): The id of the user.
+        first (int): The sequence number of the first message.
+        messages (list[dict]): The messages to insert.
+    """
+    def insert_messages(self, conn: sqlite3.Connection, user_id: any, first: int, messages: list[dict]) -> None:
+
+        conn.executemany(INSERT_MESSAGE, [
+            (user_id, first + offset, message["role"], message["content"])
+            for offset, message in enumerate(messages)
+        ])
+
+    """
+    Adds a thread to a user's JSON list of threads.
+
+    Args:
+        user_id (any): The id of the user.
+        thread_id (str): The thread's id.
+        unique (bool): Skip it if it's already there.
+        conn (sqlite3.Connection): A connection inside an open transaction, if there is one.
+    """
+    def update_threads(self, user_id: any, thread_id: str, unique: bool, conn: sqlite3.Connection = None) -> None:
+
+        if conn is None:
+
+            with self.transaction() as conn:
+                self.update_threads(user_id, thread_id, unique, conn)
+
+            return
+
+        row: tuple = conn.execute(SELECT_THREADS, (user_id,)).fetchone()
+
+        if row is None:
+            return
+
+        threads: list = json.loads(row[0])
+
+        if unique and thread_id in threads:
+            return
+
+        threads.append(thread_id)
+        conn.execute(UPDATE_THREADS, (json.dumps(threads), user_id))
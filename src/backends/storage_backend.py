@@ -0,0 +1,413 @@
+from abc import ABC, abstractmethod
+
+"""
+The interface every storage engine behind DatabaseManager implements.
+Each method is expected to cost a single round trip to the engine.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+class StorageBackend(ABC):
+
+    """
+    Creates whatever indexes or tables the other methods rely on. It's
+    safe to call more than once.
+    """
+    @abstractmethod
+    def ensure_indexes(self) -> None:
+        pass
+
+    """
+    Inserts a single user document.
+
+    Args:
+        item (dict): The document to insert.
+
+    Returns:
+        any: The id created for the new entry.
+
+    Raises:
+        DuplicateUserException: If the username is already taken.
+    """
+    @abstractmethod
+    def insert(self, item: dict) -> any:
+        pass
+
+    """
+    Retrieves the first document whose fields equal every field of the query.
+
+    Args:
+        query (dict): The fields to match.
+        projection (dict): MongoDB-style fields to include or exclude. Defaults to all of them.
+
+    Returns:
+        dict: The document, or None if nothing matches.
+    """
+    @abstractmethod
+    def retrieve(self, query: dict, projection: dict = None) -> dict:
+        pass
+
+    """
+    Adds a thread id to a user's threads.
+
+    Args:
+        user_id (any): The id of the user.
+        thread_id (str): The thread's id.
+    """
+    @abstractmethod
+    def add_thread(self, user_id: any, thread_id: str) -> None:
+        pass
+
+    """
+    Replaces a user's whole chat history.
+
+    Args:
+        user_id (any): The id of the user.
+        chat_history (list[dict]): The new chat history.
+    """
+    @abstractmethod
+    def update_chat_history(self, user_id: any, chat_history: list[dict]) -> None:
+        pass
+
+    """
+    Appends messages to the end of a user's chat history.
+
+    Args:
+        user_id (any): The id of the user.
+        messages (list[dict]): The messages to append, oldest first.
+    """
+    @abstractmethod
+    def append_chat_history(self, user_id: any, messages: list[dict]) -> None:
+        pass
+
+    """
+    Reads the messages stored in [start, end) of a user's chat history,
+    where end is `before` (or the end of the history) and start is at most
+    `limit` messages earlier.
+
+    Args:
+        user_id (any): The id of the user.
+        limit (int): The most messages to return.
+        before (int): The index to stop before. Defaults to the end.
+
+    Returns:
+        tuple[list[dict], int]: The messages, oldest first, and the start index.
+    """
+    @abstractmethod
+    def get_chat_history(self, user_id: any, limit: int, before: int = None) -> tuple[list[dict], int]:
+        pass
+
+    """
+    Removes a user and everything stored with them.
+
+    Args:
+        user_id (any): The id of the user.
+    """
+    @abstractmethod
+    def delete_user(self, user_id: any) -> None:
+        pass
+
+    """
+    Atomically adds to a user's usage.
+
+    Args:
+        user_id (any): The id of the user.
+        extra (int): The amount to add.
+        within_limit (bool): Only add it if the result doesn't exceed the user's limit.
+
+    Returns:
+        int: The usage afterwards, or None if the user is missing or the limit would be exceeded.
+    """
+    @abstractmethod
+    def update_count(self, user_id: any, extra: int, within_limit: bool = False) -> int:
+        pass
+
+    """
+    Atomically applies a finished chat turn: the usage increment, the new
+    messages and, if it's missing, the thread.
+
+    Args:
+        user_id (any): The id of the user.
+        messages (list[dict]): The messages from the turn, oldest first.
+        extra (int): The amount to add to the usage.
+        thread_id (str): The thread the turn ran on, if any.
+
+    Returns:
+        int: The usage afterwards, or None if the user doesn't exist.
+    """
+    @abstractmethod
+    def record_turn(self, user_id: any, messages: list[dict], extra: int, thread_id: str = None) -> int:
+        pass
+
+    """
+    Points a user at a different assistant.
+
+    Args:
+        user_id (any): The id of the user.
+        assistant_id (str): The assistant's id.
+    """
+    @abstractmethod
+    def set_assistant(self, user_id: any, assistant_id: str) -> None:
+        pass
+
+    """
+    Replaces a user's password hash.
+
+    Args:
+        user_id (any): The id of the user.
+        password (bytes): The new hash.
+    """
+    @abstractmethod
+    def set_password(self, user_id: any, password: bytes) -> None:
+        pass
+
+    """
+    Adds a ready-made remote resource, like an assistant or thread, to the pool.
+
+    Args:
+        kind (str): What the resource is.
+        resource_id (str): Its id.
+    """
+    @abstractmethod
+    def add_resource(self, kind: str, resource_id: str) -> None:
+        pass
+
+    """
+    Atomically removes and returns the oldest pooled resource of a kind.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        str: Its id, or None if the pool is empty.
+    """
+    @abstractmethod
+    def take_resource(self, kind: str) -> str:
+        pass
+
+    """
+    Removes a specific resource from the pool.
+
+    Args:
+        kind (str): What the resource is.
+        resource_id (str): Its id.
+
+    Returns:
+        bool: Whether it was still in the pool.
+    """
+    @abstractmethod
+    def remove_resource(self, kind: str, resource_id: str) -> bool:
+        pass
+
+    """
+    Counts the pooled resources of a kind.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        int: How many are waiting to be taken.
+    """
+    @abstractmethod
+    def count_resources(self, kind: str) -> int:
+        pass
+
+    """
+    Lists the pooled resources of a kind without taking them.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        list[str]: Their ids, oldest first.
+    """
+    @abstractmethod
+    def list_resources(self, kind: str) -> list[str]:
+        pass
+
+    """
+    Queues a background job. Jobs are identified by their key, so queueing
+    one that's already pending or running does nothing, and queueing one
+    that failed for good retries it from scratch.
+
+    Args:
+        key (str): What makes the job unique, like "delete_assistant:asst_123".
+        kind (str): Which handler runs it.
+        payload (dict): The handler's keyword arguments.
+        run_at (float): The earliest time it may run, as a Unix timestamp.
+    """
+    @abstractmethod
+    def enqueue_job(self, key: str, kind: str, payload: dict, run_at: float) -> None:
+        pass
+
+    """
+    Atomically claims the next job that's due, or whose worker stopped
+    renewing its lease, and counts the attempt. The job is held by the
+    new owner from then on, so a worker whose lease ran out can no longer
+    change it.
+
+    Args:
+        now (float): The current Unix timestamp.
+        lease (float): Seconds until another worker may claim it again.
+        kinds (list[str]): Only claim jobs of these kinds.
+        owner (str): A token unique to this claim.
+
+    Returns:
+        dict: The job's `_id`, `key`, `kind`, `payload`, `attempts` and `owner`, or None if nothing is due.
+    """
+    @abstractmethod
+    def claim_job(self, now: float, lease: float, kinds: list[str], owner: str) -> dict:
+        pass
+
+    """
+    Extends the lease on a job, as long as the claim is still its owner.
+
+    Args:
+        job_id (any): The job's id.
+        owner (str): The claim's token.
+        lease_until (float): When another worker may claim it again, as a Unix timestamp.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @abstractmethod
+    def renew_job(self, job_id: any, owner: str, lease_until: float) -> bool:
+        pass
+
+    """
+    Removes a job that succeeded, or whose outcome was read.
+
+    Args:
+        job_id (any): The job's id.
+        owner (str): Only remove it while this claim holds it. Anyone may remove it if None.
+
+    Returns:
+        bool: Whether it was removed.
+    """
+    @abstractmethod
+    def finish_job(self, job_id: any, owner: str = None) -> bool:
+        pass
+
+    """
+    Marks a job that succeeded as done and keeps its result until it's
+    read and the job is removed with `finish_job`.
+
+    Args:
+        job_id (any): The job's id.
+        result (dict): What the job produced.
+        owner (str): The claim's token. Nothing changes if it no longer holds the job.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @abstractmethod
+    def complete_job(self, job_id: any, result: dict, owner: str) -> bool:
+        pass
+
+    """
+    Puts a job that failed back in the queue.
+
+    Args:
+        job_id (any): The job's id.
+        run_at (float): When to try again, as a Unix timestamp.
+        error (str): Why it failed.
+        owner (str): The claim's token. Nothing changes if it no longer holds the job.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @abstractmethod
+    def retry_job(self, job_id: any, run_at: float, error: str, owner: str) -> bool:
+        pass
+
+    """
+    Marks a job as failed for good. It's kept so it can be inspected.
+
+    Args:
+        job_id (any): The job's id.
+        error (str): Why it failed.
+        owner (str): The claim's token. Nothing changes if it no longer holds the job.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @abstractmethod
+    def fail_job(self, job_id: any, error: str, owner: str) -> bool:
+        pass
+
+    """
+    Looks up a job by its key.
+
+    Args:
+        key (str): The job's key.
+
+    Returns:
+        dict: The job's `_id`, `status`, `attempts`, `error` and `result`, or None if there's no such job.
+    """
+    @abstractmethod
+    def get_job(self, key: str) -> dict:
+        pass
+
+    """
+    Counts the jobs with a status.
+
+    Args:
+        status (str): "pending", "running", "done" or "failed".
+
+    Returns:
+        int: How many there are.
+    """
+    @abstractmethod
+    def count_jobs(self, status: str) -> int:
+        pass
+
+    """
+    Turns an id that was stored as text, like in a session token, back
+    into the form the backend uses.
+
+    Args:
+        value (str): The id as text.
+
+    Returns:
+        any: The id.
+    """
+    def parse_id(self, value: str) -> any:
+        return value
+
+    """
+    Releases anything the backend holds open.
+    """
+    def close(self) -> None:
+        pass
+
+"""
+Applies a MongoDB-style projection to a plain document.
+
+Args:
+    document (dict): The full document.
+    projection (dict): Either only inclusions or only exclusions. `_id` is kept unless excluded.
+
+Returns:
+    dict: A new document with only the projected fields.
+"""
+def apply_projection(document: dict, projection: dict = None) -> dict:
+
+    if document is None:
+        return None
+
+    if not projection:
+        return dict(document)
+
+    included: set = {field for field, flag in projection.items() if flag and field != "_id"}
+
+    if included:
+
+        result: dict = {field: document[field] for field in included if field in document}
+
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+
+        return result
+
+    return {field: value for field, value in document.items() if field not in projection}
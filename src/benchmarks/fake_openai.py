@@ -0,0 +1,679 @@
+from utils.openai_utils import get_client
+
+import argparse
+import json
+import math
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock
+from typing import Iterator
+from uuid import uuid4
+
+import httpx
+
+"""
+An in-process stand-in for the parts of OpenAI's Assistants API this app
+uses: assistants, threads, messages and runs, polled or streamed. It can
+add latency, fail requests and runs, and answer with rate limits, so the
+managers can be tested and load tested without an account or network.
+
+Plug it into the shared clients with `install`:
+
+    fake = FakeOpenAI(latency=lognormal(0.05, 0.5), rate_limit_rate=0.05)
+    fake.install("fake-key")
+    ThreadManager("fake-key", assistant_id, thread_id).get_response("Hi")
+
+Or serve it over HTTP and point the real app at it with OPENAI_BASE_URL,
+from the `src` folder:
+
+    python -m benchmarks.fake_openai --port 8089 --latency 0.05
+    OPENAI_BASE_URL=http://localhost:8089/v1 streamlit run main.py
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+"""
+A latency that never varies.
+
+Args:
+    seconds (float): The latency.
+
+Returns:
+    callable: Draws a latency from a random.Random.
+"""
+def constant(seconds: float) -> callable:
+    return lambda rng: seconds
+
+"""
+A latency spread evenly between two bounds.
+
+Args:
+    low (float): The shortest latency, in seconds.
+    high (float): The longest latency, in seconds.
+
+Returns:
+    callable: Draws a latency from a random.Random.
+"""
+def uniform(low: float, high: float) -> callable:
+    return lambda rng: rng.uniform(low, high)
+
+"""
+A latency with a long tail, the way real API latencies are usually spread.
+
+Args:
+    median (float): The median latency, in seconds.
+    sigma (float): How wide the tail is. Around 0.5 is typical.
+
+Returns:
+    callable: Draws a latency from a random.Random.
+"""
+def lognormal(median: float, sigma: float) -> callable:
+    return lambda rng: rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+
+"""
+Turns a number of seconds into a constant distribution, leaving
+distributions as they are.
+
+Args:
+    value (float | callable): Seconds, or a distribution.
+
+Returns:
+    callable: The distribution.
+"""
+def _distribution(value: any) -> callable:
+    return value if callable(value) else constant(float(value or 0.0))
+
+"""
+The default reply: repeats the prompt back.
+
+Args:
+    prompt (str): The user's last message.
+
+Returns:
+    str: The assistant's reply.
+"""
+def echo(prompt: str) -> str:
+    return f"You said: {prompt}"
+
+# The routes the fake answers, matched against the path after /v1.
+ROUTES: list = [
+    ("POST", re.compile(r"^/assistants$"), "assistants.create"),
+    ("GET", re.compile(r"^/assistants$"), "assistants.list"),
+    ("DELETE", re.compile(r"^/assistants/(?P<assistant_id>[^/]+)$"), "assistants.delete"),
+    ("POST", re.compile(r"^/threads$"), "threads.create"),
+    ("DELETE", re.compile(r"^/threads/(?P<thread_id>[^/]+)$"), "threads.delete"),
+    ("POST", re.compile(r"^/threads/(?P<thread_id>[^/]+)/messages$"), "messages.create"),
+    ("GET", re.compile(r"^/threads/(?P<thread_id>[^/]+)/messages$"), "messages.list"),
+    ("POST", re.compile(r"^/threads/(?P<thread_id>[^/]+)/runs$"), "runs.create"),
+    ("GET", re.compile(r"^/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)$"), "runs.retrieve"),
+    ("POST", re.compile(r"^/threads/(?P<thread_id>[^/]+)/runs/(?P<run_id>[^/]+)/cancel$"), "runs.cancel"),
+]
+
+class FakeOpenAI:
+
+    def __init__(
+        self,
+        latency: any = 0.0,
+        run_time: any = 0.0,
+        token_delay: any = 0.0,
+        failure_rate: float = 0.0,
+        run_failure_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.05,
+        reply: callable = echo,
+        seed: int = 0
+    ):
+
+        # Each is seconds or a distribution from `constant`, `uniform` or `lognormal`.
+        self.latency: callable = _distribution(latency)
+        self.run_time: callable = _distribution(run_time)
+        self.token_delay: callable = _distribution(token_delay)
+
+        # The chance a request gets a 500, a run fails, or a request is rate limited.
+        self.failure_rate: float = failure_rate
+        self.run_failure_rate: float = run_failure_rate
+        self.rate_limit_rate: float = rate_limit_rate
+        self.retry_after: float = retry_after
+
+        self.reply: callable = reply
+        self.rng: random.Random = random.Random(seed)
+
+        self.assistants: dict = {}
+        self.threads: dict = {}
+        self.runs: dict = {}
+        self.lock: Lock = Lock()
+
+        self.calls: dict = {}
+
+    """
+    Makes the shared client for an API key talk to this fake. Use a key
+    nothing else in the process uses, since clients are only created once.
+
+    Args:
+        api_key (str): The key the managers will be given.
+    """
+    def install(self, api_key: str) -> None:
+
+        get_client(api_key, transport=FakeTransport(self))
+
+    """
+    Reports the requests each endpoint received.
+
+    Returns:
+        dict: For each endpoint, its `calls`, injected `errors` and `rate_limited` responses.
+    """
+    def stats(self) -> dict:
+
+        with self.lock:
+            return {endpoint: dict(counts) for endpoint, counts in self.calls.items()}
+
+    """
+    Answers a request.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The URL path, with or without the /v1 prefix.
+        query (dict): The query parameters.
+        body (bytes): The request's body.
+
+    Returns:
+        dict: The `status`, `headers`, seconds to `delay` before answering, and either a `body` or, for streams, `chunks` of (delay, bytes).
+    """
+    def respond(self, method: str, path: str, query: dict, body: bytes) -> dict:
+
+        path = path.split("/v1", 1)[-1].rstrip("/")
+
+        for route_method, pattern, endpoint in ROUTES:
+
+            match = pattern.match(path)
+
+            if route_method == method and match:
+                break
+        else:
+            return {**self.error(404, f"Unknown endpoint {method} {path}.", "invalid_request_error"), "delay": 0.0}
+
+        with self.lock:
+
+            counts: dict = self.calls.setdefault(endpoint, {"calls": 0, "errors": 0, "rate_limited": 0})
+            counts["calls"] += 1
+
+            delay: float = max(self.latency(self.rng), 0.0)
+            roll: float = self.rng.random()
+
+            if roll < self.rate_limit_rate:
+
+                counts["rate_limited"] += 1
+                response: dict = self.error(429, "Rate limit reached.", "requests", "rate_limit_exceeded")
+                response["headers"]["retry-after-ms"] = str(int(self.retry_after * 1000))
+
+                return {**response, "delay": delay}
+
+            if roll < self.rate_limit_rate + self.failure_rate:
+
+                counts["errors"] += 1
+
+                return {**self.error(500, "The server had an error.", "server_error"), "delay": delay}
+
+            payload: dict = json.loads(body) if body else {}
+            handler: callable = getattr(self, endpoint.replace(".", "_"))
+
+            return {**handler(query=query, payload=payload, **match.groupdict()), "delay": delay}
+
+    """
+    Builds an error response shaped like OpenAI's.
+
+    Args:
+        status (int): The HTTP status.
+        message (str): What went wrong.
+        kind (str): The error's type.
+        code (str): The error's code.
+
+    Returns:
+        dict: The response.
+    """
+    def error(self, status: int, message: str, kind: str, code: str = None) -> dict:
+        return self.json_response(status, {"error": {"message": message, "type": kind, "param": None, "code": code}})
+
+    """
+    Builds a JSON response.
+
+    Args:
+        status (int): The HTTP status.
+        data (dict): The body.
+
+    Returns:
+        dict: The response.
+    """
+    def json_response(self, status: int, data: dict) -> dict:
+        return {"status": status, "headers": {"content-type": "application/json"}, "body": json.dumps(data).encode()}
+
+    """
+    Builds a not found response for a missing object.
+
+    Args:
+        kind (str): What was missing.
+        object_id (str): Its id.
+
+    Returns:
+        dict: The response.
+    """
+    def missing(self, kind: str, object_id: str) -> dict:
+        return self.error(404, f"No {kind} found with id '{object_id}'.", "invalid_request_error")
+
+    """
+    Slices a list the way the API's cursor pages do.
+
+    Args:
+        items (list): Every item, oldest first.
+        query (dict): The `order`, `after` and `limit` parameters.
+
+    Returns:
+        dict: The page.
+    """
+    def page(self, items: list, query: dict) -> dict:
+
+        if query.get("order", "desc") == "desc":
+            items = items[::-1]
+
+        if query.get("after"):
+
+            ids: list = [item["id"] for item in items]
+            items = items[ids.index(query["after"]) + 1:] if query["after"] in ids else []
+
+        limit: int = int(query.get("limit", 20))
+        data: list = items[:limit]
+
+        return self.json_response(200, {
+            "object": "list",
+            "data": data,
+            "first_id": data[0]["id"] if data else None,
+            "last_id": data[-1]["id"] if data else None,
+            "has_more": len(items) > limit,
+        })
+
+    # The endpoints, named after their ROUTES. Each takes the query, the JSON
+    # payload and the path's ids, and is called with the lock held.
+
+    def assistants_create(self, query: dict, payload: dict) -> dict:
+
+        assistant: dict = {
+            "id": f"asst_{uuid4().hex[:24]}",
+            "object": "assistant",
+            "created_at": int(time.time()),
+            "name": payload.get("name"),
+            "description": payload.get("description"),
+            "model": payload.get("model", ""),
+            "instructions": payload.get("instructions"),
+            "tools": payload.get("tools", []),
+            "file_ids": payload.get("file_ids", []),
+            "metadata": payload.get("metadata", {}),
+        }
+
+        self.assistants[assistant["id"]] = assistant
+
+        return self.json_response(200, assistant)
+
+    def assistants_list(self, query: dict, payload: dict) -> dict:
+        return self.page(list(self.assistants.values()), query)
+
+    def assistants_delete(self, query: dict, payload: dict, assistant_id: str) -> dict:
+
+        if self.assistants.pop(assistant_id, None) is None:
+            return self.missing("assistant", assistant_id)
+
+        return self.json_response(200, {"id": assistant_id, "object": "assistant.deleted", "deleted": True})
+
+    def threads_create(self, query: dict, payload: dict) -> dict:
+
+        thread: dict = {
+            "id": f"thread_{uuid4().hex[:24]}",
+            "object": "thread",
+            "created_at": int(time.time()),
+            "metadata": payload.get("metadata", {}),
+        }
+
+        self.threads[thread["id"]] = {"thread": thread, "messages": [], "runs": []}
+
+        for message in payload.get("messages", []):
+            self.add_message(thread["id"], message["role"], message["content"])
+
+        return self.json_response(200, thread)
+
+    def threads_delete(self, query: dict, payload: dict, thread_id: str) -> dict:
+
+        if self.threads.pop(thread_id, None) is None:
+            return self.missing("thread", thread_id)
+
+        return self.json_response(200, {"id": thread_id, "object": "thread.deleted", "deleted": True})
+
+    """
+    Adds a message to a thread.
+
+    Args:
+        thread_id (str): The thread.
+        role (str): "user" or "assistant".
+        content (str): The message's text.
+        run (dict): The run that wrote it, for assistant messages.
+
+    Returns:
+        dict: The message.
+    """
+    def add_message(self, thread_id: str, role: str, content: str, run: dict = None) -> dict:
+
+        message: dict = {
+            "id": f"msg_{uuid4().hex[:24]}",
+            "object": "thread.message",
+            "created_at": int(time.time()),
+            "thread_id": thread_id,
+            "role": role,
+            "content": [{"type": "text", "text": {"value": content, "annotations": []}}],
+            "assistant_id": run["assistant_id"] if run else None,
+            "run_id": run["id"] if run else None,
+            "file_ids": [],
+            "metadata": {},
+            "status": "completed",
+            "completed_at": int(time.time()),
+            "incomplete_at": None,
+            "incomplete_details": None,
+        }
+
+        self.threads[thread_id]["messages"].append(message)
+
+        return message
+
+    def messages_create(self, query: dict, payload: dict, thread_id: str) -> dict:
+
+        if thread_id not in self.threads:
+            return self.missing("thread", thread_id)
+
+        return self.json_response(200, self.add_message(thread_id, payload.get("role", "user"), payload.get("content", "")))
+
+    def messages_list(self, query: dict, payload: dict, thread_id: str) -> dict:
+
+        if thread_id not in self.threads:
+            return self.missing("thread", thread_id)
+
+        # Runs that finished since the last request write their replies first.
+        for run_id in self.threads[thread_id]["runs"]:
+            self.advance(self.runs[run_id])
+
+        return self.page(self.threads[thread_id]["messages"], query)
+
+    def runs_create(self, query: dict, payload: dict, thread_id: str) -> dict:
+
+        if thread_id not in self.threads:
+            return self.missing("thread", thread_id)
+
+        if payload.get("assistant_id") not in self.assistants:
+            return self.missing("assistant", payload.get("assistant_id"))
+
+        assistant: dict = self.assistants[payload["assistant_id"]]
+        now: int = int(time.time())
+        prompts: list = [message for message in self.threads[thread_id]["messages"] if message["role"] == "user"]
+
+        run: dict = {
+            "id": f"run_{uuid4().hex[:24]}",
+            "object": "thread.run",
+            "created_at": now,
+            "assistant_id": assistant["id"],
+            "thread_id": thread_id,
+            "status": "queued",
+            "started_at": now,
+            "expires_at": now + 600,
+            "cancelled_at": None,
+            "failed_at": None,
+            "completed_at": None,
+            "last_error": None,
+            "model": assistant["model"],
+            "instructions": assistant["instructions"] or "",
+            "tools": assistant["tools"],
+            "file_ids": [],
+            "metadata": {},
+            "required_action": None,
+            "usage": None,
+        }
+
+        self.runs[run["id"]] = {
+            "run": run,
+            "reply": self.reply(prompts[-1]["content"][0]["text"]["value"] if prompts else ""),
+            "fails": self.rng.random() < self.run_failure_rate,
+            "done_at": time.monotonic() + max(self.run_time(self.rng), 0.0),
+        }
+
+        self.threads[thread_id]["runs"].append(run["id"])
+
+        if payload.get("stream"):
+            return self.stream(self.runs[run["id"]])
+
+        return self.json_response(200, run)
+
+    def runs_retrieve(self, query: dict, payload: dict, thread_id: str, run_id: str) -> dict:
+
+        if run_id not in self.runs:
+            return self.missing("run", run_id)
+
+        return self.json_response(200, self.advance(self.runs[run_id]))
+
+    def runs_cancel(self, query: dict, payload: dict, thread_id: str, run_id: str) -> dict:
+
+        if run_id not in self.runs:
+            return self.missing("run", run_id)
+
+        run: dict = self.advance(self.runs[run_id])
+
+        if run["status"] in ("queued", "in_progress", "requires_action"):
+            run.update(status="cancelled", cancelled_at=int(time.time()))
+
+        return self.json_response(200, run)
+
+    """
+    Moves a polled run along: in progress until its run time passes, then
+    completed with its reply written to the thread, or failed.
+
+    Args:
+        entry (dict): The run and what it will do.
+
+    Returns:
+        dict: The run as it is now.
+    """
+    def advance(self, entry: dict) -> dict:
+
+        run: dict = entry["run"]
+
+        if run["status"] not in ("queued", "in_progress"):
+            return run
+
+        if time.monotonic() < entry["done_at"]:
+
+            run["status"] = "in_progress"
+
+            return run
+
+        self.finish(entry)
+
+        return run
+
+    """
+    Ends a run, writing its reply to the thread unless it fails.
+
+    Args:
+        entry (dict): The run and what it will do.
+    """
+    def finish(self, entry: dict) -> None:
+
+        run: dict = entry["run"]
+
+        if entry["fails"]:
+
+            run.update(
+                status="failed",
+                failed_at=int(time.time()),
+                last_error={"code": "server_error", "message": "Sorry, something went wrong."}
+            )
+
+            return
+
+        if run["thread_id"] in self.threads:
+            entry["message"] = self.add_message(run["thread_id"], "assistant", entry["reply"], run)
+
+        words: int = len(entry["reply"].split())
+
+        run.update(
+            status="completed",
+            completed_at=int(time.time()),
+            usage={"prompt_tokens": words, "completion_tokens": words, "total_tokens": 2 * words}
+        )
+
+    """
+    Builds a streamed run's server-sent events. The run is settled now;
+    the stream only paces how its reply arrives.
+
+    Args:
+        entry (dict): The run and what it will do.
+
+    Returns:
+        dict: The response, with the events as timed `chunks`.
+    """
+    def stream(self, entry: dict) -> dict:
+
+        run: dict = entry["run"]
+
+        def event(name: str, data: dict) -> bytes:
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+
+        chunks: list = [(0.0, event("thread.run.created", dict(run)))]
+        first_token: float = max(entry["done_at"] - time.monotonic(), 0.0)
+
+        self.finish(entry)
+
+        if run["status"] == "failed":
+            chunks.append((first_token, event("thread.run.failed", dict(run))))
+
+        else:
+
+            message: dict = entry["message"]
+            chunks.append((0.0, event("thread.message.created", {**message, "status": "in_progress", "content": []})))
+
+            for index, word in enumerate(re.findall(r"\S+\s*", entry["reply"])):
+
+                chunks.append((first_token if index == 0 else max(self.token_delay(self.rng), 0.0), event(
+                    "thread.message.delta",
+                    {
+                        "id": message["id"],
+                        "object": "thread.message.delta",
+                        "delta": {"content": [{"index": 0, "type": "text", "text": {"value": word, "annotations": []}}]},
+                    }
+                )))
+
+            chunks.append((0.0, event("thread.message.completed", message)))
+            chunks.append((0.0, event("thread.run.completed", dict(run))))
+
+        chunks.append((0.0, b"event: done\ndata: [DONE]\n\n"))
+
+        return {"status": 200, "headers": {"content-type": "text/event-stream"}, "chunks": chunks}
+
+class FakeTransport(httpx.BaseTransport):
+
+    def __init__(self, fake: FakeOpenAI):
+        self.fake: FakeOpenAI = fake
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+
+        response: dict = self.fake.respond(request.method, request.url.path, dict(request.url.params), request.read())
+        time.sleep(response["delay"])
+
+        if "chunks" not in response:
+            return httpx.Response(response["status"], headers=response["headers"], content=response["body"])
+
+        def chunks() -> Iterator[bytes]:
+
+            for delay, chunk in response["chunks"]:
+                time.sleep(delay)
+                yield chunk
+
+        return httpx.Response(response["status"], headers=response["headers"], content=chunks())
+
+"""
+Serves a fake over HTTP until interrupted.
+
+Args:
+    fake (FakeOpenAI): The fake to serve.
+    host (str): The interface to listen on.
+    port (int): The port to listen on.
+"""
+def serve(fake: FakeOpenAI, host: str = "localhost", port: int = 8089) -> None:
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def handle_method(self) -> None:
+
+            url: httpx.URL = httpx.URL(self.path)
+            body: bytes = self.rfile.read(int(self.headers.get("content-length") or 0))
+
+            response: dict = fake.respond(self.command, url.path, dict(url.params), body)
+            time.sleep(response["delay"])
+
+            self.send_response(response["status"])
+
+            for name, value in response["headers"].items():
+                self.send_header(name, value)
+
+            # Streams end when the connection closes.
+            if "chunks" in response:
+
+                self.send_header("connection", "close")
+                self.end_headers()
+
+                for delay, chunk in response["chunks"]:
+                    time.sleep(delay)
+                    self.wfile.write(chunk)
+                    self.wfile.flush()
+
+                return
+
+            self.send_header("content-length", str(len(response["body"])))
+            self.end_headers()
+            self.wfile.write(response["body"])
+
+        do_GET = do_POST = do_DELETE = handle_method
+
+        def log_message(self, format: str, *args) -> None:
+            pass
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), Handler)
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        print(json.dumps(fake.stats(), indent=2))
+
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Serve a fake Assistants API.")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.05, help="Median seconds per request.")
+    parser.add_argument("--run-time", type=float, default=1.0, help="Median seconds per run.")
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--run-failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    serve(FakeOpenAI(
+        latency=lognormal(args.latency, 0.5),
+        run_time=lognormal(args.run_time, 0.5),
+        token_delay=args.token_delay,
+        failure_rate=args.failure_rate,
+        run_failure_rate=args.run_failure_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    ), args.host, args.port)
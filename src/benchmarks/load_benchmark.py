@@ -0,0 +1,468 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from benchmarks.fake_openai import FakeOpenAI, lognormal
+from managers.database_manager import DatabaseManager
+from managers.generation_manager import GenerationManager, GENERATION_WORKERS, get_generations
+from managers.job_manager import get_jobs
+from managers.metrics_manager import METRICS
+from managers.password_manager import get_passwords
+from managers.pool_manager import get_pool
+from managers.quota_manager import QuotaManager
+from managers.scheduler_manager import get_scheduler
+from managers.session_manager import SessionManager
+from utils.authentication_utils import login_user, register_user
+from utils.chat_utils import HISTORY_WINDOW, session_user, open_thread, start_turn, check_turn
+from utils.password_utils import hash_password
+
+"""
+Simulates many users signing up, logging in and chatting at once, without
+a browser. Each user goes through the same steps as main.py's
+`sign_up_user`, `log_in_user` and `chat` flows, through the functions in
+utils.chat_utils both share, against an embedded database and the fake
+Assistants API. Run it from the `src` folder:
+
+    python -m benchmarks.load_benchmark --users 50 --turns 5 --output results.json
+    python -m benchmarks.load_benchmark --users 50 --turns 5 --baseline results.json
+
+It reports the throughput and p50/p95/p99 latency of each operation, and
+the database round trips and OpenAI calls each turn costs. The results
+can be saved as JSON and compared with an earlier run.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+"""
+Picks the value below which a share of the samples fall.
+
+Args:
+    values (list[float]): The samples, in any order.
+    share (float): The share, between 0 and 1.
+
+Returns:
+    float: The nearest-rank percentile, or 0 without samples.
+"""
+def percentile(values: list[float], share: float) -> float:
+
+    if not values:
+        return 0.0
+
+    ordered: list = sorted(values)
+
+    return ordered[min(max(int(share * len(ordered) + 0.5) - 1, 0), len(ordered) - 1)]
+
+"""
+Reads the commit being benchmarked, so saved results say what they measured.
+
+Returns:
+    str: The commit's hash, or None outside a git checkout.
+"""
+def current_commit() -> str:
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+class LoadTest:
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        api_key: str,
+        sessions: SessionManager,
+        quota: QuotaManager,
+        generations: GenerationManager,
+        poll_interval: float = 0.5
+    ):
+
+        self.db: DatabaseManager = db
+        self.api_key: str = api_key
+        self.sessions: SessionManager = sessions
+        self.quota: QuotaManager = quota
+        self.generations: GenerationManager = generations
+        self.poll_interval: float = poll_interval
+
+        # The seconds each successful operation took, and the errors of the rest, by operation.
+        self.timings: dict = {}
+        self.errors: dict = {}
+        self.lock: Lock = Lock()
+
+        # Checks on turns that were still running, which grow with latency rather than with the work.
+        self.polls: int = 0
+
+    """
+    Runs and times one operation, recording an error instead of raising.
+
+    Args:
+        name (str): The operation's name.
+        operation (callable): Runs it.
+        *args: Its arguments.
+
+    Returns:
+        any: What it returned, or None if it raised.
+    """
+    def timed(self, name: str, operation: callable, *args) -> any:
+
+        started: float = time.perf_counter()
+
+        try:
+            result: any = operation(*args)
+
+        except Exception as e:
+
+            with self.lock:
+                errors: dict = self.errors.setdefault(name, {})
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+
+            return None
+
+        self.record(name, time.perf_counter() - started)
+
+        return result
+
+    """
+    Stores how long an operation took.
+
+    Args:
+        name (str): The operation's name.
+        seconds (float): How long it took.
+    """
+    def record(self, name: str, seconds: float) -> None:
+
+        with self.lock:
+            self.timings.setdefault(name, []).append(seconds)
+
+    """
+    Signs a user up, like `sign_up_user`.
+
+    Args:
+        state (dict): The simulated user, with `username` and `password`.
+    """
+    def sign_up(self, state: dict) -> None:
+
+        if not register_user(state["username"], hash_password(state["password"]), self.db, self.api_key, 0):
+            raise RuntimeError(f"User {state['username']} already exists.")
+
+    """
+    Logs a user in, like `log_in_user`, keeping their session token.
+
+    Args:
+        state (dict): The simulated user, with `username` and `password`.
+    """
+    def log_in(self, state: dict) -> None:
+
+        if not login_user(state["username"], state["password"], self.db):
+            raise RuntimeError(f"User {state['username']} couldn't log in.")
+
+        state["token"] = self.sessions.issue(self.db.get_user(state["username"], history=False))
+
+    """
+    Takes one chat turn, like a run of `chat` that submits a prompt
+    followed by the reruns that poll for its reply.
+
+    Args:
+        state (dict): The simulated user, with their `token` and loaded `chat`.
+        prompt (str): The user's message.
+
+    Raises:
+        QuotaException: If the user has no words left.
+    """
+    def turn(self, state: dict, prompt: str) -> None:
+
+        claims: dict = self.sessions.verify(state["token"])
+
+        if claims is None:
+            raise RuntimeError("The session token was refused.")
+
+        # chat_init
+        user: dict = session_user(self.db, claims)
+        thread, changed = open_thread(self.db, self.api_key, user)
+
+        if changed:
+            state["token"] = self.sessions.issue(user)
+
+        if state.get("chat") is None:
+            state["chat"], _ = self.db.get_chat_history(user["_id"], limit=HISTORY_WINDOW)
+
+        # user_prompt
+        submitted: float = time.perf_counter()
+        key: str = start_turn(self.quota, self.generations, user, thread, prompt, list(state["chat"]))
+        state["token"] = self.sessions.issue(user)
+        first_token: bool = False
+
+        # pending_response, once per poll
+        while (result := check_turn(self.db, self.generations, user, key))["state"] in ("pending", "running"):
+
+            with self.lock:
+                self.polls += 1
+
+            if result["partial"] and not first_token:
+                self.record("first_token", time.perf_counter() - submitted)
+                first_token = True
+
+            time.sleep(self.poll_interval)
+
+        state["token"] = self.sessions.issue(user)
+
+        if result["state"] == "failed":
+            raise RuntimeError(result["error"])
+
+        state["chat"] += [{"role": "user", "content": prompt}, {"role": "assistant", "content": result["reply"]}]
+
+    """
+    Runs one operation for every user at once, and measures what the whole
+    phase cost.
+
+    Args:
+        name (str): The operation's name.
+        operation (callable): Runs it for one user.
+        states (list[dict]): The simulated users.
+        concurrency (int): How many users act at once.
+        fake (FakeOpenAI): The fake API, to count the calls made.
+        *args: Further arguments for the operation.
+
+    Returns:
+        dict: The phase's wall time, the database round trips its operations made besides polls, its polls for running turns, and its OpenAI calls.
+    """
+    def phase(
+        self,
+        name: str,
+        operation: callable,
+        states: list[dict],
+        concurrency: int,
+        fake: FakeOpenAI,
+        *args
+    ) -> dict:
+
+        # The page's queries are counted on each user's own thread, and the turns' on the workers
+        # that ran them, so job claims and pool refills running meanwhile aren't counted.
+        counted: dict = {"round_trips": 0}
+        generated: int = self.generate_round_trips()
+        polls: int = self.polls
+        calls: int = sum(counts["calls"] for counts in fake.stats().values())
+        started: float = time.perf_counter()
+
+        def run(state: dict) -> None:
+
+            with self.db.track() as counter:
+                self.timed(name, operation, state, *args)
+
+            with self.lock:
+                counted["round_trips"] += counter["round_trips"]
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(run, states))
+
+        # Each poll for a running turn is one query, reported apart so the work stays comparable between runs.
+        polled: int = self.polls - polls
+
+        return {
+            "wall_time": time.perf_counter() - started,
+            "round_trips": counted["round_trips"] + self.generate_round_trips() - generated - polled,
+            "polls": polled,
+            "openai_calls": sum(counts["calls"] for counts in fake.stats().values()) - calls,
+        }
+
+    """
+    Reads how many queries the generation workers' turns have made so far.
+
+    Returns:
+        int: The round trips of every generate job run in this process.
+    """
+    def generate_round_trips(self) -> int:
+
+        with self.generations.jobs.lock:
+            return self.generations.jobs.round_trips.get("generate", 0)
+
+    """
+    Summarizes every operation's latency.
+
+    Args:
+        phases (dict): What each phase cost, by operation.
+
+    Returns:
+        dict: For each operation, its count, errors, throughput and latency percentiles in seconds.
+    """
+    def summary(self, phases: dict) -> dict:
+
+        operations: dict = {}
+
+        for name in sorted(set(self.timings) | set(self.errors)):
+
+            timings: list = self.timings.get(name, [])
+            wall_time: float = sum(phase["wall_time"] for phase_name, phase in phases.items() if phase_name.startswith(name))
+
+            operations[name] = {
+                "count": len(timings),
+                "errors": self.errors.get(name, {}),
+                "throughput": len(timings) / wall_time if wall_time else None,
+                "mean": sum(timings) / len(timings) if timings else 0.0,
+                "p50": percentile(timings, 0.50),
+                "p95": percentile(timings, 0.95),
+                "p99": percentile(timings, 0.99),
+                "max": max(timings, default=0.0),
+            }
+
+        return operations
+
+"""
+Runs the whole benchmark.
+
+Args:
+    args (argparse.Namespace): The command line settings.
+
+Returns:
+    dict: The results, ready to save as JSON.
+"""
+def run(args: argparse.Namespace) -> dict:
+
+    fake: FakeOpenAI = FakeOpenAI(
+        latency=lognormal(args.latency, 0.5),
+        run_time=lognormal(args.run_time, 0.5),
+        token_delay=args.token_delay,
+        failure_rate=args.failure_rate,
+        run_failure_rate=args.run_failure_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed
+    )
+
+    # Serving the metrics during the run shows where each turn's time goes.
+    if args.metrics_port is not None:
+        METRICS.enable(port=args.metrics_port)
+
+    api_key: str = f"load-test-{time.time_ns()}"
+    fake.install(api_key)
+
+    uri: str = args.uri or f"sqlite://{os.path.join(tempfile.mkdtemp(), 'load.db')}"
+    db: DatabaseManager = DatabaseManager(uri)
+
+    # The same shared services main.py starts, sized from the command line.
+    get_scheduler(workers=args.scheduler_workers, requests_per_minute=10 ** 6, tokens_per_minute=10 ** 9)
+    get_passwords(rounds=args.bcrypt_rounds)
+    get_pool(db, api_key, low=args.pool_low, high=args.pool_high)
+    get_jobs(db, api_key, workers=args.job_workers)
+
+    test: LoadTest = LoadTest(
+        db=db,
+        api_key=api_key,
+        sessions=SessionManager(secret=os.urandom(32).hex()),
+        quota=QuotaManager(db),
+        generations=get_generations(db, api_key, workers=args.generation_workers),
+        poll_interval=args.poll_interval
+    )
+
+    prefix: str = f"load-{time.time_ns()}"
+    states: list = [{"username": f"{prefix}-{index}", "password": f"password-{index}"} for index in range(args.users)]
+
+    phases: dict = {
+        "sign_up": test.phase("sign_up", test.sign_up, states, args.concurrency, fake),
+        "log_in": test.phase("log_in", test.log_in, states, args.concurrency, fake),
+    }
+
+    for index in range(args.turns):
+        phases[f"turn_{index}"] = test.phase("turn", test.turn, states, args.concurrency, fake, f"Question {index}: how are you?")
+
+    turns: list = [phase for name, phase in phases.items() if name.startswith("turn")]
+    completed: int = len(test.timings.get("turn", []))
+
+    return {
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "baseline", "metrics_port")},
+        "operations": test.summary(phases),
+        "per_turn": {
+            "round_trips": sum(phase["round_trips"] for phase in turns) / completed if completed else None,
+            "polls": sum(phase["polls"] for phase in turns) / completed if completed else None,
+            "openai_calls": sum(phase["openai_calls"] for phase in turns) / completed if completed else None,
+        },
+        "phases": phases,
+        "openai": fake.stats(),
+        "scheduler": {key: value for key, value in get_scheduler().metrics().items() if key != "user_queue_depths"},
+    }
+
+"""
+Prints the results as a table, with the change from a baseline if one
+is given.
+
+Args:
+    results (dict): This run's results.
+    baseline (dict): Earlier results to compare against.
+"""
+def report(results: dict, baseline: dict = None) -> None:
+
+    print(f"{'operation':<14}{'count':>8}{'errors':>8}{'ops/sec':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for name, stats in results["operations"].items():
+
+        throughput: str = f"{stats['throughput']:.1f}" if stats["throughput"] is not None else "-"
+
+        print(
+            f"{name:<14}{stats['count']:>8}{sum(stats['errors'].values()):>8}{throughput:>10}"
+            + "".join(f"{stats[key] * 1000:>10.1f}" for key in ("p50", "p95", "p99"))
+        )
+
+        if baseline and name in baseline["operations"]:
+
+            before: dict = baseline["operations"][name]
+
+            print(f"{'  vs baseline':<40}" + "".join(
+                f"{(stats[key] - before[key]) / before[key] * 100 if before[key] else 0.0:>+9.1f}%"
+                for key in ("p50", "p95", "p99")
+            ))
+
+    print(
+        f"\nPer turn: {results['per_turn']['round_trips']} database round trips, "
+        f"{results['per_turn']['polls']} polls for the reply, {results['per_turn']['openai_calls']} OpenAI calls"
+    )
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Load test the sign-up, login and chat flows.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=None, help="Users acting at once. Defaults to all of them.")
+    parser.add_argument("--uri", default="", help="The database. Defaults to a temporary SQLite file.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Median seconds per OpenAI request.")
+    parser.add_argument("--run-time", type=float, default=1.0, help="Median seconds per run.")
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--run-failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between the page's polls for a reply.")
+    parser.add_argument("--bcrypt-rounds", type=int, default=12)
+    parser.add_argument("--scheduler-workers", type=int, default=16)
+    parser.add_argument("--job-workers", type=int, default=4)
+    parser.add_argument("--generation-workers", type=int, default=GENERATION_WORKERS, help="Turns that can run at once.")
+    parser.add_argument("--pool-low", type=int, default=2)
+    parser.add_argument("--pool-high", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serves Prometheus metrics on this port during the run.")
+    parser.add_argument("--output", default="", help="Saves the results as JSON.")
+    parser.add_argument("--baseline", default="", help="Earlier JSON results to compare against.")
+    args = parser.parse_args()
+    args.concurrency = args.concurrency or args.users
+
+    results: dict = run(args)
+    baseline: dict = None
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
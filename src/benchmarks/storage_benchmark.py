@@ -0,0 +1,110 @@
+import argparse
+import os
+import tempfile
+import time
+
+from backends.storage_backend import StorageBackend
+from backends.memory_backend import MemoryBackend
+from backends.sqlite_backend import SqliteBackend
+
+"""
+Times the operations a chat turn performs against each storage backend.
+Run it from the `src` folder:
+
+    python -m benchmarks.storage_benchmark --users 50 --turns 20 --mongo-uri <uri>
+
+MongoDB is only benchmarked when a URI is given.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+"""
+Runs sign-up, login, turn and paging operations and times each kind.
+
+Args:
+    backend (StorageBackend): The backend to benchmark.
+    users (int): How many users to create.
+    turns (int): How many chat turns each user takes.
+
+Returns:
+    dict: The operations per second for each kind of operation.
+"""
+def run(backend: StorageBackend, users: int, turns: int) -> dict:
+
+    timings: dict = {"insert": 0.0, "retrieve": 0.0, "reserve": 0.0, "record_turn": 0.0, "get_chat_history": 0.0}
+    counts: dict = {name: 0 for name in timings}
+
+    def timed(name: str, operation, *args, **kwargs) -> any:
+
+        start: float = time.perf_counter()
+        result: any = operation(*args, **kwargs)
+        timings[name] += time.perf_counter() - start
+        counts[name] += 1
+
+        return result
+
+    backend.ensure_indexes()
+    prefix: str = f"bench-{time.time_ns()}"
+    ids: list = []
+
+    for index in range(users):
+        ids.append(timed("insert", backend.insert, {
+            "user": f"{prefix}-{index}",
+            "password": b"x" * 60,
+            "usage": 0,
+            "limit": 10 ** 9,
+            "assistant_id": "asst_bench",
+            "threads": [],
+            "chat_history": [],
+        }))
+
+    for index, user_id in enumerate(ids):
+
+        timed("retrieve", backend.retrieve, {"user": f"{prefix}-{index}"}, {"user": 1, "password": 1})
+
+        for turn in range(turns):
+
+            timed("reserve", backend.update_count, user_id, 10, within_limit=True)
+            timed("record_turn", backend.record_turn, user_id, [
+                {"role": "user", "content": f"prompt {turn}"},
+                {"role": "assistant", "content": f"response {turn} " * 20},
+            ], 40, "thread_bench")
+
+        timed("get_chat_history", backend.get_chat_history, user_id, 20)
+
+    for user_id in ids:
+        backend.delete_user(user_id)
+
+    return {name: counts[name] / timings[name] if timings[name] else 0.0 for name in timings}
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the storage backends.")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--mongo-uri", default="")
+    args = parser.parse_args()
+
+    backends: dict = {
+        "memory": MemoryBackend(),
+        "sqlite": SqliteBackend(os.path.join(tempfile.mkdtemp(), "bench.db")),
+    }
+
+    if args.mongo_uri:
+
+        from backends.mongo_backend import MongoBackend
+
+        backends["mongo"] = MongoBackend(args.mongo_uri, collection="bench_users")
+
+    results: dict = {name: run(backend, args.users, args.turns) for name, backend in backends.items()}
+
+    operations: list = list(next(iter(results.values())))
+
+    print(f"{'ops/sec':<18}" + "".join(f"{name:>12}" for name in results))
+
+    for operation in operations:
+        print(f"{operation:<18}" + "".join(f"{results[name][operation]:>12.0f}" for name in results))
+
+    for backend in backends.values():
+        backend.close()
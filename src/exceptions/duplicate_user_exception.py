@@ -0,0 +1,10 @@
+"""
+An exception to be thrown when a username is already taken.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# When a user is inserted with a username that already exists
+class DuplicateUserException(Exception):
+    pass
\ No newline at end of file
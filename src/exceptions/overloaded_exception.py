@@ -0,0 +1,10 @@
+"""
+An exception to be thrown when a queue is full and new work is rejected.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# When there's no room left to queue more work
+class OverloadedException(Exception):
+    pass
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""
+An exception to be thrown when a user's remaining words can't cover a request.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# When a turn is refused before it reaches the assistant
+class QuotaException(Exception):
+
+    def __init__(self, message: str, exhausted: bool):
+        super().__init__(message)
+        self.exhausted: bool = exhausted
@@ -0,0 +1,13 @@
+"""
+An exception to be thrown when an assistant run doesn't complete.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# When a run fails, expires, is cancelled, needs action, or times out
+class RunException(Exception):
+
+    def __init__(self, message: str, status: str):
+        super().__init__(message)
+        self.status: str = status
\ No newline at end of file
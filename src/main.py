@@ -3,13 +3,30 @@ from extra_streamlit_components import CookieManager
 
 from utils.authentication_utils import register_user, login_user
 from utils.password_utils import hash_password
-from utils.openai_utils import create_thread, delete_assistant
+from utils.openai_utils import get_client
 from managers.database_manager import DatabaseManager
 from managers.thread_manager import ThreadManager
+from exceptions.overloaded_exception import OverloadedException
+from managers.scheduler_manager import get_scheduler
+from managers.pool_manager import get_pool
+from managers.password_manager import get_passwords
+from managers.session_manager import SessionManager, get_sessions
+from managers.quota_manager import QuotaManager, REPLY_WORDS
+from managers.generation_manager import GenerationManager, GENERATION_WORKERS, get_generations
+from exceptions.quota_exception import QuotaException
+from managers.assistant_manager import get_assistants
+from managers.job_manager import get_jobs
+from managers.response_cache_manager import ResponseCache, get_response_cache
+from managers.metrics_manager import METRICS
+from utils.chat_utils import HISTORY_WINDOW, session_user, open_thread, start_turn, check_turn, load_older
 
 import time
+import traceback
 from typing import Set, Union
 
+# Seconds between checks on a reply that's being generated.
+POLL_INTERVAL: float = 0.5
+
 # Metadata
 def configuration() -> None:
     st.set_page_config(
@@ -22,15 +39,47 @@ def header() -> None:
     st.title("Streamlit Chatbot Demo")
     st.subheader("By: Arthur Riechert")
 
-# Whether or not the user is logged in.
-def authenticated(cookie_manager) -> bool:
-    if not cookie_manager.get("logged_in"):
-        
-        return False
+# The shared manager that signs and verifies session tokens
+def sessions_init() -> SessionManager:
 
-    else:
+    settings = st.secrets["authentication"]
+
+    return get_sessions(
+        secret=settings["session_secret"],
+        ttl=settings.get("session_ttl", 86400.0),
+    )
+
+# The claims of the user's verified session, or None if they aren't logged in.
+def authenticated(cookie_manager) -> dict:
+
+    # A token refreshed earlier in this browser session is newer than the cookie.
+    token = st.session_state.get("session") or cookie_manager.get("session")
+
+    return sessions_init().verify(token)
+
+# Signs a new token after a write changed what the session shows. The cookie is saved once at the end of the run.
+def refresh_session(user: dict) -> None:
+    st.session_state["session"] = sessions_init().issue(user)
+
+# Saves a refreshed token to the cookie so it outlives the browser session
+def save_session(cookie_manager: CookieManager) -> None:
+
+    token = st.session_state.get("session")
+
+    if token and token != cookie_manager.get("session"):
+        cookie_manager.set("session", token)
+
+# Logs the user out and refuses their existing tokens
+def end_session(cookie_manager: CookieManager, user_id: str) -> None:
+
+    sessions_init().revoke(user_id)
 
-        return cookie_manager.get("logged_in")["state"]
+    st.session_state.pop("session", None)
+    st.session_state.pop("chat", None)
+    st.session_state.pop("chat_start", None)
+    st.session_state.pop("generation", None)
+
+    cookie_manager.delete("session")
     
 # Checks if the user has a thread
 def thread_init() -> None:
@@ -40,9 +89,128 @@ def thread_init() -> None:
 # Creates the database instance
 def database_init() -> DatabaseManager:
 
-    uri: str = st.secrets["authentication"]["uri"]
+    credentials = st.secrets["authentication"]
+
+    return DatabaseManager(
+        uri=credentials["uri"],
+        max_pool_size=credentials.get("max_pool_size", 100),
+        min_pool_size=credentials.get("min_pool_size", 0),
+    )
+
+# Creates the shared OpenAI client with the configured connection settings
+def openai_init() -> None:
+
+    settings = st.secrets["openai"]
+
+    get_client(
+        api_key=settings["api_key"],
+        max_connections=settings.get("max_connections", 100),
+        max_keepalive_connections=settings.get("max_keepalive_connections", 20),
+        keepalive_expiry=settings.get("keepalive_expiry", 60.0),
+        timeout=settings.get("timeout", 60.0),
+    )
+
+# Creates the shared scheduler for OpenAI calls with the configured limits
+def scheduler_init() -> None:
+
+    settings = st.secrets["openai"]
+
+    get_scheduler(
+        workers=settings.get("workers", 16),
+        requests_per_minute=settings.get("requests_per_minute", 500),
+        tokens_per_minute=settings.get("tokens_per_minute", 150000),
+        max_queue=settings.get("max_queue", 1000),
+    )
+
+# Creates the shared pool of processes that hash passwords
+def passwords_init() -> None:
+
+    settings = st.secrets["authentication"]
+
+    get_passwords(
+        rounds=settings.get("bcrypt_rounds", 12),
+        workers=settings.get("password_workers"),
+        max_queue=settings.get("password_max_queue", 64),
+    )
+
+# Creates the shared pool of ready-made assistants and threads
+def pool_init(db: DatabaseManager) -> None:
+
+    settings = st.secrets["openai"]
+
+    get_pool(
+        db=db,
+        api_key=settings["api_key"],
+        low=settings.get("pool_low", 2),
+        high=settings.get("pool_high", 5),
+        # Shared assistants are never handed out, so only threads are pooled.
+        kinds=("thread",) if settings.get("shared_assistants", 0) else None,
+    )
+
+# Starts the background workers that carry out queued cleanup jobs
+def jobs_init(db: DatabaseManager) -> None:
+
+    settings = st.secrets["openai"]
+
+    get_jobs(
+        db=db,
+        api_key=settings["api_key"],
+        workers=settings.get("job_workers", 4),
+        max_attempts=settings.get("job_max_attempts", 5),
+    )
+
+# Queues the deletion of the user's data, threads and own assistant. Shared assistants outlive their users.
+def queue_wipe(db: DatabaseManager, user: dict) -> None:
+
+    settings = st.secrets["openai"]
+    shared: int = settings.get("shared_assistants", 0)
+    own: bool = not (shared and get_assistants(db, settings["api_key"], shared).is_shared(user["assistant_id"]))
+
+    get_jobs(db, settings["api_key"]).wipe_user(user, delete_assistant=own)
+
+# Returns the shared cache of replies to repeated prompts, or None if it's turned off
+def response_cache_init() -> ResponseCache:
+
+    settings = st.secrets["openai"]
 
-    return DatabaseManager(uri)
+    if not settings.get("response_cache"):
+        return None
+
+    return get_response_cache(
+        kind=settings["response_cache"],
+        uri=st.secrets["authentication"]["uri"],
+        maxsize=settings.get("response_cache_size", 1024),
+        ttl=settings.get("response_cache_ttl", 86400.0),
+        with_context=settings.get("response_cache_with_context", False),
+    )
+
+# Creates the quota engine that reserves each turn's words before the assistant is called
+def quota_init(db: DatabaseManager) -> QuotaManager:
+
+    return QuotaManager(
+        db=db,
+        reply_words=st.secrets["openai"].get("reply_words", REPLY_WORDS),
+    )
+
+# The shared queue that generates replies on its own background workers
+def generations_init(db: DatabaseManager) -> GenerationManager:
+
+    settings = st.secrets["openai"]
+
+    return get_generations(
+        db=db,
+        api_key=settings["api_key"],
+        workers=settings.get("generation_workers", GENERATION_WORKERS),
+        response_cache=response_cache_init(),
+    )
+
+# Starts collecting metrics and serving them to Prometheus, if they're turned on
+def metrics_init() -> None:
+
+    settings = st.secrets.get("metrics", {})
+
+    if settings.get("enabled", False):
+        METRICS.enable(port=settings.get("port", 9464), host=settings.get("host", "localhost"))
 
 # Creates cookie manager instance
 def cookie_init() -> CookieManager:
@@ -52,20 +220,11 @@ def cookie_init() -> CookieManager:
 # Wipes all the user's data
 def wipe_user(user: dict, db: DatabaseManager, cookie_manager: CookieManager) -> None:
 
-    # Data needed to remove from openai platform
-    openai_api_key: str = st.secrets["openai"]["api_key"]
-    assistant_id: str = user["assistant_id"]
-
-    delete_assistant(openai_api_key, assistant_id)
+    # The deletions run in the background so the user isn't kept waiting
+    queue_wipe(db, user)
 
-    user_id: str = user["_id"]
-    db.delete_user(user_id)
-
-    # Reset the cookies
-    cookie_manager.delete("logged_in")
-    
-    updated_cookie: dict = { "state": False, "username": "" }
-    cookie_manager.set("logged_in", updated_cookie)
+    # Log them out
+    end_session(cookie_manager, user["_id"])
 
     st.rerun()
 
@@ -95,16 +254,27 @@ def log_in_user(
 ) -> None:
     with st.spinner("Logging In..."):
 
-        db = DatabaseManager(st.secrets["authentication"]["uri"])
-        
-        if login_user(
-            user=username,
-            password=password,
-            db=db,
-        ):
+        try:
+            success = login_user(
+                user=username,
+                password=password,
+                db=db,
+            )
+
+        except OverloadedException:
+
+            st.warning("Too many people are logging in right now. Please try again.")
+
+            return
+
+        if success:
+
+            # The only read of the user until a write changes them.
+            token = sessions_init().issue(db.get_user(username, history=False))
 
             st.success("You're logged in!")
-            cookie_manager.set("logged_in", { "state": True, "username": username })
+            st.session_state["session"] = token
+            cookie_manager.set("session", token)
             time.sleep(0.5)
             st.rerun()
         
@@ -131,10 +301,18 @@ def login_page(db: DatabaseManager, cookie_manager: CookieManager) -> None:
 def sign_up_user(db: DatabaseManager, username: str, password: str) -> None:
     with st.spinner("Registering..."):
 
-        db = DatabaseManager(st.secrets["authentication"]["uri"])
+        try:
+            hash = hash_password(password)
+
+        except OverloadedException:
+
+            st.warning("Too many people are signing up right now. Please try again.")
+
+            return
+
         success = register_user(
             user=username,
-            hash=hash_password(password),
+            hash=hash,
             db=db
         )
 
@@ -195,8 +373,18 @@ def chat_introduction() -> None:
 
         st.write(f"Hello! How can I help you today, {st.session_state["username"]}?")
 
+# Prepends the next page of older messages to the loaded window
+def load_older_messages(db: DatabaseManager, user: dict) -> None:
+
+    st.session_state["chat_start"] = load_older(db, user["_id"], st.session_state["chat"], st.session_state["chat_start"])
+
 # Assemble's user's previous messages.
-def previous_messages() -> None:
+def previous_messages(db: DatabaseManager, user: dict) -> None:
+
+    # Only the loaded window is rendered; older messages stay in the database until asked for.
+    if st.session_state["chat_start"] > 0:
+        st.button("Load older messages", on_click=load_older_messages, args=(db, user))
+
     chat_history = st.session_state["chat"]
 
     if chat_history:
@@ -211,35 +399,33 @@ def previous_messages() -> None:
 
 
 # Assembles introduction and user's previous messages.
-def display_chat_history() -> None:
+def display_chat_history(db: DatabaseManager, user: dict) -> None:
 
     with st.container():
 
         chat_introduction()
-        previous_messages()
+        previous_messages(db, user)
 
 # Creates a new thread manager
-def chat_init(db: DatabaseManager, cookie_manager: CookieManager) -> Set[Union[dict, ThreadManager]]:
-    user = db.get_user(st.session_state["username"])
-    thread_id = ""
+def chat_init(db: DatabaseManager, cookie_manager: CookieManager, session: dict) -> Set[Union[dict, ThreadManager]]:
+    # Everything needed to render comes from the verified session token.
+    user = session_user(db, session)
+
+    settings = st.secrets["openai"]
 
     # Create thread if one doesn't exist.
     try:
-        if not user["threads"]:
-            thread_id = create_thread(st.secrets["openai"]["api_key"])
-            db.add_thread(user["user"], thread_id)
-        else:
-            thread_id = user["threads"][0]
+        thread, changed = open_thread(db, settings["api_key"], user, settings.get("shared_assistants", 0))
 
-        thread = ThreadManager(
-            api_key=st.secrets["openai"]["api_key"],
-            assistant_id=user["assistant_id"],
-            thread_id=thread_id
-        )
+        if changed:
+            refresh_session(user)
 
-        # Create session variable for chat history if it doesn't exist
+        # Create session variable for chat history if it doesn't exist, with only the latest page
         if not "chat" in st.session_state:
-            st.session_state["chat"] = user["chat_history"]
+            st.session_state["chat"], st.session_state["chat_start"] = db.get_chat_history(
+                user["_id"],
+                limit=HISTORY_WINDOW
+            )
 
         return user, thread
 
@@ -248,61 +434,103 @@ def chat_init(db: DatabaseManager, cookie_manager: CookieManager) -> Set[Union[d
 
         st.warning("You have no more words remaining!")
 
-        print(f"\033[31mError:\n{e.__traceback__}\033[0m")
+        METRICS.inc("chatbot_chat_init_errors_total", error=type(e).__name__)
+
+        print(f"\033[31mError:\n{"".join(traceback.format_exception(e))}\033[0m")
 
 # Detect if the user has gone over limit after receiving response
 def check_assistant_response_length(
     db: DatabaseManager,
     cookie_manager: CookieManager,
     user: dict,
-    remaining_words: int,
-    response_length: int
+    usage: int
 ) -> None:
     
-    if remaining_words < response_length:
+    if usage > user["limit"]:
         with st.spinner("Terminating account; you've exceeded the word limit..."):
             wipe_user(user, db, cookie_manager)
 
-# Display the assistant's response/
-def assistant_response(
+# Shows the reply to the turn running in the background. Only this fragment reruns while it's polled,
+# and the whole page reruns once the turn is over.
+@st.fragment(run_every=POLL_INTERVAL)
+def pending_response(
     db: DatabaseManager,
     cookie_manager: CookieManager,
-    thread: ThreadManager,
-    user: dict,
-    prompt: str, 
-    prompt_length: int,
-    remaining_words: int,
-    chat_history: list
+    user: dict
 ) -> None:
-    
-    with st.spinner("Thinking..."):
+
+    key = st.session_state.get("generation")
+
+    if not key:
+        return
+
+    result = check_turn(db, generations_init(db), user, key)
+
+    # Render what has streamed so far, with a cursor, until the next poll.
+    if result["state"] in ("pending", "running"):
 
         with st.chat_message(name="assistant", avatar="🤖"):
-            
-            response: str = thread.get_response(prompt).data[0].content[0].text.value
-            response_length: int = len(response.split())
-            remaining_words: int = remaining_words - response_length
 
-            db.update_count(id=user["_id"], extra=prompt_length + response_length)
+            if result["partial"]:
+                st.markdown(result["partial"] + "▌")
+            else:
+                st.markdown("Thinking...")
 
-            chat_history.append({"role": "assistant", "content": response})
-            db.update_chat_history(st.session_state["username"], chat_history)
+        return
 
-            st.markdown(response)
+    del st.session_state["generation"]
+    chat_history: list = st.session_state["chat"]
 
-            check_assistant_response_length(db, cookie_manager, user, remaining_words, response_length)
+    # The worker already gave back the reservation, and the usage was read back.
+    if result["state"] == "failed":
 
-# Ensures that current prompt doesn't exceed length limit
-def check_prompt_length(
+        st.session_state["turn_warning"] = "The assistant couldn't answer that. Please try again."
+        chat_history.pop()
+        refresh_session(user)
+
+        st.rerun()
+
+    # The account was wiped while the turn ran.
+    if result["usage"] is None:
+        end_session(cookie_manager, user["_id"])
+        st.rerun()
+
+    # The worker stored the reply and settled the usage, and kept both on this turn's job.
+    chat_history.append({"role": "assistant", "content": result["reply"]})
+    refresh_session(user)
+
+    check_assistant_response_length(db, cookie_manager, user, user["usage"])
+
+    # The reply is rendered with the rest of the history, and the chat input is enabled again.
+    st.rerun()
+
+# Reserves the turn's words and queues its reply, refusing it if they don't fit
+def submit_prompt(
     db: DatabaseManager,
     cookie_manager: CookieManager,
     user: dict,
-    prompt_length: int,
-    remaining_words: int
-):
-    if prompt_length > remaining_words:
-        with st.spinner("Terminating account; you've exceeded the word limit..."):
-            wipe_user(user, db, cookie_manager)
+    thread: ThreadManager,
+    prompt: str,
+    context: list
+) -> str:
+    try:
+        key = start_turn(quota_init(db), generations_init(db), user, thread, prompt, context)
+
+    except QuotaException as e:
+
+        if e.exhausted:
+            with st.spinner("Terminating account; you've exceeded the word limit..."):
+                wipe_user(user, db, cookie_manager)
+
+        # A refusal reads the stored usage, so the session shouldn't keep the stale one.
+        refresh_session(user)
+        st.warning(str(e))
+
+        return None
+
+    refresh_session(user)
+
+    return key
 
 # The processing for the user's prompt.
 def user_prompt(
@@ -311,44 +539,58 @@ def user_prompt(
     user: dict,
     thread: ThreadManager
 ):
-    if prompt := st.chat_input(placeholder="Your message..."):
+    # Only one turn runs at a time.
+    if prompt := st.chat_input(placeholder="Your message...", disabled="generation" in st.session_state):
 
         chat_history: list = st.session_state["chat"]
-        prompt_length = len(prompt)
-        remaining_words = user["limit"] - user["usage"]
 
         with st.chat_message(name="user", avatar="👨"):
 
             st.write(prompt)
             chat_history.append({"role": "user", "content": prompt})
 
-        check_prompt_length(db, cookie_manager, user, prompt_length, remaining_words)
+        # The reply is generated in the background; the page polls for it from the next run on.
+        key = submit_prompt(db, cookie_manager, user, thread, prompt, chat_history[:-1])
+
+        # Refused turns never reach the assistant.
+        if key is None:
+            chat_history.pop()
+            return
 
-        assistant_response(db, cookie_manager, thread, user, prompt, prompt_length, remaining_words, chat_history)
+        st.session_state["generation"] = key
+
+        st.rerun()
         
 # Assembles all chat elements
-def chat(db: DatabaseManager, cookie_manager: CookieManager):
+def chat(db: DatabaseManager, cookie_manager: CookieManager, session: dict) -> dict:
+
+    user, thread = chat_init(db, cookie_manager, session)
 
-    user, thread = chat_init(db, cookie_manager)
+    display_chat_history(db, user)
 
-    display_chat_history()
+    # The fragment only polls while a turn is running.
+    if "generation" in st.session_state:
+        pending_response(db, cookie_manager, user)
+
+    # Why the last turn failed, shown once.
+    if warning := st.session_state.pop("turn_warning", None):
+        st.warning(warning)
 
     user_prompt(db, cookie_manager, user, thread)
                         
     st.markdown(f"Current Usage:`{user["usage"]}`")
 
+    return user
+
 # A button that allows you to wipe all the user's data from the database
-def wipe_button(db: DatabaseManager, cookie_manager: CookieManager) -> None:
+def wipe_button(db: DatabaseManager, cookie_manager: CookieManager, user: dict) -> None:
     if st.button("Wipe Data"):
-        user = db.get_user(st.session_state["username"])
-        delete_assistant(st.secrets["openai"]["api_key"], user["assistant_id"])
-        db.delete_user(user["_id"])
-        cookie_manager.delete("logged_in")
-        cookie_manager.set("logged_in", { "state": False, "username": "" })
+        queue_wipe(db, user)
+        end_session(cookie_manager, user["_id"])
         st.rerun()
 
 # The side bar where some descriptions can be found.
-def side_bar(db: DatabaseManager, cookie_manager: CookieManager) -> None:
+def side_bar(db: DatabaseManager, cookie_manager: CookieManager, user: dict) -> None:
     with st.sidebar:
 
         st.markdown("""
@@ -359,7 +601,7 @@ def side_bar(db: DatabaseManager, cookie_manager: CookieManager) -> None:
         the button below to completely wipe your data from the demo's
         database.**""")
 
-        wipe_button(db, cookie_manager)
+        wipe_button(db, cookie_manager, user)
 
 if __name__ == "__main__":
 
@@ -367,13 +609,22 @@ if __name__ == "__main__":
     header()
 
     thread_init()
+    metrics_init()
 
     db: DatabaseManager = database_init()
+    openai_init()
+    scheduler_init()
+    passwords_init()
+    pool_init(db)
+    jobs_init(db)
     cookie_manager: CookieManager = cookie_init()
     
-    if authenticated(cookie_manager) == False:
+    session = authenticated(cookie_manager)
+
+    if session is None:
         auth_page(db, cookie_manager)
     else:
-        st.session_state["username"] = cookie_manager.get("logged_in")["username"]
-        chat(db, cookie_manager)
-        side_bar(db, cookie_manager)
\ No newline at end of file
+        st.session_state["username"] = session["user"]
+        user = chat(db, cookie_manager, session)
+        side_bar(db, cookie_manager, user)
+        save_session(cookie_manager)
\ No newline at end of file
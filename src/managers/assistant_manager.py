@@ -0,0 +1,158 @@
+from managers.database_manager import DatabaseManager
+from utils.openai_utils import create_assistant, delete_assistant
+
+from threading import Lock
+from zlib import crc32
+
+"""
+A class to share a small, fixed set of assistants between every user.
+Conversations stay isolated because each user still has their own
+thread, so sign-up and wipes no longer create or delete assistants and
+the number of assistants stays bounded. The shared ids are kept in the
+database so every process uses the same ones.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The pool kind the shared assistants are stored under. PoolManager never takes it.
+SHARED_KIND: str = "shared_assistant"
+
+# The scheduler queue the shared assistants are created in.
+SHARED_USER: str = "__shared__"
+
+class AssistantManager:
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        api_key: str,
+        size: int = 1,
+        create: callable = None,
+        delete: callable = None
+    ):
+
+        self.db: DatabaseManager = db
+        self.size: int = max(size, 1)
+        self.create: callable = create or (lambda: create_assistant(api_key, SHARED_USER))
+        self.delete: callable = delete or (lambda assistant_id: delete_assistant(api_key, assistant_id, SHARED_USER))
+
+        self.ids: list = None
+        self.lock: Lock = Lock()
+
+    """
+    Loads the shared assistants, creating any that are missing. If other
+    processes created some at the same time, the oldest are kept and this
+    process deletes the extras it made.
+
+    Returns:
+        list[str]: The shared assistants' ids.
+    """
+    def assistants(self) -> list[str]:
+
+        with self.lock:
+
+            if self.ids is None:
+
+                ids: list = self.db.list_resources(SHARED_KIND)
+                created: list = []
+
+                while len(ids) + len(created) < self.size:
+
+                    assistant_id: str = self.create()
+                    self.db.add_resource(SHARED_KIND, assistant_id)
+                    created.append(assistant_id)
+
+                if created:
+
+                    # Another process may have added some at the same time; the oldest win.
+                    ids = self.db.list_resources(SHARED_KIND)
+
+                    for assistant_id in created:
+
+                        if assistant_id not in ids[:self.size]:
+                            self.db.remove_resource(SHARED_KIND, assistant_id)
+                            self.delete(assistant_id)
+
+                self.ids = ids[:self.size]
+
+            return self.ids
+
+    """
+    Picks the shared assistant for a user. The same username always gets
+    the same one.
+
+    Args:
+        username (str): The user's name.
+
+    Returns:
+        str: The assistant's id.
+    """
+    def assign(self, username: str) -> str:
+
+        ids: list = self.assistants()
+
+        return ids[crc32(username.encode()) % len(ids)]
+
+    """
+    Checks whether an assistant is shared, and so mustn't be deleted with a user.
+
+    Args:
+        assistant_id (str): The assistant's id.
+
+    Returns:
+        bool: Whether it's shared.
+    """
+    def is_shared(self, assistant_id: str) -> bool:
+        return assistant_id in self.assistants()
+
+    """
+    Moves a user who still has their own assistant onto a shared one and
+    queues the old assistant's deletion. Their threads are kept.
+
+    Args:
+        user (dict): The user, with at least `_id`, `user` and `assistant_id`.
+        jobs (JobManager): The queue that deletes the old assistant in the background.
+
+    Returns:
+        str: The assistant the user should use.
+    """
+    def migrate(self, user: dict, jobs: "JobManager") -> str:
+
+        if user.get("assistant_id") in self.assistants():
+            return user["assistant_id"]
+
+        assistant_id: str = self.assign(user["user"])
+        self.db.set_assistant(user["_id"], assistant_id)
+
+        # Concurrent or retried migrations queue the same job once, and one that's already gone counts as deleted.
+        if user.get("assistant_id"):
+            jobs.enqueue("delete_assistant", {"assistant_id": user["assistant_id"]})
+
+        return assistant_id
+
+_assistants: AssistantManager = None
+_assistants_lock: Lock = Lock()
+
+"""
+Returns the process's shared assistants, creating the manager on first
+use. The settings only apply to the call that creates it.
+
+Args:
+    db (DatabaseManager): Where the shared ids are stored.
+    api_key (str): The key to your OpenAI account.
+    size (int): How many assistants to share between users.
+
+Returns:
+    AssistantManager: The shared assistants.
+"""
+def get_assistants(db: DatabaseManager, api_key: str, size: int = 1) -> AssistantManager:
+
+    global _assistants
+
+    with _assistants_lock:
+
+        if _assistants is None:
+            _assistants = AssistantManager(db, api_key, size)
+
+        return _assistants
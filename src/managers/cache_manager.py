@@ -0,0 +1,129 @@
+from threading import RLock
+
+from cachetools import TTLCache
+
+"""
+A class to manage a thread-safe, size-bounded cache whose entries expire
+after a fixed time and are evicted least recently used first.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+_MISSING: object = object()
+
+class CacheManager:
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+
+        self.entries: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.lock: RLock = RLock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    """
+    Looks up an entry and records whether it was a hit or a miss.
+
+    Args:
+        key (any): The key of the entry.
+
+    Returns:
+        any: The cached value, or None if it's missing or expired.
+    """
+    def get(self, key: any) -> any:
+
+        with self.lock:
+
+            value: any = self.entries.get(key, _MISSING)
+
+            if value is _MISSING:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return value
+
+    """
+    Looks up an entry without affecting the statistics.
+
+    Args:
+        key (any): The key of the entry.
+
+    Returns:
+        any: The cached value, or None if it's missing or expired.
+    """
+    def peek(self, key: any) -> any:
+
+        with self.lock:
+            return self.entries.get(key)
+
+    """
+    Stores an entry, evicting the least recently used one if the cache is full.
+
+    Args:
+        key (any): The key of the entry.
+        value (any): The value to store.
+    """
+    def set(self, key: any, value: any) -> None:
+
+        with self.lock:
+            self.entries[key] = value
+
+    """
+    Changes some fields of a cached dict in place, if it's still cached.
+
+    Args:
+        key (any): The key of the entry.
+        fields (dict): The fields to overwrite.
+    """
+    def update(self, key: any, fields: dict) -> None:
+
+        with self.lock:
+
+            value: any = self.entries.get(key)
+
+            if isinstance(value, dict):
+                value.update(fields)
+
+    """
+    Removes an entry if it exists.
+
+    Args:
+        key (any): The key of the entry.
+    """
+    def delete(self, key: any) -> None:
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    """
+    Removes every entry and resets the statistics.
+    """
+    def clear(self) -> None:
+
+        with self.lock:
+
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    """
+    Reports how well the cache is doing.
+
+    Returns:
+        dict: The hits, misses, hit rate, current size and maximum size.
+    """
+    def stats(self) -> dict:
+
+        with self.lock:
+
+            lookups: int = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "maxsize": self.entries.maxsize,
+            }
@@ -1,44 +1,139 @@
 from exceptions.credential_exception import CredentialException
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from pymongo.errors import ConnectionFailure
+from managers.cache_manager import CacheManager
+from managers.metrics_manager import METRICS
+from backends.storage_backend import StorageBackend
+
+from contextlib import contextmanager
+from copy import deepcopy
+from threading import Lock, local
+from typing import Iterator
 
 """
-A class to manage the database connection with MongoDB.
+A class to manage the database connection. Users are stored in MongoDB
+by default, or in SQLite or memory when the URI starts with `sqlite://`
+or `memory://`.
 
 AUTHOR: Arthur Riechert
 VERSION: 1.0.0
 """
 
+# Shared by every DatabaseManager in the process.
+USER_CACHE: CacheManager = CacheManager(maxsize=1024, ttl=60.0)
+
+# The fields loaded for each cached view of a user.
+PROJECTIONS: dict = {
+    "full": {"password": 0},
+    "profile": {"password": 0, "chat_history": 0},
+}
+
+# Embedded backends are shared by URI so every DatabaseManager reuses their connections.
+_embedded_backends: dict = {}
+
 class DatabaseManager:
 
-    def __init__(self, uri: str):
+    def __init__(
+        self,
+        uri: str,
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        cache: CacheManager = USER_CACHE,
+        backend: StorageBackend = None
+    ):
 
-        if not uri:
+        if not uri and backend is None:
             raise CredentialException("No URI provided!")
 
         self.uri: str = uri
-        self.db = self.start_connection()
+        self.max_pool_size: int = max_pool_size
+        self.min_pool_size: int = min_pool_size
+        self.cache: CacheManager = cache
+        self.round_trips: int = 0
+        self.round_trips_lock: Lock = Lock()
 
+        # The counters of the `track` blocks open on each thread.
+        self.tracking: local = local()
+
+        self.db: StorageBackend = backend or self.start_connection()
+        self.db.ensure_indexes()
+
+    """
+    Counts one query to the backend, for the whole manager and for every
+    `track` block open on the calling thread.
     """
-    Initializes the MongoDB database instance.
+    def count_round_trip(self) -> None:
+
+        with self.round_trips_lock:
+            self.round_trips += 1
+
+        for counter in getattr(self.tracking, "counters", ()):
+            counter["round_trips"] += 1
+
+    """
+    Counts the queries the calling thread makes inside the block, and no
+    one else's, so work like a chat turn can be measured while background
+    workers use the same manager.
 
     Returns:
-        Database: An instnace of the MongoDB database.
+        Iterator[dict]: The block's counter, whose `round_trips` grows as queries are made.
     """
-    def start_connection(self) -> any:
+    @contextmanager
+    def track(self) -> Iterator[dict]:
+
+        counter: dict = {"round_trips": 0}
+
+        if not hasattr(self.tracking, "counters"):
+            self.tracking.counters = []
+
+        self.tracking.counters.append(counter)
 
         try:
-            client: MongoClient = MongoClient(self.uri, server_api=ServerApi('1'))
+            yield counter
 
-            client.admin.command('ping')
+        finally:
+            self.tracking.counters.remove(counter)
 
-            return client["demo"]["users"]
-        
-        except ConnectionFailure as e:
+    """
+    Picks the storage backend from the URI's scheme.
+
+    Returns:
+        StorageBackend: The backend every query goes through.
+    """
+    def start_connection(self) -> StorageBackend:
+
+        if self.uri in _embedded_backends:
+            return _embedded_backends[self.uri]
+
+        if self.uri.startswith("sqlite://"):
+
+            from backends.sqlite_backend import SqliteBackend
+
+            return _embedded_backends.setdefault(self.uri, SqliteBackend(self.uri.removeprefix("sqlite://")))
+
+        if self.uri.startswith("memory://"):
+
+            from backends.memory_backend import MemoryBackend
+
+            return _embedded_backends.setdefault(self.uri, MemoryBackend())
 
-            raise ConnectionError(f"Connection failed: {e}")
+        from backends.mongo_backend import MongoBackend
+
+        backend: MongoBackend = MongoBackend(self.uri, self.max_pool_size, self.min_pool_size)
+        self.client = backend.client
+
+        return backend
         
+    """
+    Turns an id that was stored as text back into the backend's form.
+
+    Args:
+        value (str): The id as text.
+
+    Returns:
+        any: The id.
+    """
+    def parse_id(self, value: str) -> any:
+        return self.db.parse_id(value)
+
     """
     Inserts a single document into the database.
 
@@ -47,36 +142,89 @@ class DatabaseManager:
 
     Returns:
         string: The id created for the new entry.
+
+    Raises:
+        DuplicateUserException: If the username is already taken.
     """
+    @METRICS.timed("chatbot_database")
     def insert(self, item: dict) -> str:
-        return self.db.insert_one(item).inserted_id
+
+        self.count_round_trip()
+        return self.db.insert(item)
     
     """
     Retrieves a single document from the database.
 
     Args:
         query (dict): A dict containing query.
+        projection (dict): The fields to include or exclude. Defaults to all of them.
 
     Returns:
         dict: The result of the query.
     """
-    def retrieve(self, query: dict) -> dict:
-        return self.db.find_one(query)
+    @METRICS.timed("chatbot_database")
+    def retrieve(self, query: dict, projection: dict = None) -> dict:
+        self.count_round_trip()
+        return self.db.retrieve(query, projection)
     
     """
-    Finds a single user in the database.
+    Finds a single user, serving it from the user cache when possible.
+    The password hash is never included.
 
     Args:
         username (str): The username that you want to locate.
+        history (bool): Whether to include the chat history.
 
     Returns:
         dict: The user's information.
     """
-    def get_user(self, username: str) -> dict:
-        
-        user = self.retrieve({"user": username})
+    @METRICS.timed("chatbot_database")
+    def get_user(self, username: str, history: bool = True) -> dict:
 
-        return user
+        view: str = "full" if history else "profile"
+        user_id: any = self.cache.get(("name", username))
+        user: dict = self.cache.get(("user", user_id, view)) if user_id is not None else None
+
+        if user is None:
+
+            self.count_round_trip()
+            user = self.db.retrieve({"user": username}, PROJECTIONS[view])
+
+            if user is None:
+                return None
+
+            # Views are keyed by id so writes can drop them without the name. Losing
+            # the name's entry only costs a lookup, never a stale read.
+            self.cache.set(("user", user["_id"], view), user)
+            self.cache.set(("name", username), user["_id"])
+
+        return deepcopy(user)
+
+    """
+    Drops every cached view of a user after a write.
+
+    Args:
+        user_id (str): The id of the user.
+    """
+    def invalidate_user(self, user_id: str) -> None:
+
+        for view in PROJECTIONS:
+            self.cache.delete(("user", user_id, view))
+
+    """
+    Writes a new usage into every cached view of a user.
+
+    Args:
+        user_id (str): The id of the user.
+        usage (int): The usage returned by the database.
+    """
+    def refresh_usage(self, user_id: str, usage: int) -> None:
+
+        if usage is None:
+            return
+
+        for view in PROJECTIONS:
+            self.cache.update(("user", user_id, view), {"usage": usage})
     
     """
     Retrieves a users by id.
@@ -97,17 +245,15 @@ class DatabaseManager:
     Inputs the ids for threads related to an individual.
 
     Args:
-        username (str): The username of the user.
-        item (str): The thread's id.
+        user_id (str): The id of the user.
+        thread_id (str): The thread's id.
     """     
-    def add_thread(self, username: str, thread_id: str) -> None:
+    @METRICS.timed("chatbot_database")
+    def add_thread(self, user_id: str, thread_id: str) -> None:
 
-        user_id = self.get_user(username)["_id"]
-
-        self.db.update_one(
-            {"_id": user_id},
-            {"$push": { "threads": thread_id}}
-        )
+        self.count_round_trip()
+        self.db.add_thread(user_id, thread_id)
+        self.invalidate_user(user_id)
 
     """
     Replaces the current chat history with a new one.
@@ -116,14 +262,51 @@ class DatabaseManager:
         username (str): The username of the person.
         chat_history (list[dict]): The new chat history.
     """
+    @METRICS.timed("chatbot_database")
     def update_chat_history(self, username: str, chat_history: list[dict]) -> None:
 
         user_id = self.get_user(username)["_id"]
 
-        self.db.update_one(
-            {"_id": user_id},
-            {"$set": {"chat_history": chat_history}}
-        )
+        self.count_round_trip()
+        self.db.update_chat_history(user_id, chat_history)
+        self.invalidate_user(user_id)
+
+    """
+    Appends new messages to the end of a user's chat history, leaving the
+    messages already stored untouched.
+
+    Args:
+        user_id (str): The id of the user.
+        messages (list[dict]): The messages from the latest turn, oldest first.
+    """
+    @METRICS.timed("chatbot_database")
+    def append_chat_history(self, user_id: str, messages: list[dict]) -> None:
+
+        if not messages:
+            return
+
+        self.count_round_trip()
+        self.db.append_chat_history(user_id, messages)
+        self.invalidate_user(user_id)
+
+    """
+    Reads one page of a user's chat history, counting back from the newest
+    message. Pass the returned start index as `before` to get the next
+    older page.
+
+    Args:
+        user_id (str): The id of the user.
+        limit (int): The most messages to return.
+        before (int): Only return messages stored before this index. Defaults to the end.
+
+    Returns:
+        tuple[list[dict], int]: The messages, oldest first, and the index of the first one.
+    """
+    @METRICS.timed("chatbot_database")
+    def get_chat_history(self, user_id: str, limit: int = 50, before: int = None) -> tuple[list[dict], int]:
+
+        self.count_round_trip()
+        return self.db.get_chat_history(user_id, limit, before)
 
     """
     Removes the user based on id.
@@ -131,23 +314,303 @@ class DatabaseManager:
     Args:
         user_id (str): The id of the user to be deleted.
     """
+    @METRICS.timed("chatbot_database")
     def delete_user(self, user_id: str) -> None:
-        self.db.delete_one({"_id": user_id})
+        self.count_round_trip()
+        self.db.delete_user(user_id)
+        self.invalidate_user(user_id)
 
     """
-    Adds an extra amount of the current usage of the user.
+    Atomically adds an extra amount to the current usage of the user.
 
     Args:
         id (str): The id of the user.
         extra (int): The amount to add.
+
+    Returns:
+        int: The user's usage after the increment, or None if the user doesn't exist.
     """
-    def update_count(self, id: str, extra: int) -> None:
+    @METRICS.timed("chatbot_database")
+    def update_count(self, id: str, extra: int) -> int:
 
-        user: dict = self.db.find_one({"_id": id})
+        self.count_round_trip()
+        usage: int = self.db.update_count(id, extra)
+        self.refresh_usage(id, usage)
 
-        current_count: int = user["usage"] + extra
-        
-        self.db.update_one(
-            {"_id": id},
-            {"$set": {"usage": current_count}}
-        )
\ No newline at end of file
+        return usage
+
+    """
+    Atomically adds to the user's usage only if the result stays within
+    their limit.
+
+    Args:
+        id (str): The id of the user.
+        amount (int): The amount to reserve.
+
+    Returns:
+        int: The user's usage after the reservation, or None if it would exceed the limit.
+    """
+    @METRICS.timed("chatbot_database")
+    def reserve_usage(self, id: str, amount: int) -> int:
+
+        self.count_round_trip()
+        usage: int = self.db.update_count(id, amount, within_limit=True)
+        self.refresh_usage(id, usage)
+
+        return usage
+
+    """
+    Persists everything a finished chat turn changes in one update: the
+    usage increment, the new messages, and the thread the turn ran on.
+
+    Args:
+        user_id (str): The id of the user.
+        messages (list[dict]): The messages from the turn, oldest first.
+        extra (int): The amount to add to the user's usage.
+        thread_id (str): The thread the turn ran on. It's only added if it isn't registered yet.
+
+    Returns:
+        int: The user's usage after the turn, or None if the user doesn't exist.
+    """
+    @METRICS.timed("chatbot_database")
+    def record_turn(self, user_id: str, messages: list[dict], extra: int, thread_id: str = None) -> int:
+
+        self.count_round_trip()
+        usage: int = self.db.record_turn(user_id, messages, extra, thread_id)
+        self.invalidate_user(user_id)
+
+        return usage
+
+    """
+    Moves a user onto a different assistant.
+
+    Args:
+        user_id (str): The id of the user.
+        assistant_id (str): The assistant's id.
+    """
+    @METRICS.timed("chatbot_database")
+    def set_assistant(self, user_id: str, assistant_id: str) -> None:
+
+        self.count_round_trip()
+        self.db.set_assistant(user_id, assistant_id)
+        self.invalidate_user(user_id)
+
+    """
+    Replaces a user's password hash. Cached views never hold it, so they stay valid.
+
+    Args:
+        user_id (str): The id of the user.
+        password (bytes): The new hash.
+    """
+    @METRICS.timed("chatbot_database")
+    def set_password(self, user_id: str, password: bytes) -> None:
+        self.count_round_trip()
+        self.db.set_password(user_id, password)
+
+    """
+    Adds a ready-made assistant or thread to the shared pool.
+
+    Args:
+        kind (str): What the resource is, like "assistant" or "thread".
+        resource_id (str): Its id.
+    """
+    @METRICS.timed("chatbot_database")
+    def add_resource(self, kind: str, resource_id: str) -> None:
+        self.count_round_trip()
+        self.db.add_resource(kind, resource_id)
+
+    """
+    Takes the oldest pooled resource of a kind.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        str: Its id, or None if the pool is empty.
+    """
+    @METRICS.timed("chatbot_database")
+    def take_resource(self, kind: str) -> str:
+        self.count_round_trip()
+        return self.db.take_resource(kind)
+
+    """
+    Removes a specific resource from the pool.
+
+    Args:
+        kind (str): What the resource is.
+        resource_id (str): Its id.
+
+    Returns:
+        bool: Whether it was still in the pool.
+    """
+    @METRICS.timed("chatbot_database")
+    def remove_resource(self, kind: str, resource_id: str) -> bool:
+        self.count_round_trip()
+        return self.db.remove_resource(kind, resource_id)
+
+    """
+    Counts the pooled resources of a kind.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        int: How many are waiting to be taken.
+    """
+    @METRICS.timed("chatbot_database")
+    def count_resources(self, kind: str) -> int:
+        self.count_round_trip()
+        return self.db.count_resources(kind)
+
+    """
+    Lists the pooled resources of a kind without taking them.
+
+    Args:
+        kind (str): What the resource is.
+
+    Returns:
+        list[str]: Their ids, oldest first.
+    """
+    @METRICS.timed("chatbot_database")
+    def list_resources(self, kind: str) -> list[str]:
+        self.count_round_trip()
+        return self.db.list_resources(kind)
+
+    """
+    Queues a background job, unless the same job is already queued.
+
+    Args:
+        key (str): What makes the job unique.
+        kind (str): Which handler runs it.
+        payload (dict): The handler's keyword arguments.
+        run_at (float): The earliest time it may run, as a Unix timestamp.
+    """
+    @METRICS.timed("chatbot_database")
+    def enqueue_job(self, key: str, kind: str, payload: dict, run_at: float) -> None:
+        self.count_round_trip()
+        self.db.enqueue_job(key, kind, payload, run_at)
+
+    """
+    Claims the next job that's due.
+
+    Args:
+        now (float): The current Unix timestamp.
+        lease (float): Seconds until another worker may claim it again.
+        kinds (list[str]): Only claim jobs of these kinds.
+        owner (str): A token unique to this claim.
+
+    Returns:
+        dict: The job, or None if nothing is due.
+    """
+    @METRICS.timed("chatbot_database")
+    def claim_job(self, now: float, lease: float, kinds: list[str], owner: str) -> dict:
+        self.count_round_trip()
+        return self.db.claim_job(now, lease, kinds, owner)
+
+    """
+    Extends the lease on a job the claim still holds.
+
+    Args:
+        job_id (any): The job's id.
+        owner (str): The claim's token.
+        lease_until (float): When another worker may claim it again, as a Unix timestamp.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @METRICS.timed("chatbot_database")
+    def renew_job(self, job_id: any, owner: str, lease_until: float) -> bool:
+        self.count_round_trip()
+        return self.db.renew_job(job_id, owner, lease_until)
+
+    """
+    Removes a job that succeeded, or whose outcome was read.
+
+    Args:
+        job_id (any): The job's id.
+        owner (str): Only remove it while this claim holds it.
+
+    Returns:
+        bool: Whether it was removed.
+    """
+    @METRICS.timed("chatbot_database")
+    def finish_job(self, job_id: any, owner: str = None) -> bool:
+        self.count_round_trip()
+        return self.db.finish_job(job_id, owner)
+
+    """
+    Marks a job that succeeded as done, keeping its result.
+
+    Args:
+        job_id (any): The job's id.
+        result (dict): What the job produced.
+        owner (str): The claim's token.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @METRICS.timed("chatbot_database")
+    def complete_job(self, job_id: any, result: dict, owner: str) -> bool:
+        self.count_round_trip()
+        return self.db.complete_job(job_id, result, owner)
+
+    """
+    Puts a job that failed back in the queue.
+
+    Args:
+        job_id (any): The job's id.
+        run_at (float): When to try again, as a Unix timestamp.
+        error (str): Why it failed.
+        owner (str): The claim's token.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @METRICS.timed("chatbot_database")
+    def retry_job(self, job_id: any, run_at: float, error: str, owner: str) -> bool:
+        self.count_round_trip()
+        return self.db.retry_job(job_id, run_at, error, owner)
+
+    """
+    Marks a job as failed for good.
+
+    Args:
+        job_id (any): The job's id.
+        error (str): Why it failed.
+        owner (str): The claim's token.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    @METRICS.timed("chatbot_database")
+    def fail_job(self, job_id: any, error: str, owner: str) -> bool:
+        self.count_round_trip()
+        return self.db.fail_job(job_id, error, owner)
+
+    """
+    Looks up a job by its key.
+
+    Args:
+        key (str): The job's key.
+
+    Returns:
+        dict: The job's status, attempts, error and result, or None if there's no such job.
+    """
+    @METRICS.timed("chatbot_database")
+    def get_job(self, key: str) -> dict:
+        self.count_round_trip()
+        return self.db.get_job(key)
+
+    """
+    Counts the jobs with a status.
+
+    Args:
+        status (str): "pending", "running", "done" or "failed".
+
+    Returns:
+        int: How many there are.
+    """
+    @METRICS.timed("chatbot_database")
+    def count_jobs(self, status: str) -> int:
+        self.count_round_trip()
+        return self.db.count_jobs(status)
@@ -0,0 +1,248 @@
+from managers.database_manager import DatabaseManager
+from managers.job_manager import JobManager
+from managers.thread_manager import ThreadManager
+from managers.quota_manager import QuotaManager
+from managers.cache_manager import CacheManager
+from managers.response_cache_manager import ResponseCache, context_digest
+from exceptions.run_exception import RunException
+
+import atexit
+import time
+from threading import Lock
+from typing import Iterator
+from uuid import uuid4
+
+"""
+A class to generate replies as background jobs, so a chat turn doesn't
+hold the Streamlit script thread and isn't lost if the user reruns or
+closes the tab. The worker that runs a turn records the prompt, the reply
+and the usage itself, and keeps the reply and usage on the turn's job;
+the page only polls for the outcome. Turns run on their own workers, one
+per concurrent chat, so they never wait behind cleanup jobs or the
+other way around.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The reply streamed so far for each turn running in this process, by job key.
+PROGRESS: CacheManager = CacheManager(maxsize=1024, ttl=600.0)
+
+# How many turns can run at once in a process, by default.
+GENERATION_WORKERS: int = 32
+
+# Seconds a turn may stream before it's given up on.
+TURN_TIMEOUT: float = 120.0
+
+# How long a turn's lease outlasts its deadline, since a stalled read only
+# sees the deadline once the OpenAI client's own timeout ends it.
+LEASE_MARGIN: float = 60.0
+
+class GenerationManager:
+
+    def __init__(self, jobs: JobManager, response_cache: ResponseCache = None, timeout: float = TURN_TIMEOUT):
+
+        self.jobs: JobManager = jobs
+        self.response_cache: ResponseCache = response_cache
+        self.timeout: float = timeout
+
+        # A turn posts to the thread, so it's never repeated. Its lease outlasts
+        # the deadline, so only a worker that stopped can lose it, and then the
+        # reservation is given back even though the turn never finished.
+        self.jobs.register(
+            "generate",
+            self.generate,
+            max_attempts=1,
+            lease=timeout + LEASE_MARGIN,
+            on_failure=self.release
+        )
+
+    """
+    Queues a chat turn whose words have already been reserved.
+
+    Args:
+        user (dict): The user, with `_id` and `user`.
+        thread (ThreadManager): The user's thread.
+        prompt (str): The user's message.
+        context (list[dict]): The chat history before the message.
+        reserved (int): The amount the quota reserved for the turn.
+
+    Returns:
+        str: The job's key, to poll with `result`.
+    """
+    def submit(self, user: dict, thread: ThreadManager, prompt: str, context: list[dict], reserved: int) -> str:
+
+        key: str = f"generate:{uuid4().hex}"
+
+        self.jobs.enqueue("generate", {
+            "key": key,
+            "user_id": user["_id"],
+            "username": user["user"],
+            "assistant_id": thread.assistant_id,
+            "thread_id": thread.thread_id,
+            "prompt": prompt,
+            # The history is already stored; the cache only needs to tell it apart.
+            "context": context_digest(context),
+            "reserved": reserved,
+        }, key=key)
+
+        return key
+
+    """
+    Runs a chat turn on a worker and records it. If the assistant doesn't
+    answer in time, the job fails and `release` gives back the reservation.
+
+    Args:
+        key (str): The job's key.
+        user_id (any): The id of the user.
+        username (str): The user's name, so the scheduler can queue fairly.
+        assistant_id (str): The assistant to run.
+        thread_id (str): The user's thread.
+        prompt (str): The user's message.
+        context (str): The digest of the chat history before the message.
+        reserved (int): The amount the quota reserved for the turn.
+
+    Returns:
+        dict: The `reply` and the user's `usage` afterwards, kept on the job for `result`.
+
+    Raises:
+        RunException: If the run fails, passes its deadline or the job is taken over.
+    """
+    def generate(
+        self,
+        key: str,
+        user_id: any,
+        username: str,
+        assistant_id: str,
+        thread_id: str,
+        prompt: str,
+        context: str,
+        reserved: int
+    ) -> dict:
+
+        thread: ThreadManager = ThreadManager(
+            api_key=self.jobs.api_key,
+            assistant_id=assistant_id,
+            thread_id=thread_id,
+            user=username,
+            response_cache=self.response_cache
+        )
+
+        stream: Iterator[str] = thread.stream_response(prompt, context)
+        deadline: float = time.monotonic() + self.timeout
+        response: str = ""
+
+        try:
+            for delta in stream:
+
+                response += delta
+                PROGRESS.set(key, response)
+
+                if time.monotonic() > deadline:
+                    raise RunException(f"Turn {key} took longer than {self.timeout}s.", "timeout")
+
+        finally:
+            stream.close()
+            PROGRESS.delete(key)
+
+        # A worker that stalled past its lease mustn't charge a turn whose reservation was already given back.
+        if not self.jobs.renew():
+            raise RunException(f"Turn {key} lost its lease to another worker.", "expired")
+
+        usage: int = QuotaManager(self.jobs.db).settle({"_id": user_id}, reserved, [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": response},
+        ], thread_id)
+
+        return {"reply": response, "usage": usage}
+
+    """
+    Gives back the reservation of a turn that failed for good, whether it
+    raised or its worker stopped before finishing. Nothing was answered, so
+    none of it is spent.
+
+    Args:
+        user_id (any): The id of the user.
+        reserved (int): The amount the quota reserved for the turn.
+        **payload: The rest of the job's payload.
+    """
+    def release(self, user_id: any, reserved: int, **payload) -> None:
+        QuotaManager(self.jobs.db).release({"_id": user_id}, reserved)
+
+    """
+    Checks on a queued turn. Its outcome is only reported once.
+
+    Args:
+        key (str): The job's key.
+
+    Returns:
+        dict: Its `state`, one of "pending", "running", "done" or "failed", with the `partial` reply streamed so far, the `reply` and `usage`, or the `error`.
+    """
+    def result(self, key: str) -> dict:
+
+        job: dict = self.jobs.status(key)
+
+        if job is None:
+            return {"state": "failed", "error": "The turn couldn't be found."}
+
+        if job["status"] == "done":
+
+            self.jobs.db.finish_job(job["_id"])
+
+            return {"state": "done", **job["result"]}
+
+        if job["status"] == "failed":
+
+            self.jobs.db.finish_job(job["_id"])
+
+            return {"state": "failed", "error": job["error"]}
+
+        return {"state": job["status"], "partial": PROGRESS.peek(key) or ""}
+
+_generations: GenerationManager = None
+_generations_lock: Lock = Lock()
+
+"""
+Returns the generation queue shared by the whole process, starting its
+workers on first use. They only run turns; cleanup jobs have their own.
+The settings only apply to the call that creates it.
+
+Args:
+    db (DatabaseManager): Where the turns are queued.
+    api_key (str): The key to your OpenAI account.
+    workers (int): How many turns can run at once.
+    response_cache (ResponseCache): Reuses replies to repeated prompts, if given.
+
+Returns:
+    GenerationManager: The shared generation queue.
+"""
+def get_generations(
+    db: DatabaseManager,
+    api_key: str,
+    workers: int = GENERATION_WORKERS,
+    response_cache: ResponseCache = None
+) -> GenerationManager:
+
+    global _generations
+
+    with _generations_lock:
+
+        if _generations is None:
+            _generations = GenerationManager(JobManager(db, api_key, workers, handlers={}), response_cache)
+
+        return _generations
+
+"""
+Stops the shared generation queue. Runs automatically when the process exits.
+"""
+def shutdown_generations() -> None:
+
+    global _generations
+
+    with _generations_lock:
+
+        if _generations is not None:
+            _generations.jobs.shutdown(wait=False)
+            _generations = None
+
+atexit.register(shutdown_generations)
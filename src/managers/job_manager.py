@@ -0,0 +1,522 @@
+from managers.database_manager import DatabaseManager
+from managers.assistant_manager import SHARED_KIND
+from utils.openai_utils import (
+    ASSISTANT_METADATA,
+    delete_assistant,
+    delete_thread,
+    list_assistants,
+)
+from openai import NotFoundError
+
+import argparse
+import atexit
+import time
+from threading import Event, Lock, Thread, local
+from uuid import uuid4
+
+"""
+A class to run slow work, like wiping an account, in the background.
+Jobs are stored in the database so they survive restarts and can be
+picked up by any process, and a pool of worker threads runs them with
+retries. The built-in cleanup jobs are safe to run more than once; other
+parts of the app can register their own kinds.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The scheduler queue the jobs' OpenAI calls wait in.
+JOB_USER: str = "__jobs__"
+
+class JobManager:
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        api_key: str,
+        workers: int = 4,
+        max_attempts: int = 5,
+        base_delay: float = 2.0,
+        max_delay: float = 300.0,
+        lease: float = 300.0,
+        interval: float = 1.0,
+        handlers: dict = None
+    ):
+
+        self.db: DatabaseManager = db
+        self.api_key: str = api_key
+        self.max_attempts: int = max_attempts
+        self.base_delay: float = base_delay
+        self.max_delay: float = max_delay
+        self.lease: float = lease
+        self.interval: float = interval
+
+        # The function that runs each kind of job, called with its payload.
+        # An empty dict gives workers that only run the kinds registered later.
+        self.handlers: dict = handlers if handlers is not None else {
+            "delete_user": self.delete_user,
+            "delete_assistant": self.delete_assistant,
+            "delete_thread": self.delete_thread,
+            "sweep": self.sweep_assistants,
+        }
+
+        # Kinds that may only be tried a set number of times, like ones that aren't safe to repeat.
+        self.attempts: dict = {}
+
+        # Kinds whose jobs run longer or shorter than the queue's lease.
+        self.leases: dict = {}
+
+        # What undoes a kind's work once one of its jobs fails for good, called with the payload.
+        self.failure_handlers: dict = {}
+
+        self.completed: int = 0
+        self.retried: int = 0
+        self.failed: int = 0
+        self.lost: int = 0
+        self.lock: Lock = Lock()
+
+        # The queries each kind's jobs made, not counting the claims that found them.
+        self.round_trips: dict = {}
+
+        # The job each worker thread is running, so its handler can renew the lease.
+        self.running: local = local()
+
+        self.wanted: Event = Event()
+        self.stopped: Event = Event()
+        self.threads: list = [
+            Thread(target=self.work, name=f"jobs-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+    """
+    Adds a kind of job, so other parts of the app can run their work on
+    the same workers.
+
+    Args:
+        kind (str): The kind's name.
+        handler (callable): Runs a job, called with its payload. A dict it returns is kept on the job until it's read.
+        max_attempts (int): How many times a job of this kind may be tried. Defaults to the queue's setting.
+        lease (float): Seconds a worker has to finish a job of this kind. Defaults to the queue's setting.
+        on_failure (callable): Called with a job's payload once it fails for good, even if its handler never ran.
+    """
+    def register(
+        self,
+        kind: str,
+        handler: callable,
+        max_attempts: int = None,
+        lease: float = None,
+        on_failure: callable = None
+    ) -> None:
+
+        self.handlers[kind] = handler
+
+        if max_attempts is not None:
+            self.attempts[kind] = max_attempts
+
+        if lease is not None:
+            self.leases[kind] = lease
+
+        if on_failure is not None:
+            self.failure_handlers[kind] = on_failure
+
+    """
+    Looks up a queued job by its key. Jobs that succeeded are gone, unless
+    they returned a result.
+
+    Args:
+        key (str): The job's key.
+
+    Returns:
+        dict: The job's `_id`, `status`, `attempts`, `error` and `result`, or None if it isn't queued.
+    """
+    def status(self, key: str) -> dict:
+        return self.db.get_job(key)
+
+    """
+    Queues a job. A job with the same key that's still queued isn't
+    queued twice.
+
+    Args:
+        kind (str): Which handler runs it.
+        payload (dict): The handler's keyword arguments.
+        key (str): What makes the job unique. Defaults to the kind and payload values.
+        delay (float): Seconds to wait before running it.
+    """
+    def enqueue(self, kind: str, payload: dict, key: str = None, delay: float = 0.0) -> None:
+
+        key = key or ":".join([kind, *(str(value) for value in payload.values())])
+
+        self.db.enqueue_job(key, kind, payload, time.time() + delay)
+        self.wanted.set()
+
+    """
+    Queues everything needed to remove a user: their data, their threads
+    and, unless it's shared, their assistant.
+
+    Args:
+        user (dict): The user, with `_id`, `assistant_id` and `threads`.
+        delete_assistant (bool): Whether the assistant belongs to the user alone.
+    """
+    def wipe_user(self, user: dict, delete_assistant: bool = True) -> None:
+
+        self.enqueue("delete_user", {"user_id": user["_id"]})
+
+        for thread_id in user.get("threads", []):
+            self.enqueue("delete_thread", {"thread_id": thread_id})
+
+        if delete_assistant and user.get("assistant_id"):
+            self.enqueue("delete_assistant", {"assistant_id": user["assistant_id"]})
+
+    """
+    Queues a sweep that deletes this app's assistants nobody uses anymore.
+
+    Args:
+        min_age (float): Skip assistants younger than this many seconds, since they may be mid-sign-up.
+    """
+    def sweep(self, min_age: float = 3600.0) -> None:
+        self.enqueue("sweep", {"min_age": min_age}, key="sweep")
+
+    """
+    Claims the next job that's due, leased for as long as its kind needs.
+    Each claim has its own owner token, and only that claim may record
+    the job's outcome.
+
+    Returns:
+        dict: The job, with its `owner` token, or None if nothing is due.
+    """
+    def claim(self) -> dict:
+
+        # Other processes may run kinds this one hasn't registered.
+        groups: dict = {}
+
+        for kind in self.handlers:
+            groups.setdefault(self.leases.get(kind, self.lease), []).append(kind)
+
+        for lease, kinds in groups.items():
+
+            job: dict = self.db.claim_job(time.time(), lease, kinds, uuid4().hex)
+
+            if job is not None:
+                return job
+
+        return None
+
+    """
+    Extends the lease on a job for as long as its kind needs, as long as
+    its claim still holds it. Handlers call it on the worker running them,
+    right before work that mustn't happen twice, so it can't be claimed
+    again while that work is done.
+
+    Args:
+        job (dict): The job. Defaults to the one this worker thread is running.
+
+    Returns:
+        bool: Whether the claim still held the job.
+    """
+    def renew(self, job: dict = None) -> bool:
+
+        job = job or getattr(self.running, "job", None)
+
+        if job is None:
+            return False
+
+        lease: float = self.leases.get(job["kind"], self.lease)
+
+        return self.db.renew_job(job["_id"], job["owner"], time.time() + lease)
+
+    """
+    Counts and reports a job whose lease ran out before its worker
+    recorded the outcome. The claim that took it over decides what happens.
+
+    Args:
+        job (dict): The job.
+    """
+    def lose(self, job: dict) -> None:
+
+        with self.lock:
+            self.lost += 1
+
+        print(f"\033[33mJob {job['key']} lost its lease; another worker took it over.\033[0m")
+
+    """
+    Claims and runs the next job that's due, if there is one.
+
+    Returns:
+        bool: Whether a job was run.
+    """
+    def run_next(self) -> bool:
+
+        job: dict = self.claim()
+
+        if job is None:
+            return False
+
+        # Only the job's own queries are counted, not the claims that found it.
+        with self.db.track() as counter:
+            self.run(job)
+
+        with self.lock:
+            self.round_trips[job["kind"]] = self.round_trips.get(job["kind"], 0) + counter["round_trips"]
+
+        return True
+
+    """
+    Runs a claimed job and records its outcome, as long as its claim still
+    holds it.
+
+    Args:
+        job (dict): The job, as claimed.
+    """
+    def run(self, job: dict) -> None:
+
+        handler: callable = self.handlers.get(job["kind"])
+        max_attempts: int = self.attempts.get(job["kind"], self.max_attempts)
+        self.running.job = job
+
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown job kind: {job['kind']}")
+
+            # Its lease ran out while a worker that has since stopped was running it.
+            if job["attempts"] > max_attempts:
+                raise RuntimeError("The job was interrupted and can't be tried again.")
+
+            result: dict = handler(**job["payload"])
+
+        except Exception as e:
+
+            error: str = f"{type(e).__name__}: {e}"
+
+            if handler is None or job["attempts"] >= max_attempts:
+
+                # Whoever took the job over undoes its work instead, so it's never undone twice.
+                if not self.renew(job):
+                    self.lose(job)
+                    return
+
+                on_failure: callable = self.failure_handlers.get(job["kind"])
+
+                # If this raises, the job stays claimed and fails again once its lease runs out.
+                if on_failure is not None:
+                    on_failure(**job["payload"])
+
+                if not self.db.fail_job(job["_id"], error, job["owner"]):
+                    self.lose(job)
+                    return
+
+                with self.lock:
+                    self.failed += 1
+
+                print(f"\033[31mJob {job['key']} failed:\n{error}\033[0m")
+
+            else:
+
+                delay: float = min(self.base_delay * 2 ** (job["attempts"] - 1), self.max_delay)
+
+                if not self.db.retry_job(job["_id"], time.time() + delay, error, job["owner"]):
+                    self.lose(job)
+                    return
+
+                with self.lock:
+                    self.retried += 1
+
+            return
+
+        finally:
+            self.running.job = None
+
+        if result is None:
+            held: bool = self.db.finish_job(job["_id"], job["owner"])
+        else:
+            held = self.db.complete_job(job["_id"], result, job["owner"])
+
+        if not held:
+            self.lose(job)
+            return
+
+        with self.lock:
+            self.completed += 1
+
+    """
+    The loop each worker runs until shutdown.
+    """
+    def work(self) -> None:
+
+        while not self.stopped.is_set():
+
+            try:
+                if self.run_next():
+                    continue
+
+            except Exception as e:
+
+                # The database or a failure handler failed; try again on the next pass.
+                print(f"\033[31mError running the job queue:\n{e}\033[0m")
+
+            self.wanted.wait(self.interval)
+            self.wanted.clear()
+
+    """
+    Deletes a user's data.
+
+    Args:
+        user_id (any): The id of the user.
+    """
+    def delete_user(self, user_id: any) -> None:
+        self.db.delete_user(user_id)
+
+    """
+    Deletes an assistant. One that's already gone counts as deleted.
+
+    Args:
+        assistant_id (str): The assistant's id.
+    """
+    def delete_assistant(self, assistant_id: str) -> None:
+
+        try:
+            delete_assistant(self.api_key, assistant_id, JOB_USER)
+
+        except NotFoundError:
+            pass
+
+    """
+    Deletes a thread. One that's already gone counts as deleted.
+
+    Args:
+        thread_id (str): The thread's id.
+    """
+    def delete_thread(self, thread_id: str) -> None:
+
+        try:
+            delete_thread(self.api_key, thread_id, JOB_USER)
+
+        except NotFoundError:
+            pass
+
+    """
+    Queues the deletion of every assistant this app created that no user,
+    pool or shared set refers to. OpenAI can't list threads, so orphaned
+    threads can't be swept.
+
+    Args:
+        min_age (float): Skip assistants younger than this many seconds.
+    """
+    def sweep_assistants(self, min_age: float) -> None:
+
+        in_use: set = set(self.db.list_resources("assistant")) | set(self.db.list_resources(SHARED_KIND))
+        cutoff: float = time.time() - min_age
+
+        for assistant in list_assistants(self.api_key, JOB_USER):
+
+            # Only tagged assistants are ours. Untagged ones may belong to anyone sharing the account.
+            ours: bool = (assistant.metadata or {}).get("app") == ASSISTANT_METADATA["app"]
+
+            if not ours or assistant.created_at > cutoff or assistant.id in in_use:
+                continue
+
+            if self.db.retrieve({"assistant_id": assistant.id}, {"_id": 1}) is None:
+                self.enqueue("delete_assistant", {"assistant_id": assistant.id})
+
+    """
+    Reports how the queue is doing.
+
+    Returns:
+        dict: Jobs completed, retried, failed and lost to another worker by this process, their database round trips by kind, and the queue's size by status.
+    """
+    def metrics(self) -> dict:
+
+        with self.lock:
+
+            counts: dict = {
+                "completed": self.completed,
+                "retried": self.retried,
+                "failed": self.failed,
+                "lost": self.lost,
+                "round_trips": dict(self.round_trips),
+            }
+
+        return {
+            **counts,
+            "queued": {status: self.db.count_jobs(status) for status in ("pending", "running", "failed")},
+        }
+
+    """
+    Stops the workers. Queued jobs stay in the database for the next start.
+
+    Args:
+        wait (bool): Whether to wait for running jobs to finish.
+    """
+    def shutdown(self, wait: bool = True) -> None:
+
+        self.stopped.set()
+        self.wanted.set()
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+_jobs: JobManager = None
+_jobs_lock: Lock = Lock()
+
+"""
+Returns the job queue shared by the whole process, starting its workers
+on first use. The settings only apply to the call that creates it.
+
+Args:
+    db (DatabaseManager): Where the jobs are stored.
+    api_key (str): The key to your OpenAI account.
+    workers (int): How many jobs can run at once.
+    max_attempts (int): How many times a job is tried before it's marked as failed.
+
+Returns:
+    JobManager: The shared job queue.
+"""
+def get_jobs(db: DatabaseManager, api_key: str, workers: int = 4, max_attempts: int = 5) -> JobManager:
+
+    global _jobs
+
+    with _jobs_lock:
+
+        if _jobs is None:
+            _jobs = JobManager(db, api_key, workers, max_attempts)
+
+        return _jobs
+
+"""
+Stops the shared job queue. Runs automatically when the process exits.
+"""
+def shutdown_jobs() -> None:
+
+    global _jobs
+
+    with _jobs_lock:
+
+        if _jobs is not None:
+            _jobs.shutdown(wait=False)
+            _jobs = None
+
+atexit.register(shutdown_jobs)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run queued cleanup jobs until the queue is empty.")
+    parser.add_argument("--uri", required=True)
+    parser.add_argument("--api-key", required=True)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--sweep", action="store_true", help="Also delete orphaned assistants.")
+    parser.add_argument("--min-age", type=float, default=3600.0)
+    args = parser.parse_args()
+
+    jobs: JobManager = get_jobs(DatabaseManager(args.uri), args.api_key, args.workers)
+
+    if args.sweep:
+        jobs.sweep(args.min_age)
+
+    # Retries scheduled for later keep the queue busy until they're done or fail.
+    while jobs.db.count_jobs("pending") or jobs.db.count_jobs("running"):
+        time.sleep(jobs.interval)
+
+    print(jobs.metrics())
@@ -0,0 +1,347 @@
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import time
+
+"""
+A class to collect counters, gauges and latency histograms for the hot
+paths, such as database queries, OpenAI calls, runs and password checks,
+and to serve them in Prometheus' text format. Collection is off until
+`enable` is called; until then every call returns straight away.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# Upper bounds, in seconds, of the latency buckets.
+LATENCY_BUCKETS: tuple = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Upper bounds of the buckets for counts, like polls per run.
+COUNT_BUCKETS: tuple = (0, 1, 2, 4, 8, 16, 32, 64)
+
+"""
+Escapes a label value for the text format.
+
+Args:
+    value (any): The value.
+
+Returns:
+    str: The escaped value.
+"""
+def _escape(value: any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+"""
+Formats a metric's labels for the text format.
+
+Args:
+    labels (tuple): (name, value) pairs, sorted by name.
+
+Returns:
+    str: The labels in braces, or nothing without labels.
+"""
+def _labels(labels: tuple) -> str:
+
+    if not labels:
+        return ""
+
+    return "{" + ",".join(f"{name}=\"{_escape(value)}\"" for name, value in labels) + "}"
+
+class _Tracking:
+
+    def __init__(self, metrics: "MetricsManager", name: str, labels: dict):
+
+        self.metrics: MetricsManager = metrics
+        self.name: str = name
+        self.labels: dict = labels
+
+    def __enter__(self) -> "_Tracking":
+
+        self.metrics.add(f"{self.name}_in_flight", 1, **self.labels)
+        self.started: float = time.perf_counter()
+
+        return self
+
+    def __exit__(self, kind: type, error: BaseException, traceback: any) -> bool:
+
+        self.metrics.observe(f"{self.name}_seconds", time.perf_counter() - self.started, **self.labels)
+
+        # A generator closed by its caller before the end still succeeded.
+        failed: bool = error is not None and not isinstance(error, GeneratorExit)
+
+        self.metrics.inc(f"{self.name}_total", outcome="error" if failed else "ok", **self.labels)
+        self.metrics.add(f"{self.name}_in_flight", -1, **self.labels)
+
+        return False
+
+class _NotTracking:
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, kind: type, error: BaseException, traceback: any) -> bool:
+        return False
+
+_NOT_TRACKING: _NotTracking = _NotTracking()
+
+class MetricsManager:
+
+    def __init__(self, enabled: bool = False):
+
+        self.enabled: bool = enabled
+
+        # Values by (name, labels), where labels are sorted (name, value) pairs.
+        self.counters: dict = {}
+        self.gauges: dict = {}
+
+        # For each histogram: its bucket counts, then the sum and the count of observations.
+        self.histograms: dict = {}
+        self.buckets: dict = {}
+
+        self.lock: Lock = Lock()
+        self.server: ThreadingHTTPServer = None
+
+    """
+    Starts collecting, and serves the metrics over HTTP if a port is given.
+
+    Args:
+        port (int): The port to serve /metrics on, or None not to serve them. 0 picks a free port.
+        host (str): The interface to listen on.
+
+    Returns:
+        int: The port being served on, or None.
+    """
+    def enable(self, port: int = None, host: str = "localhost") -> int:
+
+        self.enabled = True
+
+        if port is None:
+            return None
+
+        return self.serve(port, host)
+
+    """
+    Adds to a counter.
+
+    Args:
+        name (str): The counter's name.
+        amount (float): How much to add.
+        **labels: The counter's labels.
+    """
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+
+        if not self.enabled:
+            return
+
+        key: tuple = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    """
+    Moves a gauge up or down.
+
+    Args:
+        name (str): The gauge's name.
+        amount (float): How much to add. Negative to subtract.
+        **labels: The gauge's labels.
+    """
+    def add(self, name: str, amount: float, **labels) -> None:
+
+        if not self.enabled:
+            return
+
+        key: tuple = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+
+    """
+    Records an observation in a histogram.
+
+    Args:
+        name (str): The histogram's name.
+        value (float): The observation.
+        buckets (tuple): The buckets' upper bounds. Only the first observation's are used.
+        **labels: The histogram's labels.
+    """
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels) -> None:
+
+        if not self.enabled:
+            return
+
+        key: tuple = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+
+            bounds: tuple = self.buckets.setdefault(name, buckets)
+            histogram: list = self.histograms.get(key)
+
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * len(bounds) + [0.0, 0]
+
+            for index, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram[index] += 1
+                    break
+
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    """
+    Measures a block of code: how many are running, how long each took
+    and whether it raised.
+
+        with METRICS.track("chatbot_database", operation="insert"):
+            ...
+
+    Args:
+        name (str): The prefix of the `_in_flight` gauge, `_seconds` histogram and `_total` counter.
+        **labels: Their labels.
+
+    Returns:
+        A context manager.
+    """
+    def track(self, name: str, **labels) -> any:
+
+        if not self.enabled:
+            return _NOT_TRACKING
+
+        return _Tracking(self, name, labels)
+
+    """
+    Decorates a function so each call is tracked, labeled with the
+    function's name as its operation.
+
+    Args:
+        name (str): The prefix of the metrics, as in `track`.
+
+    Returns:
+        callable: The decorator.
+    """
+    def timed(self, name: str) -> callable:
+
+        def decorator(function: callable) -> callable:
+
+            operation: str = function.__name__
+
+            @wraps(function)
+            def wrapper(*args, **kwargs) -> any:
+
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                with _Tracking(self, name, {"operation": operation}):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    """
+    Renders every metric in Prometheus' text format.
+
+    Returns:
+        str: The exposition.
+    """
+    def render(self) -> str:
+
+        with self.lock:
+
+            counters: list = sorted(self.counters.items())
+            gauges: list = sorted(self.gauges.items())
+            histograms: list = sorted((key, list(histogram)) for key, histogram in self.histograms.items())
+            buckets: dict = dict(self.buckets)
+
+        lines: list = []
+        described: set = set()
+
+        def describe(name: str, kind: str) -> None:
+
+            if name not in described:
+                described.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            describe(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+
+            describe(name, "histogram")
+            cumulative: int = 0
+
+            for bound, count in zip(buckets[name], histogram):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', format(bound, 'g')),))} {cumulative}")
+
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+
+        return "\n".join(lines) + "\n"
+
+    """
+    Serves the metrics at /metrics from a background thread. Only the
+    first call starts a server.
+
+    Args:
+        port (int): The port to listen on. 0 picks a free port.
+        host (str): The interface to listen on.
+
+    Returns:
+        int: The port being served on.
+    """
+    def serve(self, port: int = 9464, host: str = "localhost") -> int:
+
+        with self.lock:
+
+            if self.server is not None:
+                return self.server.server_address[1]
+
+            metrics: MetricsManager = self
+
+            class Handler(BaseHTTPRequestHandler):
+
+                def do_GET(self) -> None:
+
+                    if self.path.split("?")[0] != "/metrics":
+                        self.send_error(404)
+                        return
+
+                    body: bytes = metrics.render().encode()
+
+                    self.send_response(200)
+                    self.send_header("content-type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("content-length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format: str, *args) -> None:
+                    pass
+
+            self.server = ThreadingHTTPServer((host, port), Handler)
+            self.server.daemon_threads = True
+
+            Thread(target=self.server.serve_forever, name="metrics", daemon=True).start()
+
+            return self.server.server_address[1]
+
+    """
+    Stops serving the metrics.
+    """
+    def shutdown(self) -> None:
+
+        with self.lock:
+
+            if self.server is not None:
+                self.server.shutdown()
+                self.server.server_close()
+                self.server = None
+
+# The metrics of the whole process. Off until enabled.
+METRICS: MetricsManager = MetricsManager()
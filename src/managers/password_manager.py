@@ -0,0 +1,241 @@
+from exceptions.overloaded_exception import OverloadedException
+from managers.metrics_manager import METRICS
+from bcrypt import gensalt, hashpw, checkpw
+
+import atexit
+import multiprocessing
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+"""
+A class to run bcrypt in a pool of worker processes, so hashing uses
+every core and never blocks the threads that serve other sessions. A
+bounded number of operations may run or wait at once; beyond that new
+ones are rejected straight away instead of piling up.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+"""
+Hashes a password with a new salt. Runs in a worker process.
+
+Args:
+    password (bytes): The encoded password.
+    rounds (int): The bcrypt work factor.
+
+Returns:
+    bytes: The hash.
+"""
+def _hash(password: bytes, rounds: int) -> bytes:
+    return hashpw(password, gensalt(rounds))
+
+"""
+Checks a password against a hash. Runs in a worker process.
+
+Args:
+    password (bytes): The encoded password.
+    hashed (bytes): The stored hash.
+
+Returns:
+    bool: Whether they match.
+"""
+def _check(password: bytes, hashed: bytes) -> bool:
+    return checkpw(password, hashed)
+
+"""
+Reads the work factor a hash was made with.
+
+Args:
+    hashed (bytes): A bcrypt hash, like b"$2b$12$...".
+
+Returns:
+    int: The work factor.
+"""
+def hash_rounds(hashed: bytes) -> int:
+    return int(hashed.split(b"$")[2])
+
+class PasswordManager:
+
+    def __init__(self, rounds: int = 12, workers: int = None, max_queue: int = 64):
+
+        self.rounds: int = rounds
+        self.workers: int = workers or os.cpu_count() or 1
+
+        # Spawned workers don't inherit the parent's threads or locks.
+        self.executor: ProcessPoolExecutor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+
+        self.slots: BoundedSemaphore = BoundedSemaphore(self.workers + max_queue)
+        self.lock: Lock = Lock()
+
+        self.pending: int = 0
+        self.completed: int = 0
+        self.rejected: int = 0
+
+    """
+    Runs a function in a worker process if there's room for it.
+
+    Args:
+        function (callable): A module-level function.
+        *args: Its arguments.
+
+    Returns:
+        Future: Resolves to the function's result.
+
+    Raises:
+        OverloadedException: If too many operations are already running or waiting.
+    """
+    def submit(self, function: callable, *args) -> Future:
+
+        if not self.slots.acquire(blocking=False):
+
+            with self.lock:
+                self.rejected += 1
+
+            METRICS.inc("chatbot_bcrypt_rejected_total")
+
+            raise OverloadedException("Too many logins are being processed. Please try again.")
+
+        with self.lock:
+            self.pending += 1
+
+        try:
+            future: Future = self.executor.submit(function, *args)
+
+        except BaseException:
+
+            self.release(None)
+            raise
+
+        future.add_done_callback(self.release)
+
+        return future
+
+    """
+    Frees an operation's slot once it's done.
+
+    Args:
+        future (Future): The finished operation.
+    """
+    def release(self, future: Future) -> None:
+
+        with self.lock:
+
+            self.pending -= 1
+
+            if future is not None:
+                self.completed += 1
+
+        self.slots.release()
+
+    """
+    Hashes a password with a new salt.
+
+    Args:
+        password (str): The password.
+        rounds (int): The work factor. Defaults to the configured one.
+
+    Returns:
+        bytes: The hash.
+    """
+    @METRICS.timed("chatbot_bcrypt")
+    def hash(self, password: str, rounds: int = None) -> bytes:
+        return self.submit(_hash, password.encode('utf-8'), rounds or self.rounds).result()
+
+    """
+    Checks a password against a hash.
+
+    Args:
+        password (str): The password.
+        hashed (bytes): The stored hash.
+
+    Returns:
+        bool: Whether they match.
+    """
+    @METRICS.timed("chatbot_bcrypt")
+    def check(self, password: str, hashed: bytes) -> bool:
+        return self.submit(_check, password.encode('utf-8'), hashed).result()
+
+    """
+    Checks whether a hash was made with a different work factor than the
+    configured one.
+
+    Args:
+        hashed (bytes): The stored hash.
+
+    Returns:
+        bool: Whether it should be hashed again.
+    """
+    def needs_rehash(self, hashed: bytes) -> bool:
+        return hash_rounds(hashed) != self.rounds
+
+    """
+    Reports how busy the pool is.
+
+    Returns:
+        dict: Operations running or waiting, finished and rejected.
+    """
+    def metrics(self) -> dict:
+
+        with self.lock:
+
+            return {
+                "pending": self.pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "workers": self.workers,
+            }
+
+    """
+    Stops the worker processes.
+
+    Args:
+        wait (bool): Whether to wait for running operations to finish.
+    """
+    def shutdown(self, wait: bool = True) -> None:
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+
+_passwords: PasswordManager = None
+_passwords_lock: Lock = Lock()
+
+"""
+Returns the password pool shared by the whole process, creating it on
+first use. The settings only apply to the call that creates it.
+
+Args:
+    rounds (int): The bcrypt work factor for new hashes.
+    workers (int): How many processes hash at once. Defaults to one per core.
+    max_queue (int): The most operations that can wait before new ones are rejected.
+
+Returns:
+    PasswordManager: The shared pool.
+"""
+def get_passwords(rounds: int = 12, workers: int = None, max_queue: int = 64) -> PasswordManager:
+
+    global _passwords
+
+    with _passwords_lock:
+
+        if _passwords is None:
+            _passwords = PasswordManager(rounds, workers, max_queue)
+
+        return _passwords
+
+"""
+Stops the shared pool. Runs automatically when the process exits.
+"""
+def shutdown_passwords() -> None:
+
+    global _passwords
+
+    with _passwords_lock:
+
+        if _passwords is not None:
+            _passwords.shutdown(wait=False)
+            _passwords = None
+
+atexit.register(shutdown_passwords)
@@ -0,0 +1,237 @@
+from managers.database_manager import DatabaseManager
+from utils.openai_utils import create_assistant, delete_assistant, create_thread, delete_thread
+
+import atexit
+from threading import Event, Lock, Thread
+
+"""
+A class to keep ready-made assistants and threads in the database, so
+sign-up and a user's first chat can take one instead of waiting on
+OpenAI. A background thread tops each pool back up to the high watermark
+whenever it falls below the low one.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The scheduler queue the pool's own calls wait in.
+POOL_USER: str = "__pool__"
+
+class PoolManager:
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        api_key: str,
+        low: int = 2,
+        high: int = 5,
+        interval: float = 30.0,
+        factories: dict = None,
+        kinds: tuple = None
+    ):
+
+        self.db: DatabaseManager = db
+        self.low: int = low
+        self.high: int = high
+        self.interval: float = interval
+
+        # How to create and delete each kind of resource.
+        self.factories: dict = factories or {
+            "assistant": (
+                lambda: create_assistant(api_key, POOL_USER),
+                lambda resource_id: delete_assistant(api_key, resource_id, POOL_USER),
+            ),
+            "thread": (
+                lambda: create_thread(api_key, POOL_USER),
+                lambda resource_id: delete_thread(api_key, resource_id, POOL_USER),
+            ),
+        }
+
+        if kinds is not None:
+            self.factories = {kind: self.factories[kind] for kind in kinds}
+
+        # Resources this process pooled that haven't been taken yet.
+        self.created: dict = {kind: set() for kind in self.factories}
+        self.lock: Lock = Lock()
+        self.fill_lock: Lock = Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        self.wanted: Event = Event()
+        self.stopped: Event = Event()
+        self.thread: Thread = Thread(target=self.replenish, name="resource-pool", daemon=True)
+        self.thread.start()
+
+    """
+    Takes a ready-made resource with a single query, or creates one if
+    the pool is empty.
+
+    Args:
+        kind (str): What the resource is, like "assistant" or "thread".
+
+    Returns:
+        str: The resource's id.
+    """
+    def take(self, kind: str) -> str:
+
+        resource_id: str = self.db.take_resource(kind)
+
+        # Let the background thread check whether it needs topping up.
+        self.wanted.set()
+
+        with self.lock:
+
+            if resource_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.created[kind].discard(resource_id)
+
+        if resource_id is None:
+            return self.factories[kind][0]()
+
+        return resource_id
+
+    """
+    Returns a resource that was taken but not used.
+
+    Args:
+        kind (str): What the resource is.
+        resource_id (str): Its id.
+    """
+    def give_back(self, kind: str, resource_id: str) -> None:
+
+        self.db.add_resource(kind, resource_id)
+
+        with self.lock:
+            self.created[kind].add(resource_id)
+
+    """
+    Tops every pool below the low watermark up to the high one.
+    """
+    def fill(self) -> None:
+
+        with self.fill_lock:
+
+            for kind, (create, _) in self.factories.items():
+
+                count: int = self.db.count_resources(kind)
+
+                if count >= self.low:
+                    continue
+
+                for _ in range(self.high - count):
+
+                    if self.stopped.is_set():
+                        return
+
+                    resource_id: str = create()
+                    self.db.add_resource(kind, resource_id)
+
+                    with self.lock:
+                        self.created[kind].add(resource_id)
+
+    """
+    The background loop that keeps the pools filled until shutdown.
+    """
+    def replenish(self) -> None:
+
+        while not self.stopped.is_set():
+
+            try:
+                self.fill()
+
+            except Exception as e:
+
+                # Try again on the next pass.
+                print(f"\033[31mError filling the resource pool:\n{e}\033[0m")
+
+            self.wanted.wait(self.interval)
+            self.wanted.clear()
+
+    """
+    Reports how well the pool is keeping up.
+
+    Returns:
+        dict: Takes served from the pool, takes that had to create, and the size of each pool.
+    """
+    def metrics(self) -> dict:
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "sizes": {kind: self.db.count_resources(kind) for kind in self.factories},
+        }
+
+    """
+    Stops refilling and deletes the resources this process pooled that
+    nobody took.
+    """
+    def shutdown(self) -> None:
+
+        self.stopped.set()
+        self.wanted.set()
+        self.thread.join(timeout=10)
+
+        with self.lock:
+            created: dict = {kind: list(ids) for kind, ids in self.created.items()}
+
+        for kind, ids in created.items():
+
+            _, delete = self.factories[kind]
+
+            for resource_id in ids:
+
+                # Only delete it if no other process took it in the meantime.
+                if self.db.remove_resource(kind, resource_id):
+                    delete(resource_id)
+
+_pool: PoolManager = None
+_pool_lock: Lock = Lock()
+
+"""
+Returns the pool shared by the whole process, creating it on first use.
+The settings only apply to the call that creates it.
+
+Args:
+    db (DatabaseManager): Where the pooled ids are stored.
+    api_key (str): The key to your OpenAI account.
+    low (int): Refill a pool when it drops below this many.
+    high (int): How many to refill a pool to.
+    kinds (tuple): The kinds of resource to pool. Defaults to assistants and threads.
+
+Returns:
+    PoolManager: The shared pool.
+"""
+def get_pool(
+    db: DatabaseManager,
+    api_key: str,
+    low: int = 2,
+    high: int = 5,
+    kinds: tuple = None
+) -> PoolManager:
+
+    global _pool
+
+    with _pool_lock:
+
+        if _pool is None:
+            _pool = PoolManager(db, api_key, low, high, kinds=kinds)
+
+        return _pool
+
+"""
+Stops the shared pool. Runs automatically when the process exits.
+"""
+def shutdown_pool() -> None:
+
+    global _pool
+
+    with _pool_lock:
+
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+
+atexit.register(shutdown_pool)
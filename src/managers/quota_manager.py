@@ -0,0 +1,148 @@
+from managers.database_manager import DatabaseManager
+from exceptions.quota_exception import QuotaException
+
+"""
+A class to enforce each user's word limit before the assistant is asked
+anything. A turn first reserves its prompt plus an estimate of the reply
+in one atomic update, and is refused without calling OpenAI if that
+doesn't fit. Once the reply is in, the reservation is settled to the
+words actually used. Prompts and replies are counted the same way.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# The words a reply is expected to use, reserved before it exists.
+REPLY_WORDS: int = 150
+
+"""
+Counts the words in a message, the unit every limit is measured in.
+
+Args:
+    text (str): The message.
+
+Returns:
+    int: The number of words.
+"""
+def count_words(text: str) -> int:
+    return len(text.split())
+
+class QuotaManager:
+
+    def __init__(self, db: DatabaseManager, reply_words: int = REPLY_WORDS):
+
+        self.db: DatabaseManager = db
+        self.reply_words: int = reply_words
+
+    """
+    Tries to reserve a turn's budget from the usage the user was given.
+
+    Args:
+        user (dict): The user, with `_id`, `usage` and `limit`.
+        prompt_words (int): The words in the user's message.
+
+    Returns:
+        int: The amount reserved, or None if it didn't fit.
+    """
+    def try_reserve(self, user: dict, prompt_words: int) -> int:
+
+        remaining: int = user["limit"] - user["usage"]
+
+        if prompt_words > remaining:
+            return None
+
+        amount: int = prompt_words + min(self.reply_words, remaining - prompt_words)
+        usage: int = self.db.reserve_usage(user["_id"], amount)
+
+        if usage is None:
+            return None
+
+        user["usage"] = usage
+
+        return amount
+
+    """
+    Reserves the budget for a turn. Near the limit, the reply's share is
+    cut down to whatever is left, so the last words can still be used.
+    The user's usage may be stale, so a refusal is checked against the
+    database, and only the database's usage can exhaust the account.
+
+    Args:
+        user (dict): The user, with `_id`, `usage` and `limit`.
+        prompt (str): The user's message.
+
+    Returns:
+        int: The amount reserved, to settle or release later.
+
+    Raises:
+        QuotaException: If the budget can't be reserved. It's exhausted if the prompt alone doesn't fit the stored usage.
+    """
+    def reserve(self, user: dict, prompt: str) -> int:
+
+        prompt_words: int = count_words(prompt)
+        amount: int = self.try_reserve(user, prompt_words)
+
+        if amount is not None:
+            return amount
+
+        # Another session may have spent or given back words since the user was read.
+        current: dict = self.db.retrieve({"_id": user["_id"]}, {"usage": 1, "limit": 1})
+
+        if current is None:
+            raise QuotaException("Your account couldn't be found.", exhausted=False)
+
+        user["usage"] = current["usage"]
+        user["limit"] = current["limit"]
+
+        if prompt_words > user["limit"] - user["usage"]:
+            raise QuotaException("You've used all of your words.", exhausted=True)
+
+        amount = self.try_reserve(user, prompt_words)
+
+        # Another session spent some of the same budget first.
+        if amount is None:
+            raise QuotaException("You don't have enough words left for that message.", exhausted=False)
+
+        return amount
+
+    """
+    Records a finished turn, correcting the reservation to the words the
+    prompt and reply actually used.
+
+    Args:
+        user (dict): The user, with `_id`.
+        reserved (int): The amount `reserve` returned.
+        messages (list[dict]): The prompt and the reply, oldest first.
+        thread_id (str): The thread the turn ran on.
+
+    Returns:
+        int: The user's usage afterwards, or None if they no longer exist.
+    """
+    def settle(self, user: dict, reserved: int, messages: list[dict], thread_id: str = None) -> int:
+
+        used: int = sum(count_words(message["content"]) for message in messages)
+        usage: int = self.db.record_turn(user["_id"], messages, used - reserved, thread_id)
+
+        if usage is not None:
+            user["usage"] = usage
+
+        return usage
+
+    """
+    Gives back a reservation whose turn never reached the assistant or failed.
+
+    Args:
+        user (dict): The user, with `_id`.
+        reserved (int): The amount `reserve` returned.
+
+    Returns:
+        int: The user's usage afterwards, or None if they no longer exist.
+    """
+    def release(self, user: dict, reserved: int) -> int:
+
+        usage: int = self.db.update_count(user["_id"], -reserved)
+
+        if usage is not None:
+            user["usage"] = usage
+
+        return usage
@@ -0,0 +1,307 @@
+from managers.cache_manager import CacheManager
+from utils.mongo_utils import get_client
+from utils.openai_utils import ASSISTANT_SETTINGS
+
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+from pymongo import ASCENDING, ReturnDocument
+
+"""
+Caches assistant replies to prompts that have been seen before, so
+common opening prompts don't each cost a full run. Entries are keyed by
+the assistant, its configuration, the normalized prompt and a hash of the
+conversation before it, and are evicted least recently used first or
+once they expire.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+"""
+Normalizes a prompt so trivially different spellings share an entry.
+
+Args:
+    prompt (str): The user's message.
+
+Returns:
+    str: The prompt in lowercase with its whitespace collapsed.
+"""
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.lower().split())
+
+"""
+Digests the messages before a prompt, so a turn can carry its context to
+the cache without carrying the whole history.
+
+Args:
+    context (list[dict]): The messages before the prompt, oldest first.
+
+Returns:
+    str: The digest, or "" if there are no messages.
+"""
+def context_digest(context: list[dict] = None) -> str:
+
+    if not context:
+        return ""
+
+    return hashlib.sha256(json.dumps(context, sort_keys=True).encode()).hexdigest()
+
+"""
+Builds the key of a prompt's entry.
+
+Args:
+    prompt (str): The user's message.
+    context (str): The digest of the messages before it, from `context_digest`.
+    assistant_id (str): The assistant that answers it.
+    config (dict): The assistant's configuration.
+
+Returns:
+    str: The key.
+"""
+def response_key(prompt: str, context: str = "", assistant_id: str = "", config: dict = ASSISTANT_SETTINGS) -> str:
+
+    return hashlib.sha256(json.dumps(
+        [config, assistant_id, normalize_prompt(prompt), context],
+        sort_keys=True
+    ).encode()).hexdigest()
+
+class ResponseCache(ABC):
+
+    def __init__(self, with_context: bool = False):
+
+        # Replies that depend on earlier messages rarely repeat, so those prompts skip the cache by default.
+        self.with_context: bool = with_context
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.bypassed: int = 0
+        self.stats_lock: Lock = Lock()
+
+    """
+    Reads a stored reply.
+
+    Args:
+        key (str): The entry's key.
+
+    Returns:
+        str: The reply, or None if it's missing or expired.
+    """
+    @abstractmethod
+    def read(self, key: str) -> str:
+        pass
+
+    """
+    Stores a reply.
+
+    Args:
+        key (str): The entry's key.
+        response (str): The reply.
+    """
+    @abstractmethod
+    def write(self, key: str, response: str) -> None:
+        pass
+
+    """
+    Counts the stored entries.
+
+    Returns:
+        int: How many there are.
+    """
+    @abstractmethod
+    def size(self) -> int:
+        pass
+
+    """
+    Checks whether a prompt should go through the cache at all.
+
+    Args:
+        context (str): The digest of the messages before the prompt, or "" if there are none.
+
+    Returns:
+        bool: Whether it may be served from or stored in the cache.
+    """
+    def applies(self, context: str = "") -> bool:
+        return self.with_context or not context
+
+    """
+    Looks up the reply to a prompt, recording a hit, a miss or a bypass.
+
+    Args:
+        prompt (str): The user's message.
+        context (str): The digest of the messages before it, from `context_digest`.
+        assistant_id (str): The assistant that answers it.
+
+    Returns:
+        str: The cached reply, or None if the assistant has to answer.
+    """
+    def get(self, prompt: str, context: str = "", assistant_id: str = "") -> str:
+
+        if not self.applies(context):
+
+            with self.stats_lock:
+                self.bypassed += 1
+
+            return None
+
+        response: str = self.read(response_key(prompt, context, assistant_id))
+
+        with self.stats_lock:
+
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return response
+
+    """
+    Stores the reply to a prompt, unless the prompt bypasses the cache.
+
+    Args:
+        prompt (str): The user's message.
+        response (str): The assistant's reply.
+        context (str): The digest of the messages before the prompt, from `context_digest`.
+        assistant_id (str): The assistant that answered it.
+    """
+    def set(self, prompt: str, response: str, context: str = "", assistant_id: str = "") -> None:
+
+        if response and self.applies(context):
+            self.write(response_key(prompt, context, assistant_id), response)
+
+    """
+    Reports how well the cache is doing.
+
+    Returns:
+        dict: The hits, misses, bypasses, hit rate and current size.
+    """
+    def stats(self) -> dict:
+
+        with self.stats_lock:
+
+            lookups: int = self.hits + self.misses
+
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": self.size(),
+            }
+
+class MemoryResponseCache(ResponseCache):
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 86400.0, with_context: bool = False):
+
+        super().__init__(with_context)
+        self.entries: CacheManager = CacheManager(maxsize=maxsize, ttl=ttl)
+
+    def read(self, key: str) -> str:
+        return self.entries.get(key)
+
+    def write(self, key: str, response: str) -> None:
+        self.entries.set(key, response)
+
+    def size(self) -> int:
+        return self.entries.stats()["size"]
+
+class MongoResponseCache(ResponseCache):
+
+    def __init__(
+        self,
+        uri: str,
+        maxsize: int = 1024,
+        ttl: float = 86400.0,
+        with_context: bool = False,
+        database: str = "demo",
+        collection: str = "responses"
+    ):
+
+        super().__init__(with_context)
+        self.maxsize: int = maxsize
+        self.ttl: timedelta = timedelta(seconds=ttl)
+        self.collection = get_client(uri)[database][collection]
+
+        # MongoDB removes entries on its own once they expire.
+        self.collection.create_index([("expires", ASCENDING)], expireAfterSeconds=0, name="expires")
+        self.collection.create_index([("used", ASCENDING)], name="used")
+
+    def read(self, key: str) -> str:
+
+        now: datetime = datetime.now(timezone.utc)
+
+        # The TTL monitor only runs every minute, so expired entries are filtered here too.
+        entry: dict = self.collection.find_one_and_update(
+            {"_id": key, "expires": {"$gt": now}},
+            {"$set": {"used": now}},
+            projection={"response": 1},
+            return_document=ReturnDocument.AFTER
+        )
+
+        return entry["response"] if entry else None
+
+    def write(self, key: str, response: str) -> None:
+
+        now: datetime = datetime.now(timezone.utc)
+
+        self.collection.update_one(
+            {"_id": key},
+            {"$set": {"response": response, "used": now, "expires": now + self.ttl}},
+            upsert=True
+        )
+
+        excess: int = self.collection.estimated_document_count() - self.maxsize
+
+        # Evict the least recently used entries once the cache is over its size.
+        if excess > 0:
+
+            oldest: list = [
+                entry["_id"]
+                for entry in self.collection.find({}, {"_id": 1}).sort("used", ASCENDING).limit(excess)
+            ]
+
+            self.collection.delete_many({"_id": {"$in": oldest}})
+
+    def size(self) -> int:
+        return self.collection.estimated_document_count()
+
+_cache: ResponseCache = None
+_cache_lock: Lock = Lock()
+
+"""
+Returns the response cache shared by the whole process, creating it on
+first use. The settings only apply to the call that creates it.
+
+Args:
+    kind (str): "memory" or "mongo".
+    uri (str): The MongoDB connection string, for "mongo".
+    maxsize (int): The most replies to keep.
+    ttl (float): Seconds a reply is kept.
+    with_context (bool): Whether prompts that follow earlier messages are cached too.
+
+Returns:
+    ResponseCache: The shared cache.
+"""
+def get_response_cache(
+    kind: str = "memory",
+    uri: str = "",
+    maxsize: int = 1024,
+    ttl: float = 86400.0,
+    with_context: bool = False
+) -> ResponseCache:
+
+    global _cache
+
+    with _cache_lock:
+
+        if _cache is None:
+
+            if kind == "mongo":
+                _cache = MongoResponseCache(uri, maxsize, ttl, with_context)
+            else:
+                _cache = MemoryResponseCache(maxsize, ttl, with_context)
+
+        return _cache
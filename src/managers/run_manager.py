@@ -0,0 +1,181 @@
+from exceptions.run_exception import RunException
+from managers.metrics_manager import METRICS, COUNT_BUCKETS
+
+from openai.types.beta.threads.run import Run
+from openai import OpenAI
+
+import random
+import time
+from collections import deque
+from threading import Event
+
+"""
+A class to wait for assistant runs to finish, polling with exponential
+backoff and jitter until the run ends or a deadline passes.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# Statuses after which a run will never change again.
+TERMINAL_STATUSES: set = {"completed", "failed", "cancelled", "expired"}
+
+# Statuses that need us to act before the run can continue. No tools are
+# handled here, so these end the wait too.
+ACTION_STATUSES: set = {"requires_action"}
+
+"""
+Calls a client method on the calling thread.
+
+Args:
+    function (callable): The client method.
+    *args: Its positional arguments.
+    **kwargs: Its keyword arguments.
+
+Returns:
+    any: The method's result.
+"""
+def _direct(function: callable, *args, **kwargs) -> any:
+    return function(*args, **kwargs)
+
+class RunManager:
+
+    def __init__(
+        self,
+        initial_delay: float = 0.25,
+        max_delay: float = 2.0,
+        multiplier: float = 2.0,
+        jitter: float = 0.1,
+        timeout: float = 120.0,
+        history_size: int = 100
+    ):
+
+        self.initial_delay: float = initial_delay
+        self.max_delay: float = max_delay
+        self.multiplier: float = multiplier
+        self.jitter: float = jitter
+        self.timeout: float = timeout
+
+        self.cancelled: Event = Event()
+        self.history: deque = deque(maxlen=history_size)
+
+    """
+    Returns how long to sleep before the given poll, with random jitter so
+    concurrent waiters don't poll in lockstep.
+
+    Args:
+        attempt (int): How many polls have already been made.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    def delay(self, attempt: int) -> float:
+
+        base: float = min(self.initial_delay * self.multiplier ** attempt, self.max_delay)
+
+        return max(base * (1 + random.uniform(-self.jitter, self.jitter)), 0.0)
+
+    """
+    Polls a run until it reaches a terminal state. Runs that need action,
+    time out, or are cancelled through `cancel` are cancelled remotely.
+    The waits between polls always happen on the calling thread.
+
+    Args:
+        client (OpenAI): The client to poll with.
+        run (Run): The run as returned when it was created.
+        call (callable): Makes each request, like `ThreadManager.call`, given the client method and its arguments. Defaults to calling it directly.
+
+    Returns:
+        Run: The completed run.
+
+    Raises:
+        RunException: If the run ends in any state besides completed.
+    """
+    def wait(self, client: OpenAI, run: Run, call: callable = None) -> Run:
+
+        call = call or _direct
+        self.cancelled.clear()
+
+        started: float = time.monotonic()
+        deadline: float = started + self.timeout
+        polls: int = 0
+
+        try:
+            while run.status not in TERMINAL_STATUSES | ACTION_STATUSES:
+
+                remaining: float = deadline - time.monotonic()
+
+                if remaining <= 0:
+                    self.cancel_remote(client, run, call)
+                    raise RunException(f"Run {run.id} timed out after {self.timeout}s.", "timeout")
+
+                # Sleeping on the event lets cancel() interrupt the wait.
+                if self.cancelled.wait(min(self.delay(polls), remaining)):
+                    self.cancel_remote(client, run, call)
+                    raise RunException(f"Run {run.id} was cancelled.", "cancelled")
+
+                run = call(client.beta.threads.runs.retrieve, thread_id=run.thread_id, run_id=run.id)
+                polls += 1
+
+            if run.status in ACTION_STATUSES:
+                self.cancel_remote(client, run, call)
+
+            if run.status != "completed":
+                raise RunException(f"Run {run.id} ended with status {run.status}.", run.status)
+
+            return run
+
+        finally:
+            self.record(run, polls, started)
+
+    """
+    Stores the metrics of a finished wait.
+
+    Args:
+        run (Run): The run in its final known state.
+        polls (int): How many times it was retrieved.
+        started (float): When the wait began, from time.monotonic().
+    """
+    def record(self, run: Run, polls: int, started: float) -> None:
+
+        wait_time: float = time.monotonic() - started
+
+        self.history.append({
+            "run_id": run.id,
+            "status": run.status,
+            "polls": polls,
+            "wait_time": wait_time,
+        })
+
+        METRICS.observe("chatbot_run_seconds", wait_time, status=run.status)
+        METRICS.observe("chatbot_run_polls", polls, buckets=COUNT_BUCKETS, status=run.status)
+
+    """
+    Stops the wait in progress, cancelling its run.
+    """
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    """
+    Asks OpenAI to cancel a run, ignoring runs that already ended.
+
+    Args:
+        client (OpenAI): The client to cancel with.
+        run (Run): The run to cancel.
+        call (callable): Makes the request, as in `wait`.
+    """
+    def cancel_remote(self, client: OpenAI, run: Run, call: callable = None) -> None:
+
+        try:
+            (call or _direct)(client.beta.threads.runs.cancel, thread_id=run.thread_id, run_id=run.id)
+        except Exception:
+            pass
+
+    """
+    The metrics for the most recent run.
+
+    Returns:
+        dict: The run's id, final status, poll count and seconds spent waiting.
+    """
+    def last(self) -> dict:
+        return self.history[-1] if self.history else None
@@ -0,0 +1,343 @@
+from exceptions.overloaded_exception import OverloadedException
+from managers.metrics_manager import METRICS
+
+import atexit
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock, Thread
+
+"""
+A class to schedule calls to the OpenAI API from every session in the
+process. Calls wait in one queue per user and are taken round-robin, so a
+heavy user can't starve the others, and a bounded pool of workers runs
+them only when the request and token rate limits allow.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+class TokenBucket:
+
+    def __init__(self, per_minute: float, capacity: float = None):
+
+        self.rate: float = per_minute / 60
+        self.capacity: float = capacity or per_minute
+        self.level: float = self.capacity
+        self.updated: float = time.monotonic()
+
+    """
+    Refills the bucket for the time since it was last touched.
+    """
+    def refill(self) -> None:
+
+        now: float = time.monotonic()
+
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    """
+    Returns how long until an amount could be taken. Amounts bigger than
+    the bucket are treated as a full bucket so they can still run.
+
+    Args:
+        amount (float): The amount wanted.
+
+    Returns:
+        float: Seconds to wait, or 0 if it can be taken now.
+    """
+    def wait_time(self, amount: float) -> float:
+
+        self.refill()
+
+        missing: float = min(amount, self.capacity) - self.level
+
+        return max(missing / self.rate, 0.0)
+
+    """
+    Takes an amount out of the bucket.
+
+    Args:
+        amount (float): The amount to take.
+    """
+    def take(self, amount: float) -> None:
+
+        self.refill()
+        self.level -= min(amount, self.capacity)
+
+class SchedulerManager:
+
+    def __init__(
+        self,
+        workers: int = 16,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 150000,
+        max_queue: int = 1000
+    ):
+
+        self.requests: TokenBucket = TokenBucket(requests_per_minute)
+        self.tokens: TokenBucket = TokenBucket(tokens_per_minute)
+        self.max_queue: int = max_queue
+
+        self.queues: dict = {}
+        self.rotation: deque = deque()
+        self.condition: Condition = Condition()
+        self.rate_lock: Lock = Lock()
+        self.running: bool = True
+
+        self.depth: int = 0
+        self.in_flight: int = 0
+        self.completed: int = 0
+        self.failed: int = 0
+        self.rejected: int = 0
+        self.queue_time: float = 0.0
+        self.throttle_time: float = 0.0
+
+        self.threads: list = [
+            Thread(target=self.work, name=f"scheduler-{index}", daemon=True)
+            for index in range(workers)
+        ]
+
+        for thread in self.threads:
+            thread.start()
+
+    """
+    Queues a call behind the user's earlier calls.
+
+    Args:
+        user (str): Who the call is for. Users are served round-robin.
+        function (callable): The call to make.
+        *args: Its positional arguments.
+        tokens (int): The tokens the call is expected to use.
+        **kwargs: Its keyword arguments.
+
+    Returns:
+        Future: Resolves to the call's result.
+
+    Raises:
+        OverloadedException: If the queue is full.
+    """
+    def submit(self, user: str, function: callable, *args, tokens: int = 0, **kwargs) -> Future:
+
+        future: Future = Future()
+
+        with self.condition:
+
+            if self.depth >= self.max_queue:
+                self.rejected += 1
+                METRICS.inc("chatbot_scheduler_rejected_total")
+                raise OverloadedException("Too many requests are waiting. Please try again.")
+
+            if user not in self.queues:
+                self.queues[user] = deque()
+                self.rotation.append(user)
+
+            self.queues[user].append((future, function, args, kwargs, tokens, time.monotonic()))
+            self.depth += 1
+
+            self.condition.notify()
+
+        return future
+
+    """
+    Queues a call and blocks until it's done.
+
+    Args:
+        user (str): Who the call is for.
+        function (callable): The call to make.
+        *args: Its positional arguments.
+        tokens (int): The tokens the call is expected to use.
+        timeout (float): Seconds to wait for the result. Defaults to forever.
+        **kwargs: Its keyword arguments.
+
+    Returns:
+        any: The call's result.
+    """
+    def run(self, user: str, function: callable, *args, tokens: int = 0, timeout: float = None, **kwargs) -> any:
+        return self.submit(user, function, *args, tokens=tokens, **kwargs).result(timeout)
+
+    """
+    Takes the next call, moving its user to the back of the rotation.
+
+    Returns:
+        tuple: The call, or None once the scheduler shuts down.
+    """
+    def next_job(self) -> tuple:
+
+        with self.condition:
+
+            while self.running and not self.rotation:
+                self.condition.wait()
+
+            if not self.running:
+                return None
+
+            user: str = self.rotation.popleft()
+            queue: deque = self.queues[user]
+            job: tuple = queue.popleft()
+
+            if queue:
+                self.rotation.append(user)
+            else:
+                del self.queues[user]
+
+            self.depth -= 1
+            self.in_flight += 1
+            self.queue_time += time.monotonic() - job[5]
+
+            return job
+
+    """
+    Blocks until both rate limits allow a call, then takes from them.
+
+    Args:
+        tokens (int): The tokens the call is expected to use.
+    """
+    def throttle(self, tokens: int) -> None:
+
+        while True:
+
+            with self.rate_lock:
+
+                wait: float = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+                if wait == 0:
+                    self.requests.take(1)
+                    self.tokens.take(tokens)
+                    return
+
+                self.throttle_time += wait
+                METRICS.inc("chatbot_scheduler_throttle_seconds_total", wait)
+
+            time.sleep(wait)
+
+    """
+    The loop each worker runs until shutdown.
+    """
+    def work(self) -> None:
+
+        while (job := self.next_job()) is not None:
+
+            future, function, args, kwargs, tokens, queued = job
+            succeeded: bool = None
+
+            METRICS.observe("chatbot_scheduler_queue_seconds", time.monotonic() - queued)
+
+            try:
+                if future.set_running_or_notify_cancel():
+
+                    self.throttle(tokens)
+
+                    try:
+                        future.set_result(function(*args, **kwargs))
+                        succeeded = True
+
+                    except BaseException as e:
+                        future.set_exception(e)
+                        succeeded = False
+
+            finally:
+
+                with self.condition:
+
+                    self.in_flight -= 1
+
+                    if succeeded is True:
+                        self.completed += 1
+                    elif succeeded is False:
+                        self.failed += 1
+
+    """
+    Reports how busy the scheduler is.
+
+    Returns:
+        dict: Queue depths, in-flight calls, outcomes and time spent waiting.
+    """
+    def metrics(self) -> dict:
+
+        with self.condition:
+
+            return {
+                "queue_depth": self.depth,
+                "user_queue_depths": {user: len(queue) for user, queue in self.queues.items()},
+                "in_flight": self.in_flight,
+                "workers": len(self.threads),
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_time": self.queue_time,
+                "throttle_time": self.throttle_time,
+            }
+
+    """
+    Stops the workers. Calls still queued are cancelled.
+
+    Args:
+        wait (bool): Whether to wait for running calls to finish.
+    """
+    def shutdown(self, wait: bool = True) -> None:
+
+        with self.condition:
+
+            self.running = False
+
+            for queue in self.queues.values():
+                for job in queue:
+                    job[0].cancel()
+
+            self.queues.clear()
+            self.rotation.clear()
+            self.depth = 0
+
+            self.condition.notify_all()
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+_scheduler: SchedulerManager = None
+_scheduler_lock: Lock = Lock()
+
+"""
+Returns the scheduler shared by the whole process, creating it on first
+use. The settings only apply to the call that creates it.
+
+Args:
+    workers (int): How many calls can run at once.
+    requests_per_minute (float): The request rate limit.
+    tokens_per_minute (float): The token rate limit.
+    max_queue (int): The most calls that can wait before new ones are rejected.
+
+Returns:
+    SchedulerManager: The shared scheduler.
+"""
+def get_scheduler(
+    workers: int = 16,
+    requests_per_minute: float = 500,
+    tokens_per_minute: float = 150000,
+    max_queue: int = 1000
+) -> SchedulerManager:
+
+    global _scheduler
+
+    with _scheduler_lock:
+
+        if _scheduler is None:
+            _scheduler = SchedulerManager(workers, requests_per_minute, tokens_per_minute, max_queue)
+
+        return _scheduler
+
+"""
+Stops the shared scheduler. Runs automatically when the process exits.
+"""
+def shutdown_scheduler() -> None:
+
+    global _scheduler
+
+    with _scheduler_lock:
+
+        if _scheduler is not None:
+            _scheduler.shutdown(wait=False)
+            _scheduler = None
+
+atexit.register(shutdown_scheduler)
@@ -0,0 +1,138 @@
+from exceptions.credential_exception import CredentialException
+from managers.cache_manager import CacheManager
+
+import time
+from threading import Lock
+
+import jwt
+
+"""
+A class to issue and verify signed session tokens. A token carries the
+user's id and everything the chat page needs to render, so an
+authenticated rerun doesn't have to read the user from the database.
+Verified tokens are cached, and a user's older tokens can be revoked
+after a write that changes them.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+ALGORITHM: str = "HS256"
+
+class SessionManager:
+
+    def __init__(self, secret: str, ttl: float = 86400.0, cache: CacheManager = None):
+
+        if not secret:
+            raise CredentialException("No session secret provided!")
+
+        self.secret: str = secret
+        self.ttl: float = ttl
+        self.cache: CacheManager = cache or CacheManager(maxsize=4096, ttl=300.0)
+
+        # When each user's tokens were last revoked. Tokens issued before then are refused.
+        self.revoked: dict = {}
+        self.lock: Lock = Lock()
+
+    """
+    Issues a token for a user.
+
+    Args:
+        user (dict): The user, with `_id`, `user`, `usage`, `limit`, `assistant_id` and `threads`.
+
+    Returns:
+        str: The signed token.
+    """
+    def issue(self, user: dict) -> str:
+
+        now: float = time.time()
+
+        return jwt.encode({
+            "sub": str(user["_id"]),
+            "user": user["user"],
+            "usage": user["usage"],
+            "limit": user["limit"],
+            "assistant_id": user["assistant_id"],
+            "threads": user.get("threads", []),
+            "iat": now,
+            "exp": now + self.ttl,
+        }, self.secret, algorithm=ALGORITHM)
+
+    """
+    Verifies a token, serving it from the cache when possible.
+
+    Args:
+        token (str): The token from the user's cookie.
+
+    Returns:
+        dict: Its claims, or None if it's missing, invalid, expired or revoked.
+    """
+    def verify(self, token: str) -> dict:
+
+        if not token or not isinstance(token, str):
+            return None
+
+        claims: dict = self.cache.get(token)
+
+        if claims is None:
+
+            try:
+                claims = jwt.decode(token, self.secret, algorithms=[ALGORITHM])
+
+            except jwt.InvalidTokenError:
+                return None
+
+            self.cache.set(token, claims)
+
+        # A cached token can still expire or be revoked.
+        if claims["exp"] <= time.time():
+            return None
+
+        with self.lock:
+            revoked: float = self.revoked.get(claims["sub"])
+
+        if revoked is not None and claims["iat"] <= revoked:
+            return None
+
+        return dict(claims)
+
+    """
+    Refuses every token issued to a user until now.
+
+    Args:
+        user_id (any): The id of the user.
+    """
+    def revoke(self, user_id: any) -> None:
+
+        with self.lock:
+
+            now: float = time.time()
+
+            # Forget revocations whose tokens have all expired anyway.
+            self.revoked = {sub: when for sub, when in self.revoked.items() if when > now - self.ttl}
+            self.revoked[str(user_id)] = now
+
+_sessions: SessionManager = None
+_sessions_lock: Lock = Lock()
+
+"""
+Returns the session manager shared by the whole process, creating it on
+first use. The settings only apply to the call that creates it.
+
+Args:
+    secret (str): The key tokens are signed with.
+    ttl (float): Seconds a token stays valid.
+
+Returns:
+    SessionManager: The shared session manager.
+"""
+def get_sessions(secret: str, ttl: float = 86400.0) -> SessionManager:
+
+    global _sessions
+
+    with _sessions_lock:
+
+        if _sessions is None:
+            _sessions = SessionManager(secret, ttl)
+
+        return _sessions
@@ -1,8 +1,19 @@
 from exceptions.credential_exception import CredentialException
+from managers.run_manager import RunManager
+from managers.cache_manager import CacheManager
+from managers.scheduler_manager import get_scheduler
+from managers.response_cache_manager import ResponseCache
+from managers.metrics_manager import METRICS
+from utils.openai_utils import get_client
+
+from exceptions.run_exception import RunException
 
 from openai.types.beta.threads.run import Run
+from openai.types.beta.threads.message import Message
 from openai import OpenAI
 
+from typing import Iterable, Iterator
+
 """
 A class to manage a single assistant's threads from OpenAI.
 
@@ -10,6 +21,53 @@ AUTHOR: Arthur Riechert
 VERSION: 1.1.0
 """
 
+# Stream events that end a run without an answer, and the status each one means.
+STREAM_FAILURES: dict = {
+    "thread.run.failed": "failed",
+    "thread.run.cancelled": "cancelled",
+    "thread.run.expired": "expired",
+    "thread.run.requires_action": "requires_action",
+    "error": "error",
+}
+
+# The tokens a reply is expected to use, for rate limiting before it exists.
+REPLY_TOKENS: int = 500
+
+# The messages already fetched for each thread, and the id of the last one,
+# shared by every ThreadManager in the process.
+MESSAGE_CACHE: CacheManager = CacheManager(maxsize=256, ttl=3600.0)
+
+"""
+Joins the text of the assistant messages a run created.
+
+Args:
+    messages (list): Thread messages, in ascending order.
+    run_id (str): The id of the run.
+
+Returns:
+    str: The reply's text.
+"""
+def reply_text(messages: list, run_id: str) -> str:
+
+    return "".join(
+        part.text.value
+        for message in messages if message.role == "assistant" and message.run_id == run_id
+        for part in message.content if part.type == "text"
+    )
+
+"""
+Roughly estimates the tokens a turn will use, at about four characters
+per token for the prompt plus a typical reply.
+
+Args:
+    message (str): The user's message.
+
+Returns:
+    int: The estimated tokens.
+"""
+def estimate_tokens(message: str) -> int:
+    return len(message) // 4 + REPLY_TOKENS
+
 class ThreadManager():
     
     def __init__(
@@ -17,6 +75,9 @@ class ThreadManager():
         api_key: str,
         assistant_id: str,
         thread_id: str,
+        run_manager: RunManager = None,
+        user: str = "",
+        response_cache: ResponseCache = None,
     ):
         
         if not api_key:
@@ -24,56 +85,291 @@ class ThreadManager():
         elif not assistant_id:
             raise CredentialException("No Assistant Id provided!")
         
-        self.client: OpenAI = OpenAI(api_key=api_key)
+        self.client: OpenAI = get_client(api_key)
 
         self.assistant_id: str = assistant_id
         self.thread_id: str = thread_id
+        self.run_manager: RunManager = run_manager or RunManager()
+
+        # Calls are queued fairly by user, or by thread if no user is given.
+        self.user: str = user or thread_id
+
+        # Replies to repeated prompts are reused when a cache is given. Cached
+        # turns skip the run, but are still added to the thread.
+        self.response_cache: ResponseCache = response_cache
 
     """
     This function adds a message to the user's thread, runs it, waits for
-    a response, and then, will extract the message from the resulting
-    data structure.
+    a response, and then, will extract the reply's text from only the
+    messages created since the last sync.
 
     Args:
         message (str): The message to be sent to be added to the thread.
+        context (str): The digest of the chat history before the message, for the response cache.
 
     Returns:
-        list: All the messages in the current thread after response is ran, in descending order.
+        str: The text of the assistant's reply.
+
+    Raises:
+        RunException: If the run doesn't complete.
+        OverloadedException: If the scheduler's queue is full.
     """
-    def get_response(self, message: str) -> list:
+    @METRICS.timed("chatbot_thread")
+    def get_response(self, message: str, context: str = "") -> str:
+
+        if self.response_cache and (cached := self.response_cache.get(message, context, self.assistant_id)) is not None:
+            self.append_turn(message, cached)
+            return cached
+
+        response: str = self.run_turn(message)
+
+        if self.response_cache:
+            self.response_cache.set(message, response, context, self.assistant_id)
+
+        return response
+
+    """
+    Makes one API request through the shared scheduler, so each request
+    is rate limited and queued fairly on its own.
+
+    Args:
+        function (callable): The client method to call.
+        *args: Its positional arguments.
+        tokens (int): The tokens the request is expected to use.
+        **kwargs: Its keyword arguments.
+
+    Returns:
+        any: The method's result.
+    """
+    def call(self, function: callable, *args, tokens: int = 0, **kwargs) -> any:
+        return get_scheduler().run(self.user, function, *args, tokens=tokens, **kwargs)
+
+    """
+    Runs a whole turn. Each request is scheduled separately, and the
+    waits between polls happen on the calling thread, not a scheduler worker.
+
+    Args:
+        message (str): The message to be sent to be added to the thread.
+
+    Returns:
+        str: The text of the assistant's reply.
+    """
+    def run_turn(self, message: str) -> str:
 
         # Add the messages to the thread.
-        self.client.beta.threads.messages.create(
+        self.add_message(message)
+
+        # Run the thread. The run is what uses tokens.
+        run: Run = self.call(
+            self.client.beta.threads.runs.create,
+            thread_id=self.thread_id,
+            assistant_id=self.assistant_id,
+            tokens=estimate_tokens(message)
+        )
+
+        # Wait for completion.
+        run = self.run_manager.wait(self.client, run, self.call)
+
+        new_messages, _ = self.sync_messages()
+
+        return reply_text(new_messages, run.id)
+
+    """
+    Adds the user's message to the thread. Without a cursor yet, the
+    thread's cache starts after it, so the next sync doesn't fetch the
+    whole thread.
+
+    Args:
+        message (str): The user's message.
+
+    Returns:
+        Message: The message that was created.
+    """
+    def add_message(self, message: str) -> Message:
+
+        created: Message = self.call(
+            self.client.beta.threads.messages.create,
             self.thread_id,
             role="user",
             content=message
         )
 
-        # Run the thread.
-        run: Run = self.client.beta.threads.runs.create(
-            thread_id=self.thread_id,
-            assistant_id=self.assistant_id
+        if MESSAGE_CACHE.peek(self.thread_id) is None:
+            MESSAGE_CACHE.set(self.thread_id, {"messages": [created], "cursor": created.id, "complete": False})
+
+        return created
+
+    """
+    Adds a turn answered from the response cache to the thread without a
+    run, so the assistant sees it in later turns like any other.
+
+    Args:
+        message (str): The user's message.
+        reply (str): The cached reply.
+    """
+    def append_turn(self, message: str, reply: str) -> None:
+
+        self.add_message(message)
+
+        # The reply goes in as the assistant's own message.
+        self.call(
+            self.client.beta.threads.messages.create,
+            self.thread_id,
+            role="assistant",
+            content=reply
         )
 
-        # Wait for completion.
-        while run.status not in ["completed", "failed"]:
-            run: Run = self.client.beta.threads.runs.retrieve(
-                thread_id=self.thread_id,
-                run_id=run.id
-            )
+        self.sync_messages()
+
+    """
+    Fetches the messages created after the cached cursor and adds them to
+    the thread's cache. A thread that isn't cached yet is loaded in full.
+
+    Returns:
+        tuple[list, dict]: Only the messages that were fetched, in ascending order, and the thread's updated cache entry.
+    """
+    def sync_messages(self) -> tuple[list, dict]:
 
-        if run.status == "completed":
+        entry: dict = MESSAGE_CACHE.peek(self.thread_id) or {"messages": [], "cursor": None, "complete": True}
+        params: dict = {"order": "asc", "limit": 100}
 
-            response: list = self.client.beta.threads.messages.list(thread_id=self.thread_id, order="desc")
+        if entry["cursor"]:
+            params["after"] = entry["cursor"]
 
-            return response
+        page: any = self.call(self.client.beta.threads.messages.list, thread_id=self.thread_id, **params)
+        new_messages: list = list(page.data)
+
+        # Each further page is its own request.
+        while page.has_next_page():
+            page = self.call(page.get_next_page)
+            new_messages.extend(page.data)
+
+        if new_messages:
+            entry = {**entry, "messages": entry["messages"] + new_messages, "cursor": new_messages[-1].id}
+
+        MESSAGE_CACHE.set(self.thread_id, entry)
+
+        return new_messages, entry
         
     """
-    Returns all messages in a single thread.
+    Adds a message to the user's thread and runs it as a stream, yielding
+    the reply's text as it's generated.
+
+    Args:
+        message (str): The message to be sent to be added to the thread.
+        context (str): The digest of the chat history before the message, for the response cache.
+
+    Returns:
+        Iterator[str]: The pieces of the reply, in order. A cached reply comes in one piece.
+
+    Raises:
+        RunException: If the run doesn't complete.
+        OverloadedException: If the scheduler's queue is full.
+    """
+    def stream_response(self, message: str, context: str = "") -> Iterator[str]:
+
+        if self.response_cache and (cached := self.response_cache.get(message, context, self.assistant_id)) is not None:
+            self.append_turn(message, cached)
+            yield cached
+            return
+
+        pieces: list = []
+
+        # Decorating a generator would only time its creation, so the stream is tracked here.
+        with METRICS.track("chatbot_thread", operation="stream_response"):
+
+            # Only starting the run is scheduled; the stream is read here.
+            events: Iterable = self.start_stream(message)
+
+            for piece in self.read_stream(events):
+                pieces.append(piece)
+                yield piece
+
+        # Like a polled turn, only the messages after the cached cursor are fetched.
+        self.sync_messages()
+
+        # Only a reply that streamed to the end is worth reusing.
+        if self.response_cache:
+            self.response_cache.set(message, "".join(pieces), context, self.assistant_id)
+
+    """
+    Adds a message to the thread and starts a streamed run, scheduling
+    each request separately.
+
+    Args:
+        message (str): The message to be sent to be added to the thread.
+
+    Returns:
+        Iterable: The run's server-sent events.
+    """
+    def start_stream(self, message: str) -> Iterable:
+
+        self.add_message(message)
+
+        return self.call(
+            self.client.beta.threads.runs.create,
+            thread_id=self.thread_id,
+            assistant_id=self.assistant_id,
+            stream=True,
+            tokens=estimate_tokens(message)
+        )
+
+    """
+    Pulls the text out of a stream of run events.
+
+    Args:
+        events (Iterable): The server-sent events of a run.
+
+    Returns:
+        Iterator[str]: The pieces of the reply, in order.
+
+    Raises:
+        RunException: If the stream reports that the run ended without completing.
+    """
+    def read_stream(self, events: Iterable) -> Iterator[str]:
+
+        try:
+            for event in events:
+
+                if event.event == "thread.message.delta":
+
+                    for part in event.data.delta.content or []:
+
+                        if part.type == "text" and part.text and part.text.value:
+                            yield part.text.value
+
+                elif event.event in STREAM_FAILURES:
+
+                    status: str = STREAM_FAILURES[event.event]
+
+                    # Nothing here submits tool outputs, so don't leave the run waiting.
+                    if status == "requires_action":
+                        self.call(self.client.beta.threads.runs.cancel, thread_id=self.thread_id, run_id=event.data.id)
+
+                    raise RunException(f"Run on thread {self.thread_id} ended with status {status}.", status)
+
+        finally:
+
+            # Stop reading from the server if the caller stops early.
+            if hasattr(events, "close"):
+                events.close()
+
+    """
+    Returns all messages in a single thread, only fetching the ones that
+    aren't cached yet.
 
     Returns:
         list: All the messages in the current thread in ascending order.
     """
     def get_all_messages(self) -> list:
-        return self.client.beta.threads.messages.list(thread_id=self.thread_id, order="asc")
 
+        entry: dict = MESSAGE_CACHE.peek(self.thread_id)
+
+        # A cache seeded mid-thread is missing the older messages.
+        if entry is not None and not entry["complete"]:
+            MESSAGE_CACHE.delete(self.thread_id)
+
+        # The entry may be evicted as soon as it's stored, so the one the sync returns is used.
+        _, entry = self.sync_messages()
+
+        return list(entry["messages"])
@@ -1,9 +1,39 @@
+import os
+import tempfile
+import time
 import unittest
+from types import SimpleNamespace
+from threading import Thread
 import streamlit
 
 from managers.database_manager import DatabaseManager
+from managers.cache_manager import CacheManager
+from backends.memory_backend import MemoryBackend
+from backends.sqlite_backend import SqliteBackend
+from exceptions.duplicate_user_exception import DuplicateUserException
+from exceptions.run_exception import RunException
+from managers.run_manager import RunManager
+from managers.thread_manager import ThreadManager, MESSAGE_CACHE
+from managers.scheduler_manager import SchedulerManager, get_scheduler
+from managers.pool_manager import PoolManager
+from managers.assistant_manager import AssistantManager, SHARED_KIND
+from managers.job_manager import JobManager
+from managers.response_cache_manager import MemoryResponseCache, context_digest
+from managers.password_manager import PasswordManager, get_passwords, hash_rounds, _hash
+from exceptions.overloaded_exception import OverloadedException
+from managers.session_manager import SessionManager
+from managers.quota_manager import QuotaManager
+from exceptions.quota_exception import QuotaException
+from managers.generation_manager import GenerationManager
+from utils.openai_utils import get_client, create_assistant, create_thread, delete_thread, ASSISTANT_SETTINGS
+from benchmarks.fake_openai import FakeOpenAI, uniform
+from openai import NotFoundError
+from managers.metrics_manager import MetricsManager, COUNT_BUCKETS
+import httpx
 from exceptions.credential_exception import CredentialException
 from utils.authentication_utils import register_user, login_user, check_for_user
+from utils.chat_utils import HISTORY_WINDOW, load_older, session_user, start_turn, check_turn
+from utils import authentication_utils
 from utils.password_utils import hash_password
 
 """
@@ -15,6 +45,31 @@ VERSION: 1.1.0
 
 class DatabaseTest(unittest.TestCase):
 
+    """
+    Makes sure the shared "test" account the other tests read exists,
+    without inserting it twice.
+    """
+    @classmethod
+    def setUpClass(cls):
+
+        db: DatabaseManager = DatabaseManager(streamlit.secrets["authentication"]["uri"])
+
+        if db.retrieve({"user": "test"}, {"_id": 1}) is None:
+
+            try:
+                db.insert({
+                    "user": "test",
+                    "password": hash_password("1234"),
+                    "usage": 2000,
+                    "limit": 3000,
+                    "threads": ["1234", "2133"],
+                    "chat_history": [],
+                })
+
+            # Another test run created it first.
+            except DuplicateUserException:
+                pass
+
     """
     A basic test to make sure the secrets.toml file is
     in the right place and has the right fields.
@@ -45,6 +100,19 @@ class DatabaseTest(unittest.TestCase):
 
         self.assertIsNotNone(db.db)
 
+    """
+    Ensures that every DatabaseManager borrows the same pooled client
+    instead of opening its own.
+    """
+    def test_shared_client(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        first: DatabaseManager = DatabaseManager(uri)
+        second: DatabaseManager = DatabaseManager(uri)
+
+        self.assertIs(first.client, second.client)
+
     """
     Adds a document to the MongoDB database. The insert method
     will return a String id of the inserted item; thus, it should not
@@ -58,15 +126,20 @@ class DatabaseTest(unittest.TestCase):
 
         hash: bytes = hash_password("1234")
 
-        self.assertIsNotNone(
-            db.insert({
-                "user": "test",
-                "password": hash,
-                "usage": 2000,
-                "limit": 3000,
-                "threads": ["1234", "2133"]
-            })
-        )
+        # A fresh name each run, since the unique index refuses a second "test".
+        user_id: str = db.insert({
+            "user": f"test-insert-{time.time_ns()}",
+            "password": hash,
+            "usage": 2000,
+            "limit": 3000,
+            "threads": ["1234", "2133"]
+        })
+
+        try:
+            self.assertIsNotNone(user_id)
+
+        finally:
+            db.delete_user(user_id)
 
     """
     This test ensures that the database is able to query and return
@@ -130,6 +203,20 @@ class DatabaseTest(unittest.TestCase):
             )
         )
 
+    """
+    Ensures that logging in only takes a single query.
+    """
+    def test_login_round_trips(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        db: DatabaseManager = DatabaseManager(uri)
+        round_trips: int = db.round_trips
+
+        login_user(user="test", password="1234", db=db)
+
+        self.assertEqual(round_trips + 1, db.round_trips)
+
     """
     Tests that usage metrics are being updated in MongoDB
     """
@@ -146,12 +233,1226 @@ class DatabaseTest(unittest.TestCase):
 
         new_count: int = current_count + extra
 
-        db.update_count(test_user_id, extra)
+        returned_count: int = db.update_count(test_user_id, extra)
+        self.assertEqual(new_count, returned_count)
 
         updated_test_user: dict = db.get_user_by_id(test_user_id)
         current_count: int = updated_test_user["usage"]
 
         self.assertEqual(new_count, current_count)
 
+    """
+    Ensures that appended messages land at the end of the history
+    and can be read back one page at a time.
+    """
+    def test_chat_history_pages(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        db: DatabaseManager = DatabaseManager(uri)
+
+        test_user_id: str = db.get_user("test")["_id"]
+        db.update_chat_history("test", [])
+
+        db.append_chat_history(test_user_id, [
+            {"role": "user", "content": "one"},
+            {"role": "assistant", "content": "two"},
+        ])
+        db.append_chat_history(test_user_id, [{"role": "user", "content": "three"}])
+
+        page, start = db.get_chat_history(test_user_id, limit=2)
+        self.assertEqual(["two", "three"], [message["content"] for message in page])
+        self.assertEqual(1, start)
+
+        page, start = db.get_chat_history(test_user_id, limit=2, before=start)
+        self.assertEqual(["one"], [message["content"] for message in page])
+        self.assertEqual(0, start)
+
+    """
+    Ensures that a reservation is refused, without changing usage,
+    when it would push the user past their limit.
+    """
+    def test_reserve_usage(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        db: DatabaseManager = DatabaseManager(uri)
+
+        test_user: dict = db.get_user("test")
+        remaining: int = test_user["limit"] - test_user["usage"]
+
+        self.assertIsNone(db.reserve_usage(test_user["_id"], remaining + 1))
+        self.assertEqual(test_user["usage"], db.get_user("test")["usage"])
+
+        self.assertEqual(test_user["limit"], db.reserve_usage(test_user["_id"], remaining))
+        db.update_count(test_user["_id"], -remaining)
+
+    """
+    Ensures that a whole chat turn is persisted in a single round trip.
+    """
+    def test_record_turn(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        db: DatabaseManager = DatabaseManager(uri)
+
+        test_user: dict = db.get_user("test")
+        round_trips: int = db.round_trips
+
+        usage: int = db.record_turn(
+            user_id=test_user["_id"],
+            messages=[{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}],
+            extra=5,
+            thread_id="1234"
+        )
+
+        self.assertEqual(round_trips + 1, db.round_trips)
+        self.assertEqual(test_user["usage"] + 5, usage)
+        self.assertEqual(test_user["threads"], db.get_user("test")["threads"])
+
+        db.update_count(test_user["_id"], -5)
+
+    """
+    Ensures that repeated lookups are served from the cache and that
+    writes through the DatabaseManager drop the stale entry.
+    """
+    def test_user_cache(self):
+
+        uri: str = streamlit.secrets["authentication"]["uri"]
+
+        db: DatabaseManager = DatabaseManager(uri, cache=CacheManager())
+
+        test_user: dict = db.get_user("test", history=False)
+        round_trips: int = db.round_trips
+
+        self.assertNotIn("password", db.get_user("test", history=False))
+        self.assertNotIn("chat_history", db.get_user("test", history=False))
+        self.assertEqual(round_trips, db.round_trips)
+        self.assertEqual(2, db.cache.stats()["hits"])
+
+        db.update_count(test_user["_id"], 1)
+        self.assertEqual(test_user["usage"] + 1, db.get_user("test", history=False)["usage"])
+        db.update_count(test_user["_id"], -1)
+
+        db.add_thread(test_user["_id"], "5678")
+        self.assertIn("5678", db.get_user("test", history=False)["threads"])
+
+class CacheTest(unittest.TestCase):
+
+    """
+    Ensures that the least recently used entry is evicted once the
+    cache is full.
+    """
+    def test_lru_eviction(self):
+
+        cache: CacheManager = CacheManager(maxsize=2, ttl=60)
+
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual({"hits": 2, "misses": 1}, {
+            key: value for key, value in cache.stats().items() if key in ("hits", "misses")
+        })
+
+    """
+    Ensures that a write drops a user's cached views even after the entry
+    mapping their name to their id was evicted.
+    """
+    def test_invalidation_without_name(self):
+
+        cache: CacheManager = CacheManager(maxsize=16, ttl=60)
+        db: DatabaseManager = DatabaseManager("", cache=cache, backend=MemoryBackend())
+        user_id: str = db.insert({"user": "evicted", "password": b"", "usage": 0, "limit": 10, "assistant_id": "asst", "threads": [], "chat_history": []})
+
+        self.assertEqual([], db.get_user("evicted", history=False)["threads"])
+
+        cache.delete(("name", "evicted"))
+        db.add_thread(user_id, "thread_1")
+
+        self.assertIsNone(cache.peek(("user", user_id, "profile")))
+        self.assertEqual(["thread_1"], db.get_user("evicted", history=False)["threads"])
+
+class BackendTest(unittest.TestCase):
+
+    """
+    Runs the same chat flow against every embedded backend so that they
+    stay interchangeable.
+    """
+    def test_embedded_backends(self):
+
+        backends: list = [
+            MemoryBackend(),
+            SqliteBackend(os.path.join(tempfile.mkdtemp(), "test.db")),
+        ]
+
+        for backend in backends:
+
+            with self.subTest(backend=type(backend).__name__):
+
+                db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=backend)
+
+                user_id: str = db.insert({
+                    "user": "test",
+                    "password": hash_password("1234"),
+                    "usage": 0,
+                    "limit": 100,
+                    "assistant_id": "asst",
+                    "threads": [],
+                    "chat_history": [],
+                })
+
+                with self.assertRaises(DuplicateUserException):
+                    db.insert({"user": "test"})
+
+                self.assertTrue(login_user(user="test", password="1234", db=db))
+
+                db.add_thread(user_id, "thread")
+                self.assertEqual(10, db.reserve_usage(user_id, 10))
+                self.assertIsNone(db.reserve_usage(user_id, 91))
+                self.assertEqual(15, db.record_turn(
+                    user_id,
+                    [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}],
+                    5,
+                    "thread"
+                ))
+
+                user: dict = db.get_user("test")
+                self.assertEqual(["thread"], user["threads"])
+                self.assertEqual(2, len(user["chat_history"]))
+                self.assertEqual(([{"role": "assistant", "content": "hello"}], 1), db.get_chat_history(user_id, 1))
+
+                db.delete_user(user_id)
+                self.assertIsNone(db.get_user("test"))
+
+                # Once a job's lease runs out and it's claimed again, only the new claim may record its outcome.
+                db.enqueue_job("generate:1", "generate", {"prompt": "hi"}, 0)
+                job: dict = db.claim_job(time.time(), 60, ["generate"], "first")
+                self.assertTrue(db.renew_job(job["_id"], "first", time.time() + 60))
+
+                taken: dict = db.claim_job(time.time() + 120, 60, ["generate"], "second")
+                self.assertEqual((job["_id"], 2, "second"), (taken["_id"], taken["attempts"], taken["owner"]))
+                self.assertFalse(db.renew_job(job["_id"], "first", time.time() + 60))
+                self.assertFalse(db.fail_job(job["_id"], "Stalled", "first"))
+                self.assertFalse(db.finish_job(job["_id"], "first"))
+
+                # A job's result is kept until it's read and finished.
+                self.assertTrue(db.complete_job(job["_id"], {"reply": "hello", "usage": 2}, "second"))
+                self.assertEqual({"reply": "hello", "usage": 2}, db.get_job("generate:1")["result"])
+
+                self.assertTrue(db.finish_job(job["_id"]))
+                self.assertIsNone(db.get_job("generate:1"))
+
+                backend.close()
+
+class SchedulerTest(unittest.TestCase):
+
+    """
+    Ensures that a light user's calls aren't stuck behind a heavy user's backlog.
+    """
+    def test_fair_queuing(self):
+
+        scheduler: SchedulerManager = SchedulerManager(workers=1)
+        order: list = []
+
+        futures: list = [scheduler.submit("heavy", order.append, f"heavy-{index}") for index in range(4)]
+        futures += [scheduler.submit("light", order.append, f"light-{index}") for index in range(2)]
+
+        for future in futures:
+            future.result(timeout=5)
+
+        self.assertLess(order.index("light-1"), order.index("heavy-3"))
+        self.assertEqual(6, scheduler.metrics()["completed"])
+
+        scheduler.shutdown()
+
+    """
+    Ensures that calls past the request rate limit wait for the bucket to refill.
+    """
+    def test_rate_limit(self):
+
+        scheduler: SchedulerManager = SchedulerManager(workers=2, requests_per_minute=600)
+        scheduler.requests.level = 0
+
+        scheduler.run("user", lambda: None, timeout=5)
+
+        self.assertGreater(scheduler.metrics()["throttle_time"], 0)
+
+        scheduler.shutdown()
+
+class PoolTest(unittest.TestCase):
+
+    """
+    Ensures that the pool fills to its high watermark, serves takes from
+    the database, and deletes what's left over at shutdown.
+    """
+    def test_pool_lifecycle(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        created: list = []
+        deleted: list = []
+
+        def create() -> str:
+            created.append(f"asst_{len(created)}")
+            return created[-1]
+
+        pool: PoolManager = PoolManager(db, "key", low=1, high=3, interval=60, factories={
+            "assistant": (create, deleted.append),
+        })
+
+        pool.fill()
+        self.assertEqual(3, db.count_resources("assistant"))
+
+        self.assertEqual("asst_0", pool.take("assistant"))
+        self.assertEqual(1, pool.metrics()["hits"])
+
+        pool.shutdown()
+        self.assertEqual(["asst_1", "asst_2"], sorted(deleted))
+        self.assertEqual(0, db.count_resources("assistant"))
+
+class AssistantTest(unittest.TestCase):
+
+    """
+    Ensures that shared assistants are created once, assigned stably, and
+    that migrating a user queues the deletion of only their own assistant.
+    """
+    def test_shared_assistants(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        created: list = []
+        deleted: list = []
+
+        def create() -> str:
+            created.append(f"asst_{len(created)}")
+            return created[-1]
+
+        assistants: AssistantManager = AssistantManager(db, "key", size=2, create=create, delete=deleted.append)
+
+        self.assertEqual(["asst_0", "asst_1"], assistants.assistants())
+        self.assertEqual(assistants.assign("someone"), assistants.assign("someone"))
+
+        # A second process finds the same assistants instead of creating more.
+        self.assertEqual(["asst_0", "asst_1"], AssistantManager(db, "key", size=2, create=create).assistants())
+        self.assertEqual(2, len(created))
+
+        user_id: str = db.insert({"user": "someone", "usage": 0, "limit": 3000, "assistant_id": "asst_own"})
+        user: dict = db.get_user("someone")
+
+        jobs: JobManager = JobManager(db, "key", workers=0, handlers={})
+
+        # A retried migration queues the same deletion only once.
+        shared_id: str = assistants.migrate(dict(user), jobs)
+        self.assertEqual(shared_id, assistants.migrate(user, jobs))
+
+        self.assertTrue(assistants.is_shared(shared_id))
+        self.assertEqual([], deleted)
+        self.assertEqual(1, db.count_jobs("pending"))
+        self.assertEqual("pending", jobs.status("delete_assistant:asst_own")["status"])
+        self.assertEqual(shared_id, db.get_user_by_id(user_id)["assistant_id"])
+
+        # Migrating again changes nothing.
+        user["assistant_id"] = shared_id
+        self.assertEqual(shared_id, assistants.migrate(user, jobs))
+        self.assertEqual(1, db.count_jobs("pending"))
+
+    """
+    Ensures that when two processes create the shared assistants at once,
+    the oldest are kept and the extras are deleted.
+    """
+    def test_concurrent_creation(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        deleted: list = []
+
+        # Another process stores its assistant while this one is creating its own.
+        def create() -> str:
+            db.add_resource(SHARED_KIND, "asst_other")
+            return "asst_mine"
+
+        assistants: AssistantManager = AssistantManager(db, "key", size=1, create=create, delete=deleted.append)
+
+        self.assertEqual(["asst_other"], assistants.assistants())
+        self.assertEqual(["asst_mine"], deleted)
+        self.assertEqual(["asst_other"], db.list_resources(SHARED_KIND))
+
+class JobTest(unittest.TestCase):
+
+    """
+    Ensures that each thread's tracked round trips count only its own
+    queries, that the total loses none across threads, and that a job's
+    round trips leave out the claim that found it.
+    """
+    def test_round_trips(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        user_id: str = db.insert({"user": "tracked", "usage": 0, "limit": 100})
+        counts: list = []
+
+        def query() -> None:
+
+            with db.track() as counter:
+                for _ in range(200):
+                    db.retrieve({"_id": user_id}, {"usage": 1})
+
+            counts.append(counter["round_trips"])
+
+        before: int = db.round_trips
+        threads: list = [Thread(target=query) for _ in range(8)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([200] * 8, counts)
+        self.assertEqual(before + 1600, db.round_trips)
+
+        jobs: JobManager = JobManager(db, "key", workers=0, handlers={
+            "touch": lambda user_id: db.retrieve({"_id": user_id}, {"usage": 1}) and None,
+        })
+        jobs.enqueue("touch", {"user_id": user_id})
+        jobs.run_next()
+
+        # Reading the user, then removing the finished job.
+        self.assertEqual({"touch": 2}, jobs.metrics()["round_trips"])
+
+    """
+    Ensures that jobs are queued once per key, retried after a failure,
+    and kept as failed once they run out of attempts.
+    """
+    def test_job_retries(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        calls: list = []
+
+        def flaky(resource_id: str) -> None:
+
+            calls.append(resource_id)
+
+            if len(calls) == 1:
+                raise ConnectionError("Dropped")
+
+        def broken(resource_id: str) -> None:
+            raise ConnectionError("Always down")
+
+        jobs: JobManager = JobManager(db, "key", workers=0, max_attempts=2, base_delay=0, handlers={
+            "flaky": flaky,
+            "broken": broken,
+        })
+
+        jobs.enqueue("flaky", {"resource_id": "res_1"})
+        jobs.enqueue("flaky", {"resource_id": "res_1"})
+        self.assertEqual(1, db.count_jobs("pending"))
+
+        while jobs.run_next():
+            pass
+
+        self.assertEqual(["res_1", "res_1"], calls)
+        self.assertEqual({"completed": 1, "retried": 1, "failed": 0}, {
+            name: jobs.metrics()[name] for name in ("completed", "retried", "failed")
+        })
+
+        jobs.enqueue("broken", {"resource_id": "res_2"})
+
+        while jobs.run_next():
+            pass
+
+        self.assertEqual(1, db.count_jobs("failed"))
+        self.assertEqual(0, db.count_jobs("pending"))
+
+        jobs.shutdown()
+
+    """
+    Ensures that a job whose worker stopped mid-run is failed and undone
+    once its lease runs out, without running it again.
+    """
+    def test_interrupted_job(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        ran: list = []
+        undone: list = []
+
+        jobs: JobManager = JobManager(db, "key", workers=0, handlers={})
+        jobs.register(
+            "once",
+            lambda value: ran.append(value),
+            max_attempts=1,
+            lease=0.05,
+            on_failure=lambda value: undone.append(value)
+        )
+        jobs.enqueue("once", {"value": 1})
+
+        # A worker claims it with the kind's lease, then stops.
+        self.assertIsNotNone(jobs.claim())
+        self.assertFalse(jobs.run_next())
+
+        time.sleep(0.1)
+
+        self.assertTrue(jobs.run_next())
+        self.assertEqual([], ran)
+        self.assertEqual([1], undone)
+        self.assertEqual(1, db.count_jobs("failed"))
+
+        jobs.shutdown()
+
+    """
+    Ensures that a sweep only deletes this app's tagged assistants, even if
+    an untagged one has the same settings.
+    """
+    def test_sweep_tagged_only(self):
+
+        key: str = f"fake-{time.time_ns()}"
+        FakeOpenAI().install(key)
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        jobs: JobManager = JobManager(db, key, workers=0)
+
+        tagged: str = create_assistant(key)
+        get_client(key).beta.assistants.create(**ASSISTANT_SETTINGS)
+
+        jobs.sweep_assistants(0)
+
+        self.assertEqual(1, db.count_jobs("pending"))
+        self.assertIsNotNone(jobs.status(f"delete_assistant:{tagged}"))
+
+        jobs.shutdown()
+
+class ResponseCacheTest(unittest.TestCase):
+
+    """
+    Ensures that a repeated opening prompt is answered from the cache and
+    still added to the thread, while prompts with earlier messages or for
+    another assistant still reach the assistant.
+    """
+    def test_response_cache(self):
+
+        key: str = f"fake-{time.time_ns()}"
+        FakeOpenAI().install(key)
+
+        cache: MemoryResponseCache = MemoryResponseCache(maxsize=8, ttl=60)
+        assistant_id: str = create_assistant(key)
+        thread: ThreadManager = ThreadManager(key, assistant_id, create_thread(key), response_cache=cache)
+        runs: list = []
+
+        def run_turn(message: str) -> str:
+            runs.append(message)
+            return f"Reply {len(runs)}"
+
+        thread.run_turn = run_turn
+
+        self.assertEqual("Reply 1", thread.get_response("Hello there"))
+        self.assertEqual("Reply 1", thread.get_response("  hello   THERE "))
+        self.assertEqual(1, len(runs))
+
+        # Only the cached turn was added here, since the stand-in run posts nothing.
+        self.assertEqual(
+            [("user", "  hello   THERE "), ("assistant", "Reply 1")],
+            [(message.role, message.content[0].text.value) for message in thread.get_all_messages()]
+        )
+
+        context: list = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello!"}]
+
+        self.assertEqual("Reply 2", thread.get_response("Hello there", context_digest(context)))
+
+        other: ThreadManager = ThreadManager(key, create_assistant(key), create_thread(key), response_cache=cache)
+        other.run_turn = run_turn
+
+        self.assertEqual("Reply 3", other.get_response("Hello there"))
+        self.assertEqual({"hits": 1, "misses": 2, "bypassed": 1}, {
+            name: cache.stats()[name] for name in ("hits", "misses", "bypassed")
+        })
+
+class PasswordTest(unittest.TestCase):
+
+    """
+    Ensures that hashing runs in the pool, reports an outdated work factor,
+    and rejects work once the pool is full.
+    """
+    def test_password_pool(self):
+
+        passwords: PasswordManager = PasswordManager(rounds=5, workers=1, max_queue=1)
+
+        try:
+            hashed: bytes = passwords.hash("1234")
+
+            self.assertEqual(5, hash_rounds(hashed))
+            self.assertTrue(passwords.check("1234", hashed))
+            self.assertFalse(passwords.check("4321", hashed))
+            self.assertFalse(passwords.needs_rehash(hashed))
+            self.assertTrue(passwords.needs_rehash(passwords.hash("1234", rounds=4)))
+
+            # Slots are freed by a callback just after each result arrives.
+            while passwords.metrics()["pending"]:
+                time.sleep(0.01)
+
+            running: list = [passwords.submit(_hash, b"1234", 12) for _ in range(2)]
+
+            with self.assertRaises(OverloadedException):
+                passwords.submit(_hash, b"1234", 12)
+
+            for future in running:
+                future.result()
+
+            self.assertEqual(1, passwords.metrics()["rejected"])
+
+        finally:
+            passwords.shutdown()
+
+    """
+    Ensures that a login still succeeds when upgrading an old hash is
+    refused because the pool is full.
+    """
+    def test_rehash_best_effort(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        old: bytes = get_passwords().hash("1234", rounds=4)
+        user_id: str = db.insert({"user": "rehash", "password": old, "usage": 0, "limit": 100, "threads": []})
+
+        def overloaded(password: str) -> bytes:
+            raise OverloadedException("Busy.")
+
+        original: callable = authentication_utils.hash_password
+        authentication_utils.hash_password = overloaded
+
+        try:
+            self.assertTrue(login_user(user="rehash", password="1234", db=db))
+
+        finally:
+            authentication_utils.hash_password = original
+
+        self.assertEqual(old, db.retrieve({"_id": user_id}, {"password": 1})["password"])
+
+class SessionTest(unittest.TestCase):
+
+    """
+    Ensures that tokens carry what the chat renders, reject tampering, and
+    stop working once the user's sessions are revoked.
+    """
+    def test_session_tokens(self):
+
+        sessions: SessionManager = SessionManager("secret")
+        user: dict = {
+            "_id": "user_1",
+            "user": "test",
+            "usage": 10,
+            "limit": 3000,
+            "assistant_id": "asst_1",
+            "threads": ["thread_1"],
+        }
+
+        token: str = sessions.issue(user)
+        claims: dict = sessions.verify(token)
+
+        self.assertEqual("user_1", claims["sub"])
+        self.assertEqual(["thread_1"], claims["threads"])
+        self.assertIsNone(SessionManager("other").verify(token))
+        self.assertIsNone(sessions.verify(token[:-2]))
+
+        sessions.revoke("user_1")
+        self.assertIsNone(sessions.verify(token))
+
+        # Signing in again after the revocation works.
+        self.assertEqual("test", sessions.verify(sessions.issue(user))["user"])
+
+class QuotaTest(unittest.TestCase):
+
+    """
+    Ensures that a turn reserves its estimate up front, settles to the
+    words actually used, and is refused once the prompt can't fit.
+    """
+    def test_quota(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        user_id: str = db.insert({"user": "quota", "usage": 0, "limit": 20})
+        user: dict = {"_id": user_id, "usage": 0, "limit": 20}
+        quota: QuotaManager = QuotaManager(db, reply_words=10)
+
+        reserved: int = quota.reserve(user, "one two three")
+        self.assertEqual(13, reserved)
+        self.assertEqual(13, user["usage"])
+
+        usage: int = quota.settle(user, reserved, [
+            {"role": "user", "content": "one two three"},
+            {"role": "assistant", "content": "four five"},
+        ])
+        self.assertEqual(5, usage)
+
+        # Near the limit only what's left is reserved for the reply.
+        reserved = quota.reserve(user, " ".join(["word"] * 10))
+        self.assertEqual(15, reserved)
+        self.assertEqual(5, quota.release(user, reserved))
+
+        with self.assertRaises(QuotaException) as refused:
+            quota.reserve(user, " ".join(["word"] * 16))
+
+        self.assertTrue(refused.exception.exhausted)
+        self.assertEqual(5, db.get_user_by_id(user_id)["usage"])
+
+    """
+    Ensures that a stale usage, like one from an old session token, is
+    checked against the database before the account is called exhausted.
+    """
+    def test_stale_usage(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        user_id: str = db.insert({"user": "stale", "usage": 5, "limit": 20})
+        quota: QuotaManager = QuotaManager(db, reply_words=10)
+
+        # The session still shows the usage from before a reply was settled lower.
+        user: dict = {"_id": user_id, "usage": 18, "limit": 20}
+
+        self.assertEqual(13, quota.reserve(user, "one two three"))
+        self.assertEqual(18, user["usage"])
+
+        # The database is the one that says the prompt can't fit.
+        user["usage"] = 0
+
+        with self.assertRaises(QuotaException) as refused:
+            quota.reserve(user, " ".join(["word"] * 3))
+
+        self.assertTrue(refused.exception.exhausted)
+        self.assertEqual(18, user["usage"])
+
+class GenerationTest(unittest.TestCase):
+
+    """
+    Ensures that a real turn against the fake API stores the reply and
+    settles the usage, and that a failed run gives the reservation back.
+    """
+    def test_generate(self):
+
+        key: str = f"fake-{time.time_ns()}"
+        fake: FakeOpenAI = FakeOpenAI(run_time=0.01)
+        fake.install(key)
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        jobs: JobManager = JobManager(db, key, workers=0, handlers={})
+        generations: GenerationManager = GenerationManager(jobs)
+        quota: QuotaManager = QuotaManager(db, reply_words=10)
+
+        user_id: str = db.insert({"user": "generate", "usage": 0, "limit": 100, "threads": [], "chat_history": []})
+        user: dict = {"_id": user_id, "user": "generate", "usage": 0, "limit": 100}
+        thread: ThreadManager = ThreadManager(key, create_assistant(key), create_thread(key), user="generate")
+
+        # Two words reserved for the prompt and ten for the reply, settled to the four the reply used.
+        job_key: str = generations.submit(user, thread, "Hello there", [], quota.reserve(user, "Hello there"))
+        self.assertEqual(12, db.get_user_by_id(user_id)["usage"])
+        self.assertEqual("pending", generations.result(job_key)["state"])
+
+        jobs.run_next()
+
+        # The outcome is only reported once.
+        self.assertEqual({"state": "done", "reply": "You said: Hello there", "usage": 6}, generations.result(job_key))
+        self.assertIsNone(jobs.status(job_key))
+        self.assertEqual(6, db.get_user_by_id(user_id)["usage"])
+        self.assertEqual(2, len(db.get_chat_history(user_id)[0]))
+
+        fake.run_failure_rate = 1.0
+        job_key = generations.submit(user, thread, "Again", [], quota.reserve(user, "Again"))
+        self.assertEqual(17, db.get_user_by_id(user_id)["usage"])
+
+        jobs.run_next()
+
+        self.assertEqual("failed", generations.result(job_key)["state"])
+        self.assertEqual(0, db.count_jobs("failed"))
+        self.assertEqual(6, db.get_user_by_id(user_id)["usage"])
+        self.assertEqual(2, len(db.get_chat_history(user_id)[0]))
+
+        jobs.shutdown()
+
+    """
+    Ensures that a worker that stalled past its lease neither charges the
+    turn nor records its outcome once another worker took the job over
+    and gave the reservation back.
+    """
+    def test_lost_lease(self):
+
+        key: str = f"fake-{time.time_ns()}"
+        FakeOpenAI(run_time=0.01).install(key)
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        jobs: JobManager = JobManager(db, key, workers=0, handlers={})
+        generations: GenerationManager = GenerationManager(jobs)
+        quota: QuotaManager = QuotaManager(db, reply_words=10)
+
+        user_id: str = db.insert({"user": "stalled", "usage": 0, "limit": 100, "threads": [], "chat_history": []})
+        user: dict = {"_id": user_id, "user": "stalled", "usage": 0, "limit": 100}
+        thread: ThreadManager = ThreadManager(key, create_assistant(key), create_thread(key), user="stalled")
+
+        job_key: str = generations.submit(user, thread, "Hello there", [], quota.reserve(user, "Hello there"))
+        stalled: dict = jobs.claim()
+
+        # Its lease runs out, and the worker that takes it over gives the reservation back.
+        taken: dict = db.claim_job(time.time() + 1000, 60, ["generate"], "other")
+        generations.release(**taken["payload"])
+        db.fail_job(taken["_id"], "RuntimeError: The job was interrupted and can't be tried again.", "other")
+
+        # The stalled worker finishes afterwards.
+        jobs.claim = lambda: stalled
+        jobs.run_next()
+
+        self.assertEqual(0, db.get_user_by_id(user_id)["usage"])
+        self.assertEqual(0, len(db.get_chat_history(user_id)[0]))
+        self.assertEqual("failed", generations.result(job_key)["state"])
+        self.assertEqual(1, jobs.metrics()["lost"])
+
+    """
+    Ensures that a queued turn carries only a digest of the chat history,
+    not the history itself.
+    """
+    def test_context_digest(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        generations: GenerationManager = GenerationManager(JobManager(db, "key", workers=0, handlers={}))
+        context: list = [{"role": "user", "content": f"Message {index}"} for index in range(50)]
+
+        generations.submit({"_id": "someone", "user": "someone"}, SimpleNamespace(assistant_id="asst", thread_id="thread"), "Hi", context, 10)
+
+        self.assertEqual(context_digest(context), generations.jobs.claim()["payload"]["context"])
+
+    """
+    Ensures that turns and cleanup jobs are claimed only by their own
+    workers, so neither waits behind the other.
+    """
+    def test_separate_workers(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        cleanup: JobManager = JobManager(db, "key", workers=0)
+        generations: GenerationManager = GenerationManager(JobManager(db, "key", workers=0, handlers={}))
+
+        cleanup.enqueue("delete_user", {"user_id": "someone"})
+        generations.jobs.enqueue("generate", {"key": "turn"}, key="turn")
+
+        self.assertEqual("generate", generations.jobs.claim()["kind"])
+        self.assertIsNone(generations.jobs.claim())
+        self.assertEqual("delete_user", cleanup.claim()["kind"])
+        self.assertIsNone(cleanup.claim())
+
+class ChatFlowTest(unittest.TestCase):
+
+    """
+    Ensures that a turn started and checked through the shared chat steps
+    keeps the user's usage current, and that a turn that can't be queued
+    gives its words back.
+    """
+    def test_turn(self):
+
+        key: str = f"fake-{time.time_ns()}"
+        FakeOpenAI(run_time=0.01).install(key)
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        jobs: JobManager = JobManager(db, key, workers=0, handlers={})
+        generations: GenerationManager = GenerationManager(jobs)
+        quota: QuotaManager = QuotaManager(db, reply_words=10)
+
+        user_id: str = db.insert({"user": "flow", "usage": 0, "limit": 100, "threads": [], "chat_history": []})
+        user: dict = session_user(db, {
+            "sub": str(user_id), "user": "flow", "usage": 0, "limit": 100, "assistant_id": create_assistant(key), "threads": []
+        })
+        thread: ThreadManager = ThreadManager(key, user["assistant_id"], create_thread(key), user="flow")
+
+        turn: str = start_turn(quota, generations, user, thread, "Hello there", [])
+        self.assertEqual(12, user["usage"])
+
+        jobs.run_next()
+
+        self.assertEqual("You said: Hello there", check_turn(db, generations, user, turn)["reply"])
+        self.assertEqual(6, user["usage"])
+
+        def broken(*args) -> str:
+            raise ConnectionError("Dropped")
+
+        generations.submit = broken
+
+        with self.assertRaises(ConnectionError):
+            start_turn(quota, generations, user, thread, "Again", [])
+
+        self.assertEqual(6, db.get_user_by_id(user_id)["usage"])
+
+        jobs.shutdown()
+
+    """
+    Ensures that the chat starts with only the latest window of messages,
+    and that each "load older" click prepends the window before it until
+    the history's start.
+    """
+    def test_history_window(self):
+
+        db: DatabaseManager = DatabaseManager("", cache=CacheManager(), backend=MemoryBackend())
+        messages: list = [{"role": "user", "content": str(index)} for index in range(HISTORY_WINDOW * 2 + 5)]
+        user_id: str = db.insert({"user": "window", "usage": 0, "limit": 100, "chat_history": messages})
+
+        chat, start = db.get_chat_history(user_id, limit=HISTORY_WINDOW)
+
+        self.assertEqual(messages[-HISTORY_WINDOW:], chat)
+        self.assertEqual(HISTORY_WINDOW + 5, start)
+
+        start = load_older(db, user_id, chat, start)
+
+        self.assertEqual(messages[5:], chat)
+        self.assertEqual(5, start)
+
+        start = load_older(db, user_id, chat, start)
+
+        self.assertEqual(messages, chat)
+        self.assertEqual(0, start)
+
+class RunTest(unittest.TestCase):
+
+    """
+    Builds a stand-in client whose run reports each status in turn.
+    """
+    def fake_client(self, statuses: list) -> SimpleNamespace:
+
+        remaining: list = list(statuses)
+        cancelled: list = []
+
+        runs = SimpleNamespace(
+            retrieve=lambda thread_id, run_id: SimpleNamespace(id=run_id, thread_id=thread_id, status=remaining.pop(0)),
+            cancel=lambda thread_id, run_id: cancelled.append(run_id),
+        )
+
+        return SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=runs)), cancelled=cancelled)
+
+    """
+    Ensures that the poller backs off until the run completes and
+    records how many polls it took.
+    """
+    def test_wait_until_completed(self):
+
+        client = self.fake_client(["in_progress", "in_progress", "completed"])
+        run = SimpleNamespace(id="run", thread_id="thread", status="queued")
+        manager: RunManager = RunManager(initial_delay=0.001, max_delay=0.002)
+
+        self.assertEqual("completed", manager.wait(client, run).status)
+        self.assertEqual(3, manager.last()["polls"])
+
+    """
+    Ensures that runs needing action are cancelled and reported.
+    """
+    def test_requires_action(self):
+
+        client = self.fake_client(["requires_action"])
+        run = SimpleNamespace(id="run", thread_id="thread", status="queued")
+
+        with self.assertRaises(RunException) as context:
+            RunManager(initial_delay=0.001).wait(client, run)
+
+        self.assertEqual("requires_action", context.exception.status)
+        self.assertEqual(["run"], client.cancelled)
+
+    """
+    Ensures that a run that never finishes is cancelled at the deadline.
+    """
+    def test_timeout(self):
+
+        client = self.fake_client(["in_progress"] * 1000)
+        run = SimpleNamespace(id="run", thread_id="thread", status="queued")
+
+        with self.assertRaises(RunException) as context:
+            RunManager(initial_delay=0.001, max_delay=0.001, timeout=0.02).wait(client, run)
+
+        self.assertEqual("timeout", context.exception.status)
+        self.assertEqual(["run"], client.cancelled)
+
+    """
+    Ensures that every poll and the cancellation go through the given
+    call, so each one can be scheduled on its own.
+    """
+    def test_call_per_request(self):
+
+        client = self.fake_client(["in_progress", "requires_action"])
+        run = SimpleNamespace(id="run", thread_id="thread", status="queued")
+        requests: list = []
+
+        def call(function: callable, *args, **kwargs) -> any:
+            requests.append(function)
+            return function(*args, **kwargs)
+
+        with self.assertRaises(RunException):
+            RunManager(initial_delay=0.001).wait(client, run, call)
+
+        runs = client.beta.threads.runs
+        self.assertEqual([runs.retrieve, runs.retrieve, runs.cancel], requests)
+
+class OpenAIClientTest(unittest.TestCase):
+
+    """
+    Ensures that every ThreadManager with the same key shares one client.
+    """
+    def test_shared_client(self):
+
+        first: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="one")
+        second: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="two")
+
+        self.assertIs(first.client, second.client)
+        self.assertIs(get_client("key"), first.client)
+        self.assertIsNot(get_client("other"), first.client)
+
+class MessageSyncTest(unittest.TestCase):
+
+    """
+    Builds a stand-in messages API over a list, recording every list call.
+    """
+    def fake_messages(self, stored: list, calls: list) -> SimpleNamespace:
+
+        def list_messages(thread_id: str, order: str, limit: int, after: str = None) -> SimpleNamespace:
+
+            calls.append(after)
+            ids: list = [message.id for message in stored]
+            start: int = ids.index(after) + 1 if after else 0
+
+            return SimpleNamespace(data=stored[start:], has_next_page=lambda: False)
+
+        return SimpleNamespace(list=list_messages)
+
+    """
+    Ensures that only the messages after the cursor are fetched once the
+    thread is cached.
+    """
+    def test_incremental_sync(self):
+
+        stored: list = [SimpleNamespace(id="msg_0", role="user", run_id=None, content=[])]
+        calls: list = []
+
+        thread: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="sync")
+        thread.client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(
+            messages=self.fake_messages(stored, calls)
+        )))
+        MESSAGE_CACHE.delete("sync")
+
+        self.assertEqual(1, len(thread.get_all_messages()))
+
+        stored.append(SimpleNamespace(id="msg_1", role="assistant", run_id="run", content=[]))
+
+        self.assertEqual(["msg_1"], [message.id for message in thread.sync_messages()[0]])
+        self.assertEqual(2, len(thread.get_all_messages()))
+        self.assertEqual([None, "msg_0", "msg_1"], calls)
+
+    """
+    Ensures that all messages are returned even if the thread's entry is
+    evicted right after it's synced.
+    """
+    def test_evicted_entry(self):
+
+        stored: list = [SimpleNamespace(id="msg_0", role="user", run_id=None, content=[])]
+        calls: list = []
+
+        thread: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="evicted")
+        thread.client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(
+            messages=self.fake_messages(stored, calls)
+        )))
+        sync: callable = thread.sync_messages
+
+        def sync_and_evict() -> tuple[list, dict]:
+            synced: tuple[list, dict] = sync()
+            MESSAGE_CACHE.delete("evicted")
+            return synced
+
+        thread.sync_messages = sync_and_evict
+
+        self.assertEqual(["msg_0"], [message.id for message in thread.get_all_messages()])
+
+class StreamTest(unittest.TestCase):
+
+    """
+    Builds a text delta event like the ones the Assistants API streams.
+    """
+    def delta(self, text: str) -> SimpleNamespace:
+
+        part = SimpleNamespace(type="text", text=SimpleNamespace(value=text))
+
+        return SimpleNamespace(
+            event="thread.message.delta",
+            data=SimpleNamespace(delta=SimpleNamespace(content=[part]))
+        )
+
+    """
+    Ensures that text deltas are yielded in order from a local event stream.
+    """
+    def test_stream_deltas(self):
+
+        thread: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="thread")
+        events: list = [
+            SimpleNamespace(event="thread.run.created", data=None),
+            self.delta("Hello"),
+            self.delta(", world"),
+            SimpleNamespace(event="thread.run.completed", data=None),
+        ]
+
+        self.assertEqual(["Hello", ", world"], list(thread.read_stream(events)))
+
+    """
+    Ensures that a failed run stops the stream with a RunException.
+    """
+    def test_stream_failure(self):
+
+        thread: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="thread")
+        events: list = [self.delta("Hel"), SimpleNamespace(event="thread.run.failed", data=None)]
+
+        with self.assertRaises(RunException) as context:
+            list(thread.read_stream(events))
+
+        self.assertEqual("failed", context.exception.status)
+
+    """
+    Ensures that a run left waiting on tool outputs is cancelled through
+    the scheduler, like every other request.
+    """
+    def test_stream_cancel_scheduled(self):
+
+        cancelled: list = []
+        thread: ThreadManager = ThreadManager(api_key="key", assistant_id="asst", thread_id="thread")
+        thread.client = SimpleNamespace(beta=SimpleNamespace(threads=SimpleNamespace(runs=SimpleNamespace(
+            cancel=lambda thread_id, run_id: cancelled.append(run_id)
+        ))))
+        events: list = [SimpleNamespace(event="thread.run.requires_action", data=SimpleNamespace(id="run"))]
+        before: int = get_scheduler().metrics()["completed"]
+
+        with self.assertRaises(RunException):
+            list(thread.read_stream(events))
+
+        self.assertEqual(["run"], cancelled)
+        self.assertEqual(before + 1, get_scheduler().metrics()["completed"])
+
+class FakeOpenAITest(unittest.TestCase):
+
+    """
+    Points a fresh key at a fake API and creates an assistant and thread on it.
+    """
+    def setUp(self):
+
+        self.fake: FakeOpenAI = FakeOpenAI(latency=uniform(0.0, 0.005), run_time=0.05, rate_limit_rate=0.2, retry_after=0.01, seed=3)
+        self.key: str = f"fake-{time.time_ns()}"
+        self.fake.install(self.key)
+
+        self.assistant_id: str = create_assistant(self.key, "test")
+        self.thread_id: str = create_thread(self.key, "test")
+
+    """
+    Ensures that polled and streamed turns get their replies through
+    rate limits, and that both are stored in the thread.
+    """
+    def test_turns(self):
+
+        thread: ThreadManager = ThreadManager(
+            api_key=self.key,
+            assistant_id=self.assistant_id,
+            thread_id=self.thread_id,
+            run_manager=RunManager(initial_delay=0.01)
+        )
+
+        self.assertEqual("You said: Hello", thread.get_response("Hello"))
+        self.assertEqual("You said: Hi there", "".join(thread.stream_response("Hi there")))
+
+        # The streamed turn moved the thread's cursor to its reply.
+        self.assertEqual("You said: Hi there", MESSAGE_CACHE.peek(self.thread_id)["messages"][-1].content[0].text.value)
+        self.assertEqual(4, len(thread.get_all_messages()))
+        self.assertGreater(sum(counts["rate_limited"] for counts in self.fake.stats().values()), 0)
+
+    """
+    Ensures that a polled turn schedules each request on its own: adding
+    the message, starting the run, every poll and each page of messages.
+    """
+    def test_scheduled_requests(self):
+
+        thread: ThreadManager = ThreadManager(
+            api_key=self.key,
+            assistant_id=self.assistant_id,
+            thread_id=self.thread_id,
+            run_manager=RunManager(initial_delay=0.01)
+        )
+        scheduler: SchedulerManager = get_scheduler()
+        before: int = scheduler.metrics()["completed"]
+
+        self.assertEqual("You said: Hello", thread.get_response("Hello"))
+
+        # The reply's page, then the empty page after it.
+        self.assertEqual(2 + thread.run_manager.last()["polls"] + 2, scheduler.metrics()["completed"] - before)
+
+    """
+    Ensures that failed runs raise a RunException whether polled or
+    streamed, and that deleting a missing thread is a NotFoundError.
+    """
+    def test_failures(self):
+
+        self.fake.run_failure_rate = 1.0
+        thread: ThreadManager = ThreadManager(
+            api_key=self.key,
+            assistant_id=self.assistant_id,
+            thread_id=self.thread_id,
+            run_manager=RunManager(initial_delay=0.01)
+        )
+
+        with self.assertRaises(RunException):
+            thread.get_response("Hello")
+
+        with self.assertRaises(RunException):
+            list(thread.stream_response("Hello"))
+
+        delete_thread(self.key, self.thread_id)
+
+        with self.assertRaises(NotFoundError):
+            delete_thread(self.key, self.thread_id)
+
+class MetricsTest(unittest.TestCase):
+
+    """
+    Ensures that tracked calls are counted by outcome and timed, and that
+    nothing is collected while metrics are off.
+    """
+    def test_tracking(self):
+
+        metrics: MetricsManager = MetricsManager()
+
+        @metrics.timed("test_call")
+        def call(fail: bool) -> None:
+
+            if fail:
+                raise ValueError("Failed.")
+
+        call(False)
+        self.assertEqual("\n", metrics.render())
+
+        metrics.enable()
+        call(False)
+
+        with self.assertRaises(ValueError):
+            call(True)
+
+        metrics.observe("test_polls", 3, buckets=COUNT_BUCKETS)
+        text: str = metrics.render()
+
+        self.assertIn('test_call_total{operation="call",outcome="ok"} 1', text)
+        self.assertIn('test_call_total{operation="call",outcome="error"} 1', text)
+        self.assertIn('test_call_in_flight{operation="call"} 0', text)
+        self.assertIn('test_call_seconds_count{operation="call"} 2', text)
+        self.assertIn('test_polls_bucket{le="2"} 0', text)
+        self.assertIn('test_polls_bucket{le="4"} 1', text)
+        self.assertIn("# TYPE test_call_seconds histogram", text)
+
+    """
+    Ensures that the metrics are served in the text format at /metrics.
+    """
+    def test_endpoint(self):
+
+        metrics: MetricsManager = MetricsManager()
+        port: int = metrics.enable(port=0)
+
+        try:
+            metrics.inc("test_requests_total", status=429)
+            response: httpx.Response = httpx.get(f"http://localhost:{port}/metrics")
+
+            self.assertEqual(200, response.status_code)
+            self.assertIn('test_requests_total{status="429"} 1', response.text)
+            self.assertEqual(404, httpx.get(f"http://localhost:{port}/other").status_code)
+
+        finally:
+            metrics.shutdown()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -2,8 +2,11 @@ import streamlit as st
 
 from managers.database_manager import DatabaseManager
 from exceptions.credential_exception import CredentialException
-from utils.password_utils import check_password
-from utils.openai_utils import create_assistant
+from exceptions.duplicate_user_exception import DuplicateUserException
+from exceptions.overloaded_exception import OverloadedException
+from utils.password_utils import check_password, hash_password, needs_rehash
+from managers.pool_manager import get_pool
+from managers.assistant_manager import get_assistants
 
 """
 Provides all the processes for authenticating a user or creating a new user.
@@ -27,7 +30,7 @@ def check_for_user(user: str, db: DatabaseManager) -> bool:
     if not user:
         raise CredentialException("Invalid user.")
     
-    result: dict = db.retrieve({"user": user})
+    result: dict = db.retrieve({"user": user}, {"user": 1})
     
     if result and result["user"] == user:
         return True
@@ -41,29 +44,45 @@ Args:
     user (str): The user to insert.
     hash (str): The encrypted password.
     db (DatabaseManager): The DatabaseManager currently employed.
+    api_key (str): The key to your OpenAI account. Defaults to the one in the app's secrets.
+    shared (int): How many shared assistants there are, or 0 for one per user. Defaults to the app's setting.
 
 Returns:
     bool: Whether or not the operation is successful.
 """
-def register_user(user: str, hash: bytes, db: DatabaseManager) -> bool:
+def register_user(user: str, hash: bytes, db: DatabaseManager, api_key: str = None, shared: int = None) -> bool:
 
-    # Ensure no duplicates are created.
-    user_exists: bool = check_for_user(user, db)
-    if user_exists: return False
+    # Callers outside Streamlit, like the load benchmark, pass the settings in.
+    api_key = api_key or st.secrets["openai"]["api_key"]
 
-    # Only create the assistant after we verify the user doesn't exist already.
-    api_key: str = st.secrets["openai"]["api_key"]
-    assistant_id: str = create_assistant(api_key)
-    
-    db.insert({
-        "user": user,
-        "password": hash,
-        "usage": 0,
-        "limit": 3000,
-        "assistant_id": assistant_id,
-        "threads": [],
-        "chat_history": [],
-    })
+    if shared is None:
+        shared = st.secrets["openai"].get("shared_assistants", 0)
+
+    # Shared assistants are reused as they are; otherwise the user gets their own.
+    if shared:
+        assistant_id: str = get_assistants(db, api_key, shared).assign(user)
+    else:
+        assistant_id: str = get_pool(db, api_key).take("assistant")
+
+    # The unique index on the username rejects duplicates, even concurrent ones.
+    try:
+        db.insert({
+            "user": user,
+            "password": hash,
+            "usage": 0,
+            "limit": 3000,
+            "assistant_id": assistant_id,
+            "threads": [],
+            "chat_history": [],
+        })
+
+    except DuplicateUserException:
+
+        # The assistant is still unused, so it can go back for the next sign-up.
+        if not shared:
+            get_pool(db, api_key).give_back("assistant", assistant_id)
+
+        return False
 
     return True
 
@@ -77,18 +96,31 @@ Args:
 
 Returns:
     bool: Whether or not the operation was a success.
+
+Raises:
+    OverloadedException: If too many passwords are already being checked. Upgrading an old hash is skipped instead.
 """
 def login_user(user: str, password: str, db: DatabaseManager) -> bool:
 
-    verified: bool = False
-    user_exists: bool = check_for_user(user, db)
+    if not user:
+        raise CredentialException("Invalid user.")
+
+    result: dict = db.retrieve({"user": user}, {"user": 1, "password": 1})
+
+    if not result:
+        return False
+
+    if result["user"] != user or not check_password(password, result["password"]):
+        return False
+
+    # The password is only known now, so this is when an old work factor can be upgraded.
+    if needs_rehash(result["password"]):
+
+        try:
+            db.set_password(result["_id"], hash_password(password))
 
-    if user_exists:
-        
-        result: dict = db.retrieve({"user": user})
-        username: str = result["user"]
-        hash: bytes = result["password"]
+        # The upgrade can wait for a later login; this one already succeeded.
+        except OverloadedException:
+            pass
 
-        verified: bool = username == user and check_password(password, hash)
-            
-    return verified
\ No newline at end of file
+    return True
\ No newline at end of file
@@ -0,0 +1,166 @@
+from managers.database_manager import DatabaseManager
+from managers.thread_manager import ThreadManager
+from managers.quota_manager import QuotaManager
+from managers.generation_manager import GenerationManager
+from managers.pool_manager import get_pool
+from managers.assistant_manager import get_assistants
+from managers.job_manager import get_jobs
+
+"""
+Provides the steps of a chat turn, from opening the user's thread to
+reading back the reply, without anything tied to Streamlit. The chat page
+and the load benchmark both call these, so they run the same flow.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# How many messages are loaded at first, and with each "load older" click.
+HISTORY_WINDOW: int = 20
+
+"""
+Builds the user from their verified session, without reading the database.
+
+Args:
+    db (DatabaseManager): The currently employed DatabaseManager, to parse the id.
+    claims (dict): The session token's claims.
+
+Returns:
+    dict: The user's `_id`, `user`, `usage`, `limit`, `assistant_id` and `threads`.
+"""
+def session_user(db: DatabaseManager, claims: dict) -> dict:
+
+    return {
+        "_id": db.parse_id(claims["sub"]),
+        "user": claims["user"],
+        "usage": claims["usage"],
+        "limit": claims["limit"],
+        "assistant_id": claims["assistant_id"],
+        "threads": claims["threads"],
+    }
+
+"""
+Opens the user's thread. Users with their own assistant move onto a
+shared one when assistants are shared, and a user without a thread takes
+one from the pool.
+
+Args:
+    db (DatabaseManager): The currently employed DatabaseManager.
+    api_key (str): The key to your OpenAI account.
+    user (dict): The user, as from `session_user`. Updated in place.
+    shared (int): How many assistants are shared between users, or 0 if each has their own.
+
+Returns:
+    tuple[ThreadManager, bool]: The thread, and whether the user changed, so their session needs signing again.
+"""
+def open_thread(db: DatabaseManager, api_key: str, user: dict, shared: int = 0) -> tuple[ThreadManager, bool]:
+
+    changed: bool = False
+
+    if shared:
+
+        assistant_id: str = get_assistants(db, api_key, shared).migrate(user, get_jobs(db, api_key))
+
+        if assistant_id != user["assistant_id"]:
+            user["assistant_id"] = assistant_id
+            changed = True
+
+    if not user["threads"]:
+        thread_id: str = get_pool(db, api_key).take("thread")
+        db.add_thread(user["_id"], thread_id)
+        user["threads"] = [thread_id]
+        changed = True
+
+    thread: ThreadManager = ThreadManager(
+        api_key=api_key,
+        assistant_id=user["assistant_id"],
+        thread_id=user["threads"][0],
+        user=user["user"]
+    )
+
+    return thread, changed
+
+"""
+Prepends the page of messages before the loaded window to it.
+
+Args:
+    db (DatabaseManager): The currently employed DatabaseManager.
+    user_id (any): The id of the user.
+    chat (list[dict]): The loaded window of the chat history. Updated in place.
+    start (int): Where the loaded window starts in the whole history.
+
+Returns:
+    int: Where the window starts now. Once it's 0, there's nothing older to load.
+"""
+def load_older(db: DatabaseManager, user_id: any, chat: list[dict], start: int) -> int:
+
+    older, start = db.get_chat_history(user_id, limit=HISTORY_WINDOW, before=start)
+    chat[:0] = older
+
+    return start
+
+"""
+Reserves a turn's words and queues its reply.
+
+Args:
+    quota (QuotaManager): Reserves the words.
+    generations (GenerationManager): Generates the reply in the background.
+    user (dict): The user. Their usage is updated in place.
+    thread (ThreadManager): The user's thread.
+    prompt (str): The user's message.
+    context (list[dict]): The chat history before the message.
+
+Returns:
+    str: The turn's key, to check on with `check_turn`.
+
+Raises:
+    QuotaException: If the words can't be reserved.
+"""
+def start_turn(
+    quota: QuotaManager,
+    generations: GenerationManager,
+    user: dict,
+    thread: ThreadManager,
+    prompt: str,
+    context: list[dict]
+) -> str:
+
+    reserved: int = quota.reserve(user, prompt)
+
+    try:
+        return generations.submit(user, thread, prompt, context, reserved)
+
+    # A turn that was never queued won't give its words back on its own.
+    except Exception:
+        quota.release(user, reserved)
+        raise
+
+"""
+Checks on a turn once. When it's over, the user's usage is brought up to
+date: from the turn when it's done, or from the database when it failed,
+since the worker gave the reservation back.
+
+Args:
+    db (DatabaseManager): The currently employed DatabaseManager.
+    generations (GenerationManager): Where the turn was queued.
+    user (dict): The user. Their usage is updated in place.
+    key (str): The turn's key.
+
+Returns:
+    dict: The turn's outcome, as from `GenerationManager.result`. A done turn's `usage` is None if the user no longer exists.
+"""
+def check_turn(db: DatabaseManager, generations: GenerationManager, user: dict, key: str) -> dict:
+
+    result: dict = generations.result(key)
+
+    if result["state"] == "done" and result["usage"] is not None:
+        user["usage"] = result["usage"]
+
+    elif result["state"] == "failed":
+
+        stored: dict = db.retrieve({"_id": user["_id"]}, {"usage": 1})
+
+        if stored is not None:
+            user["usage"] = stored["usage"]
+
+    return result
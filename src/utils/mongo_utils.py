@@ -0,0 +1,98 @@
+import atexit
+import time
+from threading import Lock
+
+from pymongo.mongo_client import MongoClient
+from pymongo.server_api import ServerApi
+from pymongo.errors import ConnectionFailure
+
+"""
+Keeps a single pooled MongoClient per connection string for the whole process.
+
+AUTHOR: Arthur Riechert
+VERSION: 1.0.0
+"""
+
+# Seconds between health checks of a cached client.
+HEALTH_CHECK_INTERVAL: float = 30.0
+
+_clients: dict = {}
+_last_checked: dict = {}
+_lock: Lock = Lock()
+
+"""
+Returns the shared client for a connection string, creating it on first use.
+The client is only pinged when it hasn't been checked recently, and the ping
+runs outside the lock so other callers never wait on it.
+
+The pool sizes only apply to the call that creates the client; later calls
+for the same connection string get the existing client as it is.
+
+Args:
+    uri (str): The MongoDB connection string.
+    max_pool_size (int): The most connections the client will open.
+    min_pool_size (int): The connections kept open while idle.
+
+Returns:
+    MongoClient: The shared client.
+
+Raises:
+    ConnectionError: If the health check fails.
+"""
+def get_client(uri: str, max_pool_size: int = 100, min_pool_size: int = 0) -> MongoClient:
+
+    with _lock:
+
+        client: MongoClient = _clients.get(uri)
+
+        if client is None:
+            client = MongoClient(
+                uri,
+                server_api=ServerApi('1'),
+                maxPoolSize=max_pool_size,
+                minPoolSize=min_pool_size,
+            )
+            _clients[uri] = client
+            _last_checked[uri] = 0.0
+
+        now: float = time.monotonic()
+        check: bool = now - _last_checked[uri] >= HEALTH_CHECK_INTERVAL
+
+        # Claim the check, so concurrent callers don't all ping at once.
+        if check:
+            _last_checked[uri] = now
+
+    if not check:
+        return client
+
+    try:
+        client.admin.command('ping')
+
+    except ConnectionFailure as e:
+
+        with _lock:
+
+            # Drop the client so the next caller gets a fresh one, unless another caller already has.
+            # It isn't closed, since others may still be using it and the driver reconnects on its own.
+            if _clients.get(uri) is client:
+                del _clients[uri]
+                del _last_checked[uri]
+
+        raise ConnectionError(f"Connection failed: {e}")
+
+    return client
+
+"""
+Closes every shared client. Runs automatically when the process exits.
+"""
+def close_clients() -> None:
+
+    with _lock:
+
+        for client in _clients.values():
+            client.close()
+
+        _clients.clear()
+        _last_checked.clear()
+
+atexit.register(close_clients)
@@ -1,4 +1,11 @@
+from managers.scheduler_manager import get_scheduler
+from managers.metrics_manager import METRICS
 from openai import OpenAI
+from openai.types.beta.assistant import Assistant
+
+import atexit
+import httpx
+from threading import Lock
 
 """
 Functions to work with OpenAI's API.
@@ -7,39 +14,182 @@ AUTHOR: Arthur Riechert
 VERSION: 1.1.0
 """
 
+# How every assistant this app creates is configured.
+ASSISTANT_SETTINGS: dict = {
+    "instructions": "You are a friendly assistant.",
+    "tools": [{"type": "retrieval"}],
+    "model": "gpt-4-1106-preview",
+}
+
+# Tags the assistants this app creates, so a sweep never touches anyone else's.
+ASSISTANT_METADATA: dict = {"app": "streamlit-chatbot-demo"}
+
+_clients: dict = {}
+_lock: Lock = Lock()
+
 """
-Creates a default assistant in OpenAI.
+Counts a response from OpenAI by method and status.
+
+Args:
+    response (httpx.Response): The response.
+"""
+def _count_response(response: httpx.Response) -> None:
+    METRICS.inc("chatbot_openai_responses_total", method=response.request.method, status=response.status_code)
+
+"""
+Builds the httpx connection settings of a shared client.
+
+Returns:
+    dict: The keyword arguments for an httpx client.
+"""
+def _http_settings(
+    max_connections: int,
+    max_keepalive_connections: int,
+    keepalive_expiry: float,
+    timeout: float,
+    connect_timeout: float,
+    transport: httpx.BaseTransport = None
+) -> dict:
+
+    settings: dict = {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        "timeout": httpx.Timeout(timeout, connect=connect_timeout),
+    }
+
+    # Every response is counted by status, so rate limits and errors show up in the metrics.
+    settings["event_hooks"] = {"response": [_count_response]}
+
+    # A custom transport, like the fake API in benchmarks.fake_openai, replaces the network.
+    if transport is not None:
+        settings["transport"] = transport
+
+    return settings
+
+"""
+Returns the shared client for an API key, creating it on first use so
+every caller reuses its keep-alive connections. The connection settings
+only apply to the call that creates the client.
 
 Args:
     api_key (str): The key to your OpenAI account.
+    max_connections (int): The most connections the client will open.
+    max_keepalive_connections (int): The idle connections kept open for reuse.
+    keepalive_expiry (float): Seconds an idle connection is kept open.
+    timeout (float): Seconds to wait on each request.
+    connect_timeout (float): Seconds to wait while connecting.
+    transport (httpx.BaseTransport): Handles the requests instead of the network, for testing.
+
+Returns:
+    OpenAI: The shared client.
+"""
+def get_client(
+    api_key: str,
+    max_connections: int = 100,
+    max_keepalive_connections: int = 20,
+    keepalive_expiry: float = 60.0,
+    timeout: float = 60.0,
+    connect_timeout: float = 5.0,
+    transport: httpx.BaseTransport = None
+) -> OpenAI:
+
+    with _lock:
+
+        client: OpenAI = _clients.get(api_key)
+
+        if client is None:
+
+            http_client: httpx.Client = httpx.Client(**_http_settings(
+                max_connections, max_keepalive_connections, keepalive_expiry, timeout, connect_timeout, transport
+            ))
+
+            client = OpenAI(api_key=api_key, http_client=http_client)
+            _clients[api_key] = client
+
+        return client
+
+"""
+Closes every shared client. Runs automatically when the process exits.
+"""
+def close_clients() -> None:
+
+    with _lock:
+
+        for client in _clients.values():
+            client.close()
+
+        _clients.clear()
+
+atexit.register(close_clients)
+
+"""
+Creates a default assistant in OpenAI, through the shared scheduler.
+
+Args:
+    api_key (str): The key to your OpenAI account.
+    user (str): Who the assistant is for, so the scheduler can queue fairly.
 
 Returns:
     str: The id of the assistant created.
 """
-def create_assistant(api_key: str) -> str:
-    return OpenAI(api_key=api_key).beta.assistants.create(
-        instructions="You are a friendly assistant.",
-        tools=[{"type": "retrieval"}],
-        model="gpt-4-1106-preview",
-    ).id
+@METRICS.timed("chatbot_openai")
+def create_assistant(api_key: str, user: str = "") -> str:
+    return get_scheduler().run(user, lambda: get_client(api_key).beta.assistants.create(
+        **ASSISTANT_SETTINGS,
+        metadata=ASSISTANT_METADATA,
+    ).id)
+
+"""
+Deletes an existing assistant, through the shared scheduler.
 
+Args:
+    api_key (str): The key to your OpenAI account.
+    assistant_id (str): The assistant to delete.
+    user (str): Who the assistant belonged to.
 """
-Deletes an existing assistant.
+@METRICS.timed("chatbot_openai")
+def delete_assistant(api_key: str, assistant_id: str, user: str = "") -> None:
+    get_scheduler().run(user, get_client(api_key).beta.assistants.delete, assistant_id)
+
+"""
+Lists every assistant in the account, through the shared scheduler.
 
 Args:
     api_key (str): The key to your OpenAI account.
+    user (str): Who the listing is for.
+
+Returns:
+    list[Assistant]: The assistants, newest first.
 """
-def delete_assistant(api_key: str, assistant_id: str) -> None:
-    OpenAI(api_key=api_key).beta.assistants.delete(assistant_id)
+@METRICS.timed("chatbot_openai")
+def list_assistants(api_key: str, user: str = "") -> list[Assistant]:
+    return get_scheduler().run(user, lambda: list(get_client(api_key).beta.assistants.list(limit=100)))
 
 """
-Creates a new thread.
+Creates a new thread, through the shared scheduler.
 
 Args:
     api_key (str): The key to your OpenAI account.
+    user (str): Who the thread is for.
 
 Returns:
     str: The thread's id.
 """
-def create_thread(api_key: str) -> str:
-    return OpenAI(api_key=api_key).beta.threads.create().id
\ No newline at end of file
+@METRICS.timed("chatbot_openai")
+def create_thread(api_key: str, user: str = "") -> str:
+    return get_scheduler().run(user, lambda: get_client(api_key).beta.threads.create().id)
+
+"""
+Deletes an existing thread, through the shared scheduler.
+
+Args:
+    api_key (str): The key to your OpenAI account.
+    thread_id (str): The thread to delete.
+    user (str): Who the thread belonged to.
+"""
+@METRICS.timed("chatbot_openai")
+def delete_thread(api_key: str, thread_id: str, user: str = "") -> None:
+    get_scheduler().run(user, get_client(api_key).beta.threads.delete, thread_id)
\ No newline at end of file
@@ -1,10 +1,11 @@
-from bcrypt import gensalt, hashpw, checkpw
+from managers.password_manager import get_passwords
 
 """
-Provides methods for hashing passwords.
+Provides methods for hashing passwords. The hashing itself runs in the
+shared pool of worker processes.
 
 AUTHOR: Arthur Riechert
-VERSION: 1.1.0
+VERSION: 1.2.0
 """
 
 """
@@ -15,12 +16,13 @@ Args:
 
 Returns:
     bytes: The hashed password.
+
+Raises:
+    OverloadedException: If too many passwords are already being hashed.
 """
 def hash_password(password: str) -> bytes:
 
-    salt: bytes = gensalt()
-
-    hashed_password: bytes = hashpw(password.encode('utf-8'), salt)
+    hashed_password: bytes = get_passwords().hash(password)
 
     return hashed_password
 
@@ -33,7 +35,24 @@ Args:
 
 Returns:
     bool: Whether or not the two passwords are equal.
+
+Raises:
+    OverloadedException: If too many passwords are already being checked.
 """
 def check_password(entered_password: str, hashed_password: bytes) -> bool:
 
-    return checkpw(entered_password.encode('utf-8'), hashed_password)
\ No newline at end of file
+    return get_passwords().check(entered_password, hashed_password)
+
+"""
+Checks if a password was hashed with a different work factor than the
+one currently configured.
+
+Args:
+    hashed_password (bytes): A string bytes representing a hashed password.
+
+Returns:
+    bool: Whether or not it should be hashed again.
+"""
+def needs_rehash(hashed_password: bytes) -> bool:
+
+    return get_passwords().needs_rehash(hashed_password)